@@ -2,6 +2,7 @@ from collections import OrderedDict
 from ocgis.interface.base.crs import CFWGS84
 from ocgis import constants
 from ocgis.util.logging_ocgis import ocgis_lh
+import numpy as np
 
 
 class SpatialCollection(OrderedDict):
@@ -20,7 +21,18 @@ class SpatialCollection(OrderedDict):
         self._uid_ctr_field = 1
 
         super(SpatialCollection,self).__init__()
-        
+
+    def __reduce__(self):
+        ## the ordered dictionary reduction passes the items to the constructor
+        ## which does not accept them. items are instead set following
+        ## construction. this is required to return collections from worker
+        ## processes.
+        items = [(k,self[k]) for k in self]
+        inst_dict = vars(self).copy()
+        for k in vars(OrderedDict()):
+            inst_dict.pop(k,None)
+        return(self.__class__,(),inst_dict,None,iter(items))
+
     @property
     def _archetype_field(self):
         ukey = self.keys()[0]
@@ -62,6 +74,42 @@ class SpatialCollection(OrderedDict):
                         yld_row = {k.upper():v for k,v in yld_row.iteritems()}
                     yield(row['geom'],yld_row)
                     
+    def get_iter_batch(self,use_upper_keys=False,conversion_map=None,batch_size=None,formatter=None):
+        '''
+        Columnar alternative to :meth:`~ocgis.api.collection.SpatialCollection.get_iter_dict`.
+        
+        :param bool use_upper_keys: If `True`, batch keys are upper-cased.
+        :param dict conversion_map: Maps header names to functions applied to each
+         value in the header's column.
+        :param int batch_size: See :meth:`~ocgis.interface.base.field.Field.get_iter_batch`.
+        :param formatter: See :meth:`~ocgis.interface.base.field.Field.get_iter_batch`.
+        :type formatter: function
+        :returns: Tuples of a geometry array, an array indexing the geometry array
+         for each row, and a dictionary mapping headers to arrays of row values.
+        :rtype: tuple
+        '''
+        r_headers = self.headers
+        use_conversion = False if conversion_map is None else True
+        for ugid,field_dict in self.iteritems():
+            for field in field_dict.itervalues():
+                if formatter is None:
+                    ugid_column = np.array([ugid])
+                else:
+                    ugid_column = formatter(np.array([ugid]))
+                for geoms,batch in field.get_iter_batch(value_keys=self.value_keys,batch_size=batch_size,
+                                                        formatter=formatter):
+                    geom_index = batch['geom_index']
+                    batch['ugid'] = np.repeat(ugid_column,geom_index.shape[0])
+                    yld_batch = {k:batch[k] for k in r_headers}
+                    if use_conversion:
+                        for k,v in conversion_map.iteritems():
+                            converted = np.empty(geom_index.shape[0],dtype=object)
+                            converted[:] = [v(element) for element in yld_batch[k]]
+                            yld_batch[k] = converted
+                    if use_upper_keys:
+                        yld_batch = {k.upper():v for k,v in yld_batch.iteritems()}
+                    yield(geoms,geom_index,yld_batch)
+                    
     def get_iter_elements(self):
         for ugid,fields in self.iteritems():
             for field_alias,field in fields.iteritems():
@@ -109,7 +109,7 @@ class OcgInterpreter(Interpreter):
             else:
                 ## the operations object performs subsetting and calculations
                 ocgis_lh('initializing subset',interpreter_log,level=logging.DEBUG)
-                so = SubsetOperation(self.ops,serial=env.SERIAL,nprocs=env.CORES)
+                so = SubsetOperation(self.ops,serial=env.SERIAL,nprocs=env.CORES,ordered=env.ORDERED)
                 ## if there is no grouping on the output files, a singe converter is
                 ## is needed
                 if self.ops.output_grouping is None:
@@ -0,0 +1,293 @@
+from collections import OrderedDict
+import numpy as np
+import netCDF4 as nc
+from ocgis import env
+from ocgis.util.helpers import get_file_signature, get_cache_path, get_cached
+
+
+## file indices keyed by uri tuple. entries are replaced when a file signature
+## changes.
+_file_index_cache = {}
+
+
+class AggregatedDataset(object):
+    '''
+    A read-only virtual aggregation of netCDF files along the unlimited dimension
+    of the first file. This mirrors :class:`netCDF4.MFDataset` but the member
+    files are opened when their values are first read. Only the files overlapping
+    a read are opened. Metadata is read from the first file. Member files may
+    have any netCDF format.
+
+    :param uris: A sequence of dataset URIs ordered along the aggregation dimension.
+    :type uris: sequence of str
+    '''
+
+    ## attributes of the aggregation that are never read from the first file
+    _attrs_internal = ('uris','_datasets','index','offsets')
+
+    def __init__(self,uris):
+        self.uris = list(uris)
+        self._datasets = OrderedDict()
+        self.index = get_file_index(self.uris)
+        self.offsets = np.cumsum([0]+self.index['lengths'])
+
+        master = self._get_dataset_(0)
+        self.file_format = master.file_format
+        self.dimensions = OrderedDict()
+        for key,value in master.dimensions.iteritems():
+            if key == self.index['dimension']:
+                length = int(self.offsets[-1])
+            else:
+                length = len(value)
+            self.dimensions[key] = AggregatedDimension(key,length,value.isunlimited())
+        self.variables = OrderedDict()
+        for key,value in master.variables.iteritems():
+            self.variables[key] = AggregatedVariable(self,value)
+
+    def __getattr__(self,name):
+        ## global attributes are read from the first file. attribute names may
+        ## start with an underscore (i.e. "_CoordSysBuilder").
+        if name in self._attrs_internal or name.startswith('__'):
+            raise(AttributeError(name))
+        return(getattr(self._get_dataset_(0),name))
+
+    def getncattr(self,name):
+        return(self._get_dataset_(0).getncattr(name))
+
+    def ncattrs(self):
+        return(self._get_dataset_(0).ncattrs())
+
+    def close(self):
+        for ds in self._datasets.itervalues():
+            ds.close()
+        self._datasets.clear()
+
+    def _get_dataset_(self,file_idx):
+        try:
+            ret = self._datasets[file_idx]
+        except KeyError:
+            ret = nc.Dataset(self.uris[file_idx],'r')
+            self._datasets[file_idx] = ret
+        return(ret)
+
+
+class AggregatedDimension(object):
+
+    def __init__(self,name,length,unlimited):
+        self._name = name
+        self._length = length
+        self._unlimited = unlimited
+
+    def __len__(self):
+        return(self._length)
+
+    def isunlimited(self):
+        return(self._unlimited)
+
+
+class AggregatedVariable(object):
+    '''
+    A variable of an :class:`~ocgis.api.request.aggregation.AggregatedDataset`.
+    Indices along the aggregation dimension are mapped to (file, local index)
+    pairs and only the files containing selected indices are read. Coordinate
+    values along the aggregation dimension are read from the file index.
+
+    :type dataset: :class:`~ocgis.api.request.aggregation.AggregatedDataset`
+    :param variable: The variable in the first file.
+    :type variable: :class:`netCDF4.Variable`
+    '''
+
+    ## attributes of the aggregated variable that are never read from the first
+    ## file
+    _attrs_internal = ('_dataset','_variable','_name','_axis')
+
+    def __init__(self,dataset,variable):
+        self._dataset = dataset
+        self._variable = variable
+        self._name = variable._name
+        self.dimensions = variable.dimensions
+        self.dtype = variable.dtype
+        try:
+            self._axis = self.dimensions.index(dataset.index['dimension'])
+        except ValueError:
+            self._axis = None
+        self.shape = tuple([len(dataset.dimensions[d]) for d in self.dimensions])
+        self.ndim = len(self.shape)
+
+    def __getattr__(self,name):
+        ## variable attributes are read from the first file. attribute names may
+        ## start with an underscore (i.e. "_FillValue").
+        if name in self._attrs_internal or name.startswith('__'):
+            raise(AttributeError(name))
+        return(getattr(self._variable,name))
+
+    def getncattr(self,name):
+        return(self._variable.getncattr(name))
+
+    def ncattrs(self):
+        return(self._variable.ncattrs())
+
+    def __len__(self):
+        return(self.shape[0])
+
+    def __getitem__(self,idx):
+        if self._axis is None:
+            return(self._variable[idx])
+
+        if isinstance(idx,(tuple,list)):
+            idx = list(idx)
+        else:
+            idx = [idx]
+        idx += [slice(None)]*(self.ndim-len(idx))
+
+        ## the global indices along the aggregation dimension
+        length = self.shape[self._axis]
+        select = idx[self._axis]
+        is_scalar = isinstance(select,(int,long,np.integer))
+        if is_scalar:
+            global_idx = np.array([select])
+        elif isinstance(select,slice):
+            global_idx = np.arange(*select.indices(length))
+        else:
+            global_idx = np.asarray(select)
+            if global_idx.dtype == bool:
+                global_idx = np.where(global_idx)[0]
+        global_idx = np.where(global_idx < 0,global_idx+length,global_idx)
+        if np.any(global_idx >= length) or np.any(global_idx < 0):
+            raise(IndexError('index out of range for aggregation dimension: {0}'.format(self._name)))
+
+        ## integer indices on other axes remove the axis from the returned value
+        axis = self._axis-sum([isinstance(i,(int,long,np.integer)) for i in idx[:self._axis]])
+
+        coordinates = self._dataset.index['coordinates'].get(self._name)
+        if coordinates is not None:
+            ret = coordinates[global_idx]
+            ## apply the remaining indices one axis at a time matching netCDF
+            ## orthogonal indexing. the last axis is first so integer indices
+            ## do not shift the preceding axes.
+            for ii in range(self.ndim-1,-1,-1):
+                if ii == self._axis:
+                    continue
+                ret = ret[tuple([slice(None)]*ii+[idx[ii]])]
+        else:
+            ret = self._get_file_values_(idx,global_idx,axis)
+
+        if is_scalar:
+            ret = ret[tuple([slice(None)]*axis+[0])]
+        return(ret)
+
+    def _get_file_values_(self,idx,global_idx,axis):
+        ## read from each file in runs of indices falling in the same file
+        offsets = self._dataset.offsets
+        file_idx = np.searchsorted(offsets,global_idx,side='right')-1
+        local_idx = global_idx-offsets[file_idx]
+        if global_idx.shape[0] == 0:
+            runs = [(0,slice(0,0))]
+        else:
+            breaks = np.where(np.diff(file_idx) != 0)[0]+1
+            runs = []
+            for run in np.split(np.arange(global_idx.shape[0]),breaks):
+                local = local_idx[run]
+                if np.all(np.diff(local) == 1):
+                    local = slice(int(local[0]),int(local[-1])+1)
+                runs.append((file_idx[run[0]],local))
+
+        parts = []
+        for file_idx,local in runs:
+            file_slc = list(idx)
+            file_slc[self._axis] = local
+            variable = self._dataset._get_dataset_(file_idx).variables[self._name]
+            parts.append(variable[tuple(file_slc)])
+        if len(parts) == 1:
+            ret = parts[0]
+        elif any([isinstance(p,np.ma.MaskedArray) for p in parts]):
+            ret = np.ma.concatenate(parts,axis=axis)
+        else:
+            ret = np.concatenate(parts,axis=axis)
+        return(ret)
+
+
+def get_file_index(uris):
+    '''
+    Return the aggregation dimension name, the length of each file along the
+    dimension, and the values of coordinate and bounds variables along the
+    dimension. Every file is opened once to build the index. Indices are
+    cached in memory and in :attr:`ocgis.env.DIR_METADATA` if it is set. The
+    index is rebuilt if a file's modification time or size changes.
+
+    :param uris: See :class:`~ocgis.api.request.aggregation.AggregatedDataset`.
+    :rtype: dict
+    '''
+    key = tuple(uris)
+    signature = [get_file_signature(uri) for uri in uris]
+    try:
+        ret = _file_index_cache[key]
+        if ret['signature'] != signature or None in signature:
+            raise(KeyError)
+        return(ret)
+    except KeyError:
+        pass
+
+    def _build_():
+        ret = _get_file_index_(uris)
+        ret['signature'] = signature
+        return(ret)
+
+    ret = get_cached(_get_file_index_cache_path_(uris,signature),_build_)
+    _file_index_cache[key] = ret
+    return(ret)
+
+def _get_file_index_(uris):
+    ret = {'dimension':None,'lengths':[],'coordinates':{}}
+    parts = OrderedDict()
+    for uri in uris:
+        ds = nc.Dataset(uri,'r')
+        try:
+            if ret['dimension'] is None:
+                ret['dimension'] = _get_aggregation_dimension_(ds)
+                names = _get_coordinate_names_(ds,ret['dimension'])
+                for name in names:
+                    parts[name] = []
+            ret['lengths'].append(len(ds.dimensions[ret['dimension']]))
+            for name,values in parts.iteritems():
+                values.append(ds.variables[name][:])
+        finally:
+            ds.close()
+    for name,values in parts.iteritems():
+        if any([isinstance(v,np.ma.MaskedArray) for v in values]):
+            ret['coordinates'][name] = np.ma.concatenate(values)
+        else:
+            ret['coordinates'][name] = np.concatenate(values)
+    return(ret)
+
+def _get_aggregation_dimension_(ds):
+    ## the unlimited dimension as with netCDF4.MFDataset falling back to a "time"
+    ## dimension
+    for key,value in ds.dimensions.iteritems():
+        if value.isunlimited():
+            return(key)
+    if 'time' in ds.dimensions:
+        return('time')
+    raise(ValueError('No unlimited or "time" dimension found for aggregation.'))
+
+def _get_coordinate_names_(ds,dimension):
+    ## coordinate variables on the aggregation dimension and their bounds
+    ret = []
+    for key,value in ds.variables.iteritems():
+        if value.dimensions == (dimension,) and key == dimension:
+            ret.append(key)
+            for attr in ('bounds','climatology'):
+                try:
+                    bounds = getattr(value,attr)
+                except AttributeError:
+                    continue
+                if bounds in ds.variables and ds.variables[bounds].dimensions[0] == dimension:
+                    ret.append(bounds)
+    return(ret)
+
+def _get_file_index_cache_path_(uris,signature):
+    if None in signature:
+        ret = None
+    else:
+        ret = get_cache_path(env.DIR_METADATA,'ocgis_file_index',zip(uris,signature))
+    return(ret)
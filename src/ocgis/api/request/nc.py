@@ -5,7 +5,7 @@ import inspect
 import os
 from ocgis import env, constants
 from ocgis.util.helpers import locate, validate_time_subset, itersubclasses,\
-    assert_raise
+    assert_raise, get_file_signature, get_cache_path, get_cached
 from datetime import datetime
 import netCDF4 as nc
 from ocgis.interface.metadata import NcMetadata
@@ -21,6 +21,8 @@ from ocgis.interface.nc.dimension import NcVectorDimension
 from ocgis.interface.nc.field import NcField
 from ocgis.interface.base.variable import Variable, VariableCollection
 from ocgis.util.inspect import Inspect
+from collections import OrderedDict
+from ocgis.api.request.aggregation import AggregatedDataset
 
 
 class NcRequestDataset(object):
@@ -61,34 +63,61 @@ class NcRequestDataset(object):
         self.__source_metadata = None
         
     def _open_(self):
-        try:
-            ret = nc.Dataset(self.uri,'r')
-        except TypeError:
-            ret = nc.MFDataset(self.uri)
+        if env.MAX_OPEN_DATASETS > 0:
+            ret = get_pooled_dataset(self._uri,env.MAX_OPEN_DATASETS)
+        else:
+            ret = open_dataset(self._uri)
         return(ret)
+    
+    def _close_(self,ds):
+        ## pooled datasets remain open until evicted from the pool
+        if env.MAX_OPEN_DATASETS <= 0:
+            ds.close()
             
     @property
     def _source_metadata(self):
         if self.__source_metadata is None:
-            ds = self._open_()
-            try:
-                self.__source_metadata = NcMetadata(ds)
-                var = ds.variables[self.variable]
-                if self.dimension_map is None:
-                    self.__source_metadata['dim_map'] = get_dimension_map(ds,var,self._source_metadata)
-                else:
-                    for k,v in self.dimension_map.iteritems():
-                        try:
-                            variable_name = ds.variables.get(v)._name
-                        except AttributeError:
-                            variable_name = None
-                        self.dimension_map[k] = {'variable':variable_name,
-                                                 'dimension':v,
-                                                 'pos':var.dimensions.index(v)}
-                        self.__source_metadata['dim_map'] = self.dimension_map
-            finally:
-                ds.close()
+            metadata = get_cached(self._get_metadata_cache_path_(),self._get_source_metadata_)
+            if self.dimension_map is not None:
+                self.dimension_map = metadata['dim_map']
+            self.__source_metadata = metadata
         return(self.__source_metadata)
+    
+    def _get_metadata_cache_path_(self):
+        ## the cached metadata file path if env.DIR_METADATA is set. the key
+        ## includes the cache format version and the modification time and size
+        ## of each file. remote datasets are not cached.
+        if env.DIR_METADATA is None:
+            ret = None
+        else:
+            signature = [get_file_signature(uri) for uri in self._uri]
+            if None in signature:
+                ret = None
+            else:
+                key = (zip(self._uri,signature),self.variable,sorted((self.dimension_map or {}).items()))
+                ret = get_cache_path(env.DIR_METADATA,'ocgis_metadata',key)
+        return(ret)
+    
+    def _get_source_metadata_(self):
+        ds = self._open_()
+        try:
+            ret = NcMetadata(ds)
+            var = ds.variables[self.variable]
+            if self.dimension_map is None:
+                ret['dim_map'] = get_dimension_map(ds,var,ret)
+            else:
+                for k,v in self.dimension_map.iteritems():
+                    try:
+                        variable_name = ds.variables.get(v)._name
+                    except AttributeError:
+                        variable_name = None
+                    self.dimension_map[k] = {'variable':variable_name,
+                                             'dimension':v,
+                                             'pos':var.dimensions.index(v)}
+                    ret['dim_map'] = self.dimension_map
+        finally:
+            self._close_(ds)
+        return(ret)
         
     def get(self,format_time=True):
         
@@ -388,47 +417,90 @@ class NcRequestDataset(object):
         return(rows)
     
 
+## open datasets keyed by uri tuple with the least recently used first. the
+## process identifier is stored to avoid sharing handles with forked processes.
+_dataset_pool = OrderedDict()
+_dataset_pool_pid = [None]
+
+def open_dataset(uris):
+    '''
+    :param uris: A sequence of dataset URIs. A virtual aggregation of the files
+     is opened if there is more than one URI.
+    :type uris: sequence of str
+    :rtype: :class:`netCDF4.Dataset` or :class:`ocgis.api.request.aggregation.AggregatedDataset`
+    '''
+    if len(uris) == 1:
+        ret = nc.Dataset(uris[0],'r')
+    else:
+        ret = AggregatedDataset(uris)
+    return(ret)
+
+def get_pooled_dataset(uris,max_open):
+    '''
+    Return an open dataset from the process-local pool opening the dataset if
+    it is not present or its files have changed. The least recently used datasets
+    are closed when more than ``max_open`` datasets are open. Returned datasets
+    should not be closed.
+    
+    :param uris: See :func:`~ocgis.api.request.nc.open_dataset`.
+    :param int max_open: The maximum number of open datasets to keep in the pool.
+    :rtype: See :func:`~ocgis.api.request.nc.open_dataset`.
+    '''
+    pid = os.getpid()
+    if _dataset_pool_pid[0] != pid:
+        ## handles inherited from a parent process are dropped without closing
+        _dataset_pool.clear()
+        _dataset_pool_pid[0] = pid
+    
+    key = tuple(uris)
+    signature = [get_file_signature(uri) for uri in uris]
+    try:
+        ds,pooled_signature = _dataset_pool.pop(key)
+        if pooled_signature != signature:
+            ds.close()
+            raise(KeyError)
+    except KeyError:
+        ds = open_dataset(uris)
+    _dataset_pool[key] = (ds,signature)
+    
+    while len(_dataset_pool) > max_open:
+        _dataset_pool.popitem(last=False)[1][0].close()
+    
+    return(ds)
+
+def close_pooled_datasets():
+    '''Close all datasets in the process-local pool.'''
+    
+    if _dataset_pool_pid[0] == os.getpid():
+        for ds,_ in _dataset_pool.itervalues():
+            ds.close()
+    _dataset_pool.clear()
+
+
+## transformed rotated pole coordinates with the least recently added first
+_rotated_pole_cache = OrderedDict()
+
 def get_rotated_pole_spatial_grid_dimension(crs,grid):
-        import csv
-        import itertools
-        import subprocess
-        import tempfile
-        class ProjDialect(csv.excel):
-            lineterminator = '\n'
-            delimiter = '\t'
-        f = tempfile.NamedTemporaryFile()
-        writer = csv.writer(f,dialect=ProjDialect)
+        '''
+        Transform the rotated pole coordinates of a grid to WGS84. Transformed
+        coordinates are cached by the rotated pole parameters and the coordinate
+        values.
+        
+        :type crs: :class:`ocgis.interface.base.crs.CFRotatedPole`
+        :type grid: :class:`ocgis.interface.base.dimension.spatial.SpatialGridDimension`
+        :rtype: :class:`ocgis.interface.base.dimension.spatial.SpatialGridDimension`
+        '''
         _row = grid.row.value
         _col = grid.col.value
-        shp = (_row.shape[0],_col.shape[0])
-        uid = np.arange(1,(shp[0]*shp[1])+1,dtype=int).reshape(*shp)
-        uid = np.ma.array(data=uid,mask=False)
-        for row_idx,col_idx in itertools.product(range(_row.shape[0]),range(_col.shape[0])):
-            writer.writerow([_col[col_idx],_row[row_idx]])
-        f.flush()
-        cmd = crs._trans_proj.split(' ')
-        cmd.append(f.name)
-        cmd = ['proj','-f','"%.6f"','-m','57.2957795130823'] + cmd
-        capture = subprocess.check_output(cmd)
-        f.close()
-        coords = capture.split('\n')
-        new_coords = []
-        for ii,coord in enumerate(coords):
-            coord = coord.replace('"','')
-            coord = coord.split('\t')
-            try:
-                coord = map(float,coord)
-            ## likely empty string
-            except ValueError:
-                if coord[0] == '':
-                    continue
-                else:
-                    raise
-            new_coords.append(coord)
-            
-        new_coords = np.array(new_coords)
-        new_row = new_coords[:,1].reshape(*shp)
-        new_col = new_coords[:,0].reshape(*shp)
+        key = (crs._trans_proj,_row.dtype.str,_row.tostring(),_col.dtype.str,_col.tostring())
+        try:
+            new_col,new_row = _rotated_pole_cache[key]
+        except KeyError:
+            col,row = np.meshgrid(_col,_row)
+            new_col,new_row = crs.get_transformed_coordinates(CFWGS84(),col,row)
+            _rotated_pole_cache[key] = (new_col,new_row)
+            while len(_rotated_pole_cache) > constants.rotated_pole_cache_size:
+                _rotated_pole_cache.popitem(last=False)
         
         new_grid = copy(grid)
         new_grid._row_src_idx = new_grid.row._src_idx
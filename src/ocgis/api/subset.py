@@ -11,17 +11,50 @@ from shapely.geometry.point import Point
 from ocgis.calc.base import AbstractMultivariateFunction,\
     AbstractKeyedOutputFunction
 from ocgis.util.helpers import project_shapely_geometry
+from ocgis.util.spatial.weights import get_spatial_weights
 from shapely.geometry.multipoint import MultiPoint
+from multiprocessing import Pool
+
+
+## the subset operation executed by worker processes. this is set before the
+## process pool is created so the forked workers inherit it and only work unit
+## indices need to be sent to the workers.
+_parallel_subset_operation = None
+
+
+def _process_subset_unit_(idx):
+    ## process the work unit with index idx in a worker process returning a list
+    ## of collections
+    so = _parallel_subset_operation
+    rds,field,gd = so._parallel_units[idx]
+    ret = [so._process_collection_(coll) for coll in so._process_geometries_(rds,geoms=[gd],field=field)]
+    return(ret)
 
 
 class SubsetOperation(object):
-    
-    def __init__(self,ops,serial=True,nprocs=1):
+    '''
+    :param ops: The operations to execute.
+    :type ops: :class:`ocgis.OcgOperations`
+    :param serial: If `False`, process selection geometries in parallel using a
+     process pool.
+    :type serial: bool
+    :param nprocs: The number of worker processes to use in the parallel case.
+    :type nprocs: int
+    :param ordered: If `True`, parallel collections are returned in the order of
+     the selection geometries. Otherwise, collections are returned as soon as
+     they are processed.
+    :type ordered: bool
+    '''
+
+    def __init__(self,ops,serial=True,nprocs=1,ordered=True):
         self.ops = ops
         self.serial = serial
         self.nprocs = nprocs
+        self.ordered = ordered
+
+        self._parallel_units = None
         
-        self._subset_log = ocgis_lh.get_logger('subset')
+        self._subset_log = ocgis_lh.get_logger('subset')
 
         ## create the calculation engine
         if self.ops.calc is None:
@@ -61,14 +94,168 @@ class SubsetOperation(object):
         if self.serial:
             for coll in self._iter_collections_():
                 yield(coll)
-        ## use a multiprocessing pool returning unordered geometries
+        ## use a multiprocessing pool returning ordered or unordered collections
         ## for the parallel case
         else:
-            raise(ocgis_lh(exc=NotImplementedError('multiprocessing is not available')))
+            for coll in self._iter_collections_parallel_():
+                yield(coll)
 
-    def _process_geometries_(self,rds):
-        ocgis_lh(msg='entering _process_geometries_',logger=self._subset_log,level=logging.DEBUG)
-        
+    def _get_request_dataset_iterator_(self):
+        if self.cengine is None:
+            itr_rd = ([rd] for rd in self.ops.dataset)
+        else:
+            if self.cengine._check_calculation_members_(self.cengine.funcs,AbstractMultivariateFunction):
+                itr_rd = [[r for r in self.ops.dataset]]
+            else:
+                itr_rd = ([rd] for rd in self.ops.dataset)
+        return(itr_rd)
+
+    def _get_selection_iterator_(self):
+        ## slice always overrides geometry.
+        if self.ops.slice is not None:
+            itr = [{}]
+        else:
+            itr = [{}] if self.ops.geom is None else self.ops.geom
+        return(itr)
+
+    def _iter_collections_parallel_(self):
+        global _parallel_subset_operation
+
+        ## each work unit is a sequence of request datasets, their field, and a
+        ## single selection geometry. selection geometries are independent so
+        ## they may be processed in any order. fields are loaded once before the
+        ## workers are forked.
+        geoms = list(self._get_selection_iterator_())
+        headers,_ = self._get_headers_()
+        self._parallel_units = []
+        for rds in self._get_request_dataset_iterator_():
+            field,empty = self._get_field_(rds,headers)
+            ## empty time or level subsets are returned once by this process
+            if empty is not None:
+                yield(empty)
+                continue
+            self._parallel_units += [(rds,field,gd) for gd in geoms]
+
+        ocgis_lh('{0} work unit(s) to process using {1} process(es)'.format(len(self._parallel_units),self.nprocs),
+                 self._subset_log)
+
+        _parallel_subset_operation = self
+        pool = Pool(processes=self.nprocs)
+        try:
+            if self.ordered:
+                imap = pool.imap
+            else:
+                imap = pool.imap_unordered
+            for colls in imap(_process_subset_unit_,range(len(self._parallel_units))):
+                for coll in colls:
+                    ocgis_lh('subset yielding',self._subset_log,level=logging.DEBUG)
+                    yield(coll)
+        finally:
+            pool.terminate()
+            pool.join()
+            _parallel_subset_operation = None
+            self._parallel_units = None
+
+    def _process_collection_(self,coll):
+        ## if there are calculations, do those now and return a new type of collection
+        if self.cengine is not None:
+            ocgis_lh('performing computations',
+                     self._subset_log,
+                     alias=coll.items()[0][1].keys()[0],
+                     ugid=coll.keys()[0])
+            ## source fields are checked for all masked values following streamed
+            ## calculations
+            if self._get_check_masked_() and self._get_is_stream_calc_():
+                sources = [(ugid,alias,field) for ugid,dct in coll.iteritems()
+                           for alias,field in dct.iteritems() if field is not None]
+            else:
+                sources = []
+            coll = self.cengine.execute(coll)
+            for ugid,alias,field in sources:
+                masked = []
+                for variable in field.variables.itervalues():
+                    if variable._value is None and variable._streamed_all_masked is not None:
+                        masked.append(variable._streamed_all_masked)
+                    else:
+                        masked.append(variable.value.mask.all())
+                self._check_masked_(field,masked,alias,ugid)
+
+        ## conversion of groups.
+        if self.ops.output_grouping is not None:
+            raise(NotImplementedError)
+
+        return(coll)
+
+    def _get_field_(self,rds,headers):
+        '''
+        :param rds: The request datasets to load.
+        :type rds: sequence of :class:`ocgis.RequestDataset`
+        :param headers: The headers for an empty collection.
+        :returns: Tuple of the field and `None`. If a time or level subset is
+         empty and empty returns are allowed, `None` and an empty collection.
+        :rtype: tuple
+        '''
+        fields = []
+        for rd in rds:
+            try:
+                fields.append(rd.get(format_time=self.ops.format_time))
+            except EmptySubsetError as e:
+                if self.ops.allow_empty:
+                    ocgis_lh(msg='time or level subset empty but empty returns allowed',
+                             logger=self._subset_log,level=logging.WARN)
+                    coll = SpatialCollection(headers=headers)
+                    coll.add_field(1,None,rd.alias,None)
+                    return(None,coll)
+                else:
+                    ocgis_lh(exc=ExtentError(message=str(e)),alias=rd.alias,logger=self._subset_log)
+        field = fields[0]
+        if len(fields) > 1:
+            field.variables.add_variable(fields[1].variables.first())
+        return(field,None)
+    
+    def _check_masked_(self,sfield,masked,alias,ugid):
+        '''
+        :param sfield: The field to check.
+        :type sfield: :class:`ocgis.interface.base.field.Field`
+        :param masked: Sequence of booleans with a `True` value for each variable
+         with all values masked.
+        :raises: EmptyData, MaskedDataError
+        '''
+        for is_masked in masked:
+            if is_masked:
+                ## masked data may be okay depending on other opeartional
+                ## conditions.
+                if self.ops.snippet or self.ops.allow_empty or (self.ops.output_format == 'numpy' and self.ops.allow_empty):
+                    if self.ops.snippet:
+                        ocgis_lh('all masked data encountered but allowed for snippet',
+                                 self._subset_log,alias=alias,ugid=ugid,level=logging.WARN)
+                    if self.ops.allow_empty:
+                        ocgis_lh('all masked data encountered but empty returns allowed',
+                                 self._subset_log,alias=alias,ugid=ugid,level=logging.WARN)
+                    if self.ops.output_format == 'numpy':
+                        ocgis_lh('all masked data encountered but numpy data being returned allowed',
+                                 logger=self._subset_log,alias=alias,ugid=ugid,level=logging.WARN)
+                else:
+                    ## if the geometry is also masked, it is an empty spatial
+                    ## operation.
+                    if sfield.spatial.abstraction_geometry.value.mask.all():
+                        ocgis_lh(exc=EmptyData,logger=self._subset_log)
+                    ## if none of the other conditions are met, raise the masked data error
+                    else:
+                        ocgis_lh(logger=self._subset_log,exc=MaskedDataError(),alias=alias,ugid=ugid)
+    
+    def _get_check_masked_(self):
+        return(env.OPTIMIZE_FOR_CALC is False and self.ops.file_only is False)
+    
+    def _get_is_stream_calc_(self):
+        return(env.STREAM_CALC and self.cengine is not None)
+    
+    def _get_headers_(self):
+        '''
+        :returns: Tuple of the output headers and the value keys of a keyed
+         output function or `None`.
+        :rtype: tuple
+        '''
         ## select headers
         if self.ops.headers is not None:
             headers = self.ops.headers
@@ -98,36 +285,50 @@ class SubsetOperation(object):
                 value_keys = None
         else:
             value_keys = None
+        return(headers,value_keys)
+
+    def _process_geometries_(self,rds,geoms=None,field=None):
+        '''
+        :param rds: The request datasets to process.
+        :type rds: sequence of :class:`ocgis.RequestDataset`
+        :param geoms: The selection geometry dictionaries to process. If `None`,
+         use the selection geometries from the operations.
+        :type geoms: sequence of dict
+        :param field: The field loaded from the request datasets. If `None`, the
+         field is loaded.
+        :type field: :class:`ocgis.interface.base.field.Field`
+        '''
+
+        ocgis_lh(msg='entering _process_geometries_',logger=self._subset_log,level=logging.DEBUG)
+        
+        headers,value_keys = self._get_headers_()
                     
         alias = '_'.join([r.alias for r in rds])
         ocgis_lh('processing...',self._subset_log,alias=alias)
         ## return the field object
-        try:
-            field = [rd.get(format_time=self.ops.format_time) for rd in rds]
-            if len(field) > 1:
-                field[0].variables.add_variable(field[1].variables.first())
-            field = field[0]
-        except EmptySubsetError as e:
-            if self.ops.allow_empty:
-                ocgis_lh(msg='time or level subset empty but empty returns allowed',
-                         logger=self._subset_log,level=logging.WARN)
-                coll = SpatialCollection(headers=headers)
-                coll.add_field(1,None,rd.alias,None)
-                try:
-                    yield(coll)
-                finally:
-                    return
-            else:
-                ocgis_lh(exc=ExtentError(message=str(e)),alias=rd.alias,logger=self._subset_log)
+        if field is None:
+            field,empty = self._get_field_(rds,headers)
+            if empty is not None:
+                yield(empty)
+                return
                 
         ## set iterator based on presence of slice. slice always overrides geometry.
-        if self.ops.slice is not None:
-            itr = [{}]
+        if geoms is None:
+            itr = self._get_selection_iterator_()
         else:
-            itr = [{}] if self.ops.geom is None else self.ops.geom
+            itr = geoms
+            
+        ## aggregation with many selection geometries may use a weight matrix
+        ## computed once for all geometries. the field's values are then
+        ## aggregated for all geometries in a single pass.
+        if self._get_use_spatial_weights_(field):
+            itr = list(itr)
+            weighted_geoms,weighted = self._get_weighted_aggregation_(field,itr,alias)
+        else:
+            weighted = None
                 
         ## loop over the iterator
-        for gd in itr:
+        for ii,gd in enumerate(itr):
             ## initialize the collection object to store the subsetted data. if
             ## the output CRS differs from the field's CRS, adjust accordingly 
             ## when initilizing.
@@ -144,16 +345,7 @@ class SubsetOperation(object):
             
             crs = gd.get('crs')
             
-            if 'properties' in gd and 'UGID' in gd['properties']:
-                ugid = gd['properties']['UGID']
-            else:
-                ## try to get lowercase ugid in case the shapefile is not perfectly
-                ## formed. however, if there is no geometry accept the error and
-                ## use the default geometry identifier.
-                if len(gd) == 0:
-                    ugid = 1
-                else:
-                    ugid = gd['properties']['ugid']
+            ugid = self._get_ugid_(gd)
                     
             ocgis_lh('processing',self._subset_log,level=logging.DEBUG,alias=alias,ugid=ugid)
             
@@ -174,23 +366,20 @@ class SubsetOperation(object):
             elif self.ops.slice is not None:
                 field = field.__getitem__(self.ops.slice)
                 
-            ## see if the selection crs matches the field's crs
-            if crs is not None and crs != field.spatial.crs:
-                geom = project_shapely_geometry(geom,crs.sr,field.spatial.crs.sr)
-                crs = field.spatial.crs
-            ## if the geometry is a point, we need to buffer it...
-            if type(geom) in [Point,MultiPoint]:
-                ocgis_lh(logger=self._subset_log,msg='buffering point geometry',level=logging.DEBUG)
-                geom = geom.buffer(self.ops.search_radius_mult*field.spatial.grid.resolution)
-            ## unwrap the data if it is geographic and 360
-            if geom is not None and crs == CFWGS84():
-                if CFWGS84.get_is_360(field.spatial):
-                    ocgis_lh('unwrapping selection geometry',self._subset_log,alias=alias,ugid=ugid)
-                    geom = Wrapper().unwrap(geom)
+            ## project, buffer, and unwrap the selection geometry to match the
+            ## field
+            if weighted is None:
+                geom,crs = self._get_selection_geometry_(field,geom,crs,alias,ugid)
+            else:
+                geom,crs = weighted_geoms[ii]
             ## perform the spatial operation
             if geom is not None:
                 try:
-                    if self.ops.spatial_operation == 'intersects':
+                    if weighted is not None:
+                        sfield = weighted.next()
+                        if sfield is None:
+                            ocgis_lh(exc=EmptySubsetError(field.spatial.name),logger=self._subset_log)
+                    elif self.ops.spatial_operation == 'intersects':
                         sfield = field.get_intersects(geom)
                     elif self.ops.spatial_operation == 'clip':
                         sfield = field.get_clip(geom)
@@ -207,8 +396,8 @@ class SubsetOperation(object):
             
             ## if empty returns are allowed, there be an empty field
             if sfield is not None:
-                ## aggregate if requested
-                if self.ops.aggregate:
+                ## aggregate if requested. weighted fields are already aggregated.
+                if self.ops.aggregate and weighted is None:
                     sfield = sfield.get_spatially_aggregated(new_spatial_uid=ugid)
                 
                 ## wrap the returned data.
@@ -218,30 +407,11 @@ class SubsetOperation(object):
                             ocgis_lh('wrapping output geometries',self._subset_log,alias=alias,ugid=ugid)
                             sfield.spatial.crs.wrap(sfield.spatial)
                             
-                ## check for all masked values
-                if env.OPTIMIZE_FOR_CALC is False and self.ops.file_only is False:
-                    for variable in sfield.variables.itervalues():
-                        if variable.value.mask.all():
-                            ## masked data may be okay depending on other opeartional
-                            ## conditions.
-                            if self.ops.snippet or self.ops.allow_empty or (self.ops.output_format == 'numpy' and self.ops.allow_empty):
-                                if self.ops.snippet:
-                                    ocgis_lh('all masked data encountered but allowed for snippet',
-                                             self._subset_log,alias=alias,ugid=ugid,level=logging.WARN)
-                                if self.ops.allow_empty:
-                                    ocgis_lh('all masked data encountered but empty returns allowed',
-                                             self._subset_log,alias=alias,ugid=ugid,level=logging.WARN)
-                                if self.ops.output_format == 'numpy':
-                                    ocgis_lh('all masked data encountered but numpy data being returned allowed',
-                                             logger=self._subset_log,alias=alias,ugid=ugid,level=logging.WARN)
-                            else:
-                                ## if the geometry is also masked, it is an empty spatial
-                                ## operation.
-                                if sfield.spatial.abstraction_geometry.value.mask.all():
-                                    ocgis_lh(exc=EmptyData,logger=self._subset_log)
-                                ## if none of the other conditions are met, raise the masked data error
-                                else:
-                                    ocgis_lh(logger=self._subset_log,exc=MaskedDataError(),alias=alias,ugid=ugid)
+                ## check for all masked values. streamed calculations do not load
+                ## the complete values and are checked following the calculation.
+                if self._get_check_masked_() and not self._get_is_stream_calc_():
+                    masked = (variable.value.mask.all() for variable in sfield.variables.itervalues())
+                    self._check_masked_(sfield,masked,alias,ugid)
             
             ## update the coordinate system of the data output
             if self.ops.output_crs is not None:
@@ -262,31 +432,82 @@ class SubsetOperation(object):
             
             yield(coll)
     
+    def _get_selection_geometry_(self,field,geom,crs,alias,ugid):
+        '''
+        :returns: Tuple of the selection geometry and its coordinate system after
+         matching the selection geometry to the field.
+        :rtype: tuple
+        '''
+        ## see if the selection crs matches the field's crs
+        if crs is not None and crs != field.spatial.crs:
+            geom = project_shapely_geometry(geom,crs.sr,field.spatial.crs.sr)
+            crs = field.spatial.crs
+        ## if the geometry is a point, we need to buffer it...
+        if type(geom) in [Point,MultiPoint]:
+            ocgis_lh(logger=self._subset_log,msg='buffering point geometry',level=logging.DEBUG)
+            geom = geom.buffer(self.ops.search_radius_mult*field.spatial.grid.resolution)
+        ## unwrap the data if it is geographic and 360
+        if geom is not None and crs == CFWGS84():
+            if CFWGS84.get_is_360(field.spatial):
+                ocgis_lh('unwrapping selection geometry',self._subset_log,alias=alias,ugid=ugid)
+                geom = Wrapper().unwrap(geom)
+        return(geom,crs)
+    
+    def _get_ugid_(self,gd):
+        if 'properties' in gd and 'UGID' in gd['properties']:
+            ugid = gd['properties']['UGID']
+        else:
+            ## try to get lowercase ugid in case the shapefile is not perfectly
+            ## formed. however, if there is no geometry accept the error and
+            ## use the default geometry identifier.
+            if len(gd) == 0:
+                ugid = 1
+            else:
+                ugid = gd['properties']['ugid']
+        return(ugid)
+    
+    def _get_use_spatial_weights_(self,field):
+        '''
+        :returns: `True` if selection geometries should be aggregated using a
+         weight matrix.
+        :rtype: bool
+        '''
+        ret = False
+        if env.USE_SPATIAL_WEIGHTS and self.ops.aggregate and self.ops.geom is not None:
+            if self.ops.slice is None and not self.ops.snippet:
+                if self.ops.spatial_operation in ('intersects','clip'):
+                    if field.spatial.grid is not None and field.spatial.grid.corners is not None:
+                        ret = True
+        return(ret)
+    
+    def _get_weighted_aggregation_(self,field,itr,alias):
+        '''
+        :returns: Tuple of the matched selection geometries and an iterator over
+         the aggregated fields. Both are ordered by the selection geometries.
+        :rtype: tuple
+        '''
+        geoms = []
+        ugids = []
+        for gd in itr:
+            ugid = self._get_ugid_(gd)
+            geoms.append(self._get_selection_geometry_(field,gd.get('geom'),gd.get('crs'),alias,ugid))
+            ugids.append(ugid)
+        polygons = [geom for geom,crs in geoms]
+        
+        ocgis_lh('computing spatial weights for {0} selection geometries'.format(len(polygons)),
+                 self._subset_log,alias=alias)
+        clip = self.ops.spatial_operation == 'clip'
+        weights = get_spatial_weights(field.spatial,polygons,clip=clip,cache_dir=env.DIR_WEIGHTS)
+        clip_polygons = polygons if clip else None
+        ret = field.iter_spatially_aggregated(weights,ugids,clip_polygons=clip_polygons)
+        return(geoms,ret)
+    
     def _iter_collections_(self):
         
         ocgis_lh('{0} request dataset(s) to process'.format(len(self.ops.dataset)),'conv._iter_collections_')
         
-        if self.cengine is None:
-            itr_rd = ([rd] for rd in self.ops.dataset)
-        else:
-            if self.cengine._check_calculation_members_(self.cengine.funcs,AbstractMultivariateFunction):
-                itr_rd = [[r for r in self.ops.dataset]]
-            else:
-                itr_rd = ([rd] for rd in self.ops.dataset)
-        
-        for rds in itr_rd:
+        for rds in self._get_request_dataset_iterator_():
             for coll in self._process_geometries_(rds):
-                ## if there are calculations, do those now and return a new type of collection
-                if self.cengine is not None:
-                    ocgis_lh('performing computations',
-                             self._subset_log,
-                             alias=coll.items()[0][1].keys()[0],
-                             ugid=coll.keys()[0])
-                    coll = self.cengine.execute(coll)
-                
-                ## conversion of groups.
-                if self.ops.output_grouping is not None:
-                    raise(NotImplementedError)
-                else:
-                    ocgis_lh('subset yielding',self._subset_log,level=logging.DEBUG)
-                    yield(coll)
+                coll = self._process_collection_(coll)
+                ocgis_lh('subset yielding',self._subset_log,level=logging.DEBUG)
+                yield(coll)
\ No newline at end of file
@@ -1,12 +1,14 @@
 import numpy as np
 import abc
 import itertools
+from copy import copy
 from ocgis.interface.base.variable import DerivedVariable, VariableCollection
 from ocgis.util.helpers import get_default_or_apply
 from ocgis.util.logging_ocgis import ocgis_lh
-from ocgis import constants
+from ocgis import constants, env
 import logging
 from ocgis.exc import SampleSizeNotImplemented, DefinitionValidationError
+from ocgis.calc.segment import get_segment_count
 
 
 class AbstractFunction(object):
@@ -166,7 +168,12 @@ class AbstractFunction(object):
     def _get_parms_(self):
         return(self.parms)
     
-    def _get_temporal_agg_fill_(self,value,f=None,parms=None,shp_fill=None):
+    def _get_temporal_agg_fill_(self,value,f=None,parms=None,shp_fill=None,get_block=None):
+        ## values are read for each temporal group if a block function is provided.
+        ## the first block provides the data type.
+        if get_block is not None:
+            value = get_block(self.tgd.dgroups[0])
+        
         ## if a default data type was provided at initialization, use this value
         ## otherwise use the data type from the input value.
         dtype = self.dtype or value.dtype
@@ -195,45 +202,54 @@ class AbstractFunction(object):
         ## choose the constructor parms or those passed to the method directly.
         parms = parms or self.parms
         
-        for ir,it,il in itertools.product(*(range(s) for s in fill.shape[0:3])):
+        for it in range(fill.shape[1]):
             
             ## reference for the current iteration group used by some computations
             self._curr_group = self.tgd.dgroups[it]
             
-            ## subset the values by the current temporal group
-            values = value[ir,self._curr_group,il,:,:]
-            ## only 3-d data should be sent to the temporal aggregation method
-            assert(len(values.shape) == 3)
-            ## execute the temporal aggregation or calculation
-            cc = f(values,**parms)
-            
-            ## compute the sample size of the computation if requested
-            if self.calc_sample_size:
-                sample_size = self.get_sample_size(values)
-                assert(len(sample_size.shape) == 2)
-                sample_size = sample_size.reshape(1,1,1,sample_size.shape[0],sample_size.shape[1])
+            ## a block contains only the time steps of the current group
+            if get_block is None:
+                block,group = value,self._curr_group
             else:
-                sample_size = None
-                            
-            ## temporal aggregation / calculation should reduce the data to only its spatial
-            ## dimensions
-            assert(len(cc.shape) == 2)
-            ## resize the data back to 5 dimensions
-            cc = cc.reshape(1,1,1,cc.shape[0],cc.shape[1])
+                if it > 0:
+                    value = get_block(self._curr_group)
+                block,group = value,slice(None)
             
-            ## put the data in the fill array
-            try:
-                fill[ir,it,il,:,:] = cc
+            for ir,il in itertools.product(range(fill.shape[0]),range(fill.shape[2])):
+                ## subset the values by the current temporal group
+                values = block[ir,group,il,:,:]
+                ## only 3-d data should be sent to the temporal aggregation method
+                assert(len(values.shape) == 3)
+                ## execute the temporal aggregation or calculation
+                cc = f(values,**parms)
+                
+                ## compute the sample size of the computation if requested
                 if self.calc_sample_size:
-                    fill_sample_size[ir,it,il,:,:] = sample_size
-            ## if it doesn't fit, check if we need to spatially aggregate
-            except ValueError as e:
-                if self.use_raw_values:
-                    fill[ir,it,il,:,:] = self.aggregate_spatial(cc,weights)
-                    if self.calc_sample_size:
-                        fill_sample_size[ir,it,il,:,:] = self.aggregate_spatial(sample_size,weights)
+                    sample_size = self.get_sample_size(values)
+                    assert(len(sample_size.shape) == 2)
+                    sample_size = sample_size.reshape(1,1,1,sample_size.shape[0],sample_size.shape[1])
                 else:
-                    ocgis_lh(exc=e,logger='calc.base')
+                    sample_size = None
+                                
+                ## temporal aggregation / calculation should reduce the data to only its spatial
+                ## dimensions
+                assert(len(cc.shape) == 2)
+                ## resize the data back to 5 dimensions
+                cc = cc.reshape(1,1,1,cc.shape[0],cc.shape[1])
+                
+                ## put the data in the fill array
+                try:
+                    fill[ir,it,il,:,:] = cc
+                    if self.calc_sample_size:
+                        fill_sample_size[ir,it,il,:,:] = sample_size
+                ## if it doesn't fit, check if we need to spatially aggregate
+                except ValueError as e:
+                    if self.use_raw_values:
+                        fill[ir,it,il,:,:] = self.aggregate_spatial(cc,weights)
+                        if self.calc_sample_size:
+                            fill_sample_size[ir,it,il,:,:] = self.aggregate_spatial(sample_size,weights)
+                    else:
+                        ocgis_lh(exc=e,logger='calc.base')
         
         ## we need to transfer the data mask from the fill to the sample size
         if self.calc_sample_size:
@@ -321,6 +337,16 @@ class AbstractUnivariateSetFunction(AbstractUnivariateFunction):
     '''
     __metaclass__ = abc.ABCMeta
     
+    ## optional method to overload computing the calculation for all temporal
+    ## groups at once with signature calculate_segments(values,starts,**kwds).
+    ## time steps in values are sorted so each group is contiguous and starts
+    ## contains the first index of each group. see ocgis.calc.segment.
+    calculate_segments = None
+    
+    ## set to False if the calculation reads the complete values of the current
+    ## variable. values are then not streamed by temporal group.
+    streamable = True
+    
     def aggregate_temporal(self):
         '''
         This operations is always implicit to :meth:`~ocgis.calc.base.AbstractFunction.calculate`.
@@ -330,15 +356,109 @@ class AbstractUnivariateSetFunction(AbstractUnivariateFunction):
     def _execute_(self):
         shp_fill = list(self.field.shape)
         shp_fill[1] = len(self.tgd.dgroups)
+        segments = self._get_segments_()
         for variable in self.field.variables.itervalues():
             
             ## some calculations need information from the current variable iteration
             self._curr_variable = variable
             
-            value = self.get_variable_value(variable)
-            fill = self._get_temporal_agg_fill_(value,shp_fill=shp_fill)
+            if self._get_is_streamed_(variable):
+                ## the complete values are never loaded so whether all values
+                ## are masked is determined from the blocks. the subset
+                ## operation checks this following the calculation.
+                masked = []
+                def get_block(group,variable=variable):
+                    ret = self._get_variable_value_block_(variable,group)
+                    masked.append(np.ma.getmaskarray(ret).all())
+                    return(ret)
+                fill = self._get_temporal_agg_fill_(None,shp_fill=shp_fill,get_block=get_block)
+                variable._streamed_all_masked = all(masked)
+            else:
+                value = self.get_variable_value(variable)
+                if segments is None:
+                    fill = self._get_temporal_agg_fill_(value,shp_fill=shp_fill)
+                else:
+                    fill = self._get_temporal_agg_fill_segments_(value,shp_fill,*segments)
             self._add_to_collection_(value=fill,parent_variables=[variable])
             
+    def _get_is_streamed_(self,variable):
+        ## values are streamed by temporal group if requested and the variable's
+        ## values have not been loaded from source. raw values for aggregated
+        ## fields are always in memory.
+        if not env.STREAM_CALC or not self.streamable or variable._value is not None or variable._data is None:
+            ret = False
+        elif self.use_raw_values and self.field._raw is not None:
+            ret = False
+        else:
+            ret = True
+        return(ret)
+    
+    def _get_variable_value_block_(self,variable,group):
+        ## a shallow copy of the field containing only the time steps in the group.
+        ## only these time steps are read from the source.
+        field = copy(self.field)
+        field.temporal = self.field.temporal[group]
+        field.variables = VariableCollection(variables=[variable[:]])
+        ret = field.variables[variable.alias].value
+        return(ret)
+            
+    def _get_segments_(self):
+        ## segments require a segment calculation and temporal groups that do not
+        ## overlap and are not empty
+        group_index = getattr(self.tgd,'group_index',None)
+        if self.calculate_segments is None or group_index is None:
+            return(None)
+        ngroups = len(self.tgd.dgroups)
+        select = np.where(group_index >= 0)[0]
+        counts = np.bincount(group_index[select],minlength=ngroups)
+        if ngroups == 0 or (counts == 0).any():
+            return(None)
+        ## the time step order placing groups in contiguous segments. avoid the
+        ## copy if time steps are already ordered.
+        order = select[np.argsort(group_index[select],kind='mergesort')]
+        if order.shape[0] == group_index.shape[0] and np.all(np.diff(order) == 1):
+            order = slice(None)
+        starts = np.append(0,np.cumsum(counts)[:-1])
+        return(order,starts)
+        
+    def _get_temporal_agg_fill_segments_(self,value,shp_fill,order,starts):
+        dtype = self.dtype or value.dtype
+        fill = np.ma.array(np.zeros(shp_fill,dtype=dtype))
+        if self.calc_sample_size:
+            fill_sample_size = np.ma.zeros(fill.shape,dtype=constants.np_int)
+        else:
+            fill_sample_size = None
+        if self.use_raw_values and self.field._raw is not None:
+            weights = self.field._raw.spatial.weights
+        
+        for ir,il in itertools.product(range(shp_fill[0]),range(shp_fill[2])):
+            ## a single copy of the values orders the time steps for all groups
+            values = value[ir,order,il,:,:]
+            cc = self.calculate_segments(values,starts,**self.parms)
+            assert(len(cc.shape) == 3)
+            if self.calc_sample_size:
+                sample_size = get_segment_count(values,starts)
+            
+            try:
+                fill[ir,:,il,:,:] = cc
+                if self.calc_sample_size:
+                    fill_sample_size[ir,:,il,:,:] = sample_size
+            ## if it doesn't fit, check if we need to spatially aggregate
+            except ValueError as e:
+                if self.use_raw_values:
+                    for it in range(shp_fill[1]):
+                        fill[ir,it,il,:,:] = self.aggregate_spatial(cc[it],weights)
+                        if self.calc_sample_size:
+                            fill_sample_size[ir,it,il,:,:] = self.aggregate_spatial(sample_size[it],weights)
+                else:
+                    ocgis_lh(exc=e,logger='calc.base')
+        
+        ## we need to transfer the data mask from the fill to the sample size
+        if self.calc_sample_size:
+            fill_sample_size.mask = fill.mask.copy()
+        
+        return({'fill':fill,'sample_size':fill_sample_size})
+            
     @classmethod
     def validate(cls,ops):
         if ops.calc_grouping is None:
@@ -1,6 +1,5 @@
 from ocgis.calc import base
 import numpy as np
-from ocgis.util.helpers import iter_array
 from ocgis.exc import DefinitionValidationError
 from ocgis import constants
 from collections import OrderedDict
@@ -25,21 +24,19 @@ class Duration(base.AbstractUnivariateSetFunction,base.AbstractParameterizedFunc
         ## storage array for counts
         shp_out = values.shape[-2:]
         store = np.zeros(shp_out,dtype=self.dtype).flatten()
-        ## get the summary operation from the numpy library
-        summary_operation = getattr(np,summary)
-
-        ## find longest sequence for each geometry across time dimension
-        for ii,fill in enumerate(self._iter_consecutive_(values,threshold,operation)):
-            ## case of only a singular occurrence
-            if len(fill) > 1:
-                fill = summary_operation(fill)
-            else:
-                try:
-                    fill = fill[0]
-                ## value is likely masked
-                except IndexError:
-                    fill = 0
-            store[ii] = fill
+        
+        idx_cell,durations = self._get_consecutive_(values,threshold,operation)
+        counts = np.bincount(idx_cell,minlength=store.shape[0])
+        
+        ## case of only a singular occurrence. cells with no durations (values
+        ## are likely masked) remain zero.
+        select = counts[idx_cell] == 1
+        store[idx_cell[select]] = durations[select]
+        ## summarize the cells with multiple durations
+        select = counts[idx_cell] > 1
+        if select.any():
+            summarized,summary_values = self._get_summary_values_(summary,idx_cell[select],durations[select])
+            store[summarized] = summary_values
         
         store.resize(shp_out)
         
@@ -49,9 +46,16 @@ class Duration(base.AbstractUnivariateSetFunction,base.AbstractParameterizedFunc
         
         return(store)
     
-    def _iter_consecutive_(self,values,threshold,operation):
-        ## time index reference
-        ref = np.arange(0,values.shape[0])
+    def _get_consecutive_(self,values,threshold,operation):
+        '''
+        Compute the durations of consecutive occurrences along the time axis for
+        all grid cells at once.
+        
+        :returns: Tuple of integer arrays `(idx_cell,durations)` with `idx_cell`
+         the flat index of the grid cell for each duration. Durations are sorted
+         by cell then time.
+        :rtype: tuple
+        '''
         ## perform requested logical operation
         if operation == 'gt':
             arr = values > threshold
@@ -61,27 +65,61 @@ class Duration(base.AbstractUnivariateSetFunction,base.AbstractParameterizedFunc
             arr = values >= threshold
         elif operation == 'lte':
             arr = values <= threshold
-
-        ## find longest sequence for each geometry across time dimension
-        for rowidx,colidx in iter_array(values[0,:,:],use_mask=False):
-            vec = arr[:,rowidx,colidx].reshape(-1)
-            ## check first if there is a longer series than 1
-            if np.any(np.diff(ref[vec]) == 1):
-                ## find locations where the values switch
-                diff_idx = np.diff(vec)
-                if diff_idx.shape != ref.shape:
-                    diff_idx = np.append(diff_idx,[False])
-                split_idx = ref[diff_idx] + 1
-                splits = np.array_split(vec,split_idx)
-                fill = [a.sum() for a in splits if np.all(a)]
-            ## case of only a singular occurrence
-            elif np.any(vec):
-                fill = [1]
-            ## case for no occurrence
-            else:
-                fill = [0]
-            
-            yield(fill)
+        
+        ## occurrences are determined from the data. masked time steps do not
+        ## count towards a duration.
+        ntime = values.shape[0]
+        ncell = values.shape[1]*values.shape[2]
+        occurs = np.ma.getdata(arr).reshape(ntime,ncell).T
+        unmasked = np.invert(np.ma.getmaskarray(arr).reshape(ntime,ncell).T)
+        
+        ## locate the starts and stops of the runs by differencing the padded
+        ## occurrences. runs are sorted by cell then time.
+        padded = np.zeros((ncell,ntime+2),dtype=np.int8)
+        padded[:,1:-1] = occurs
+        diff = np.diff(padded,axis=1)
+        run_cell,run_start = np.nonzero(diff == 1)
+        run_stop = np.nonzero(diff == -1)[1]
+        ## count the unmasked time steps in each run
+        count_unmasked = np.zeros((ncell,ntime+1),dtype=int)
+        np.cumsum(unmasked,axis=1,out=count_unmasked[:,1:])
+        run_duration = count_unmasked[run_cell,run_stop]-count_unmasked[run_cell,run_start]
+        
+        ## durations are only counted for cells with a series longer than one.
+        ## other cells have a duration of one if there is an unmasked occurrence
+        ## and zero otherwise.
+        has_series = np.bincount(run_cell,weights=run_stop-run_start > 1,minlength=ncell) > 0
+        select = np.logical_and(has_series[run_cell],run_duration > 0)
+        other_cell = np.where(np.invert(has_series))[0]
+        other_duration = np.logical_and(occurs[other_cell],unmasked[other_cell]).any(axis=1).astype(int)
+        
+        idx_cell = np.append(run_cell[select],other_cell)
+        durations = np.append(run_duration[select],other_duration)
+        order = np.argsort(idx_cell,kind='mergesort')
+        return(idx_cell[order],durations[order])
+    
+    def _get_summary_values_(self,summary,idx_cell,durations):
+        ## segments of durations for each cell
+        starts = np.append(0,np.nonzero(np.diff(idx_cell))[0]+1)
+        counts = np.diff(np.append(starts,durations.shape[0]))
+        if summary in ('mean','std'):
+            ret = np.add.reduceat(durations.astype(float),starts)/counts
+            if summary == 'std':
+                anomaly = durations-np.repeat(ret,counts)
+                ret = np.sqrt(np.add.reduceat(anomaly*anomaly,starts)/counts)
+        elif summary == 'max':
+            ret = np.maximum.reduceat(durations,starts)
+        elif summary == 'min':
+            ret = np.minimum.reduceat(durations,starts)
+        elif summary == 'median':
+            ## durations are sorted within each cell segment
+            durations = durations[np.lexsort((durations,idx_cell))]
+            middle = starts+counts//2
+            ret = np.where(counts % 2 == 1,durations[middle],(durations[middle-1]+durations[middle])/2.0)
+        else:
+            summary_operation = getattr(np,summary)
+            ret = [summary_operation(d) for d in np.split(durations,starts[1:])]
+        return(idx_cell[starts],ret)
     
     @classmethod 
     def validate(cls,ops):
@@ -106,8 +144,10 @@ class FrequencyDuration(base.AbstractKeyedOutputFunction,Duration):
         '''
         shp_out = values.shape[-2:]
         store = np.zeros(shp_out,dtype=object).flatten()
-        for ii,duration in enumerate(self._iter_consecutive_(values,threshold,operation)):
-            summary = self._get_summary_(duration)
+        idx_cell,durations = self._get_consecutive_(values,threshold,operation)
+        splits = np.searchsorted(idx_cell,np.arange(1,store.shape[0]))
+        for ii,duration in enumerate(np.split(durations,splits)):
+            summary = self._get_summary_(duration.tolist())
             store[ii] = summary
         store.resize(shp_out)
         
@@ -9,6 +9,8 @@ class DynamicDailyKernelPercentileThreshold(AbstractUnivariateSetFunction,Abstra
     parms_definition = {'operation':str,'percentile':float,'daily_percentile':None,'width':int}
     dtype = np.int32
     description = 'Implementation of moving window percentile threshold calculations similar to ECA indices: http://eca.knmi.nl/documents/atbd.pdf'
+    ## the daily percentiles are computed from the complete values
+    streamable = False
     
     def __init__(self,*args,**kwds):
         self._daily_percentile = {}
@@ -44,16 +46,16 @@ class DynamicDailyKernelPercentileThreshold(AbstractUnivariateSetFunction,Abstra
         ## extract the corresponding dates
         dates = self.field.temporal.value_datetime[self._curr_group]
         
-        ## match each date to it's percentile
-        dp_indices = np.zeros(dates.shape)
-        for ii,date in enumerate(dates):
-            month,day = date.month,date.day
-            dp_indices[ii] = daily_percentile['index'][np.logical_and(daily_percentile['month'] == month,
-                                                                      daily_percentile['day'] == day)]
+        ## match each date to it's percentile. calendar days are sorted by their
+        ## integer keys.
+        keys = self._get_calendar_day_keys_(dates)
+        cday_keys = daily_percentile['month']*100+daily_percentile['day']
+        dp_indices = np.searchsorted(cday_keys,keys)
+        dp_indices = np.minimum(dp_indices,cday_keys.shape[0]-1)
+        if not np.all(cday_keys[dp_indices] == keys):
+            ocgis_lh(exc=ValueError('Dates are missing from the daily percentile calendar.'),logger='calc.library')
         ## construct the the comparison array
-        b = np.empty_like(values)
-        for ii in range(b.shape[0]):
-            b[ii] = daily_percentile[dp_indices[ii]]['percentile']
+        b = daily_percentile['percentile'][dp_indices].reshape(values.shape)
         
         ## perform requested logical operation
         if operation == 'gt':
@@ -94,72 +96,68 @@ class DynamicDailyKernelPercentileThreshold(AbstractUnivariateSetFunction,Abstra
         :param width: Width of kernel to use for the moving window percentile.
         :type width: int, oddly-number, at least 3 or greater
         :returns: A structure array with four fields: month, day, index, and percentile.
+         Calendar days are sorted by month and day. The percentile field is a dense
+         float array with shape (ncalendar_days,realization,level,row,column).
         :rtype: numpy.ndarray
         '''
         assert(len(all_values.shape) == 5)
         
-        ## collect the days and months uniquely to use for the calendar attribution
-        dmap = {}
-        years = set()
-        for dt in temporal.flat:
-            day,month,year = dt.day,dt.month,dt.year
-            years.update([year])
-            if month not in dmap:
-                dmap[month] = []
-            if day not in dmap[month]:
-                dmap[month].append(day)
+        ## the unique calendar days and the calendar day index of each date
+        keys = DynamicDailyKernelPercentileThreshold._get_calendar_day_keys_(temporal)
+        cday_keys,dt_cday = np.unique(keys,return_inverse=True)
+        cday_shape = cday_keys.shape[0]
         
         ## this is the structure array storing date parts and percentile arrays
-        cday_length = sum([len(v) for v in dmap.itervalues()])
-        cday = np.zeros(cday_length,dtype=[('month',int),('day',int),('index',int),('percentile',object)])
-        idx = 0
-        for month in sorted(dmap):
-            for day in sorted(dmap[month]):
-                cday[idx] = (month,day,idx,None)
-                idx += 1
+        shp_percentile = tuple([all_values.shape[0]]+list(all_values.shape[2:]))
+        cday = np.zeros(cday_shape,dtype=[('month',int),('day',int),('index',int),('percentile',float,shp_percentile)])
+        cday['month'] = cday_keys//100
+        cday['day'] = cday_keys%100
+        cday['index'] = np.arange(cday_shape)
         
-        ## loop for each calendar day and calculate the percentile value for its
-        ## data window
-        r_cday_index = cday['index']
-        r_logical_and = np.logical_and
-        cday_shape = cday.shape[0]
-        for target_cday_index in range(cday_shape):
-            select = np.zeros(all_values.shape[1],dtype=bool)
-            
-            ## this function returns the calendar days part of the target calendar
-            ## day's window. these are then used to subset the calendar day structure
-            ## array.
-            window_days = DynamicDailyKernelPercentileThreshold._get_calendar_day_window_(r_cday_index,target_cday_index,width)
-            cday_select = np.zeros(cday_shape,dtype=bool)
-            for wd in window_days:
-                cday_select = np.logical_or(cday_select,r_cday_index == wd)
-            cday_sub = cday[cday_select]
-            
-            ## a tight loop used to determine if a date is a member of a particular
-            ## window.
-            ## TODO: optimize
-            for ii,dt in enumerate(temporal.flat):
-                r_month,r_day = dt.month,dt.day
-                dt_cday = cday['index'][r_logical_and(cday['day'] == r_day,cday['month'] == r_month)]
-                select[ii] = dt_cday in cday_sub['index']
-            
-            ## calculate the percentile value for the window
-            percentile_subset = all_values[:,select]
-#            assert(percentile_subset.shape[0] == len(years)*width)
-            cday['percentile'][target_cday_index] = np.percentile(percentile_subset,percentile,axis=1)
-            
-        return(cday)        
+        ## a date is a member of a calendar day's window if the circular distance
+        ## between the calendar days is within the kernel stride. rows are the
+        ## target calendar days.
+        stride_dim = DynamicDailyKernelPercentileThreshold._get_stride_dim_(width)
+        distance = (dt_cday-cday['index'].reshape(-1,1)) % cday_shape
+        select = np.logical_or(distance <= stride_dim,distance >= cday_shape-stride_dim)
+        
+        ## windows with the same number of dates are gathered into a single array
+        ## and the percentiles calculated along the window axis. the number of
+        ## windows in a gather is limited to bound memory use.
+        counts = select.sum(axis=1)
+        size_window = all_values.size/all_values.shape[1]
+        for count in np.unique(counts):
+            targets = np.where(counts == count)[0]
+            idx_time = np.nonzero(select[targets])[1].reshape(-1,count)
+            nchunk = max(1,int(1e7/(size_window*count)))
+            for start in range(0,targets.shape[0],nchunk):
+                stop = start+nchunk
+                percentile_subset = all_values[:,idx_time[start:stop]]
+                ret = np.percentile(percentile_subset,percentile,axis=2)
+                cday['percentile'][targets[start:stop]] = np.rollaxis(ret,1)
             
+        return(cday)
+    
     @staticmethod
-    def _get_calendar_day_window_(cday_index,target_cday_index,width):
+    def _get_calendar_day_keys_(dates):
+        ## integer keys for the calendar day of each date that sort by month and
+        ## day
+        ret = np.array([dt.month*100+dt.day for dt in dates.flat],dtype=int)
+        return(ret)
+    
+    @staticmethod
+    def _get_stride_dim_(width):
         width = int(width)
         try:
             assert(width >= 3)
             assert(width%2 != 0)
         except AssertionError:
             ocgis_lh(exc=ValueError('Kernel widths must be >= 3 and be oddly numbered.'),logger='calc.library')
-        
-        stride_dim = (width-1)/2
+        return((width-1)/2)
+            
+    @staticmethod
+    def _get_calendar_day_window_(cday_index,target_cday_index,width):
+        stride_dim = DynamicDailyKernelPercentileThreshold._get_stride_dim_(width)
         axis_length = cday_index.shape[0]
         
         lower_idx = target_cday_index - stride_dim
@@ -1,5 +1,6 @@
 from ocgis.calc import base
 import numpy as np
+from ocgis.calc import segment
 
 
 class FrequencyPercentile(base.AbstractUnivariateSetFunction,base.AbstractParameterizedFunction):
@@ -22,6 +23,9 @@ class Max(base.AbstractUnivariateSetFunction):
     
     def calculate(self,values):
         return(np.ma.max(values,axis=0))
+    
+    def calculate_segments(self,values,starts):
+        return(segment.get_segment_max(values,starts))
 
 
 class Min(base.AbstractUnivariateSetFunction):
@@ -30,6 +34,9 @@ class Min(base.AbstractUnivariateSetFunction):
     
     def calculate(self,values):
         return(np.ma.min(values,axis=0))
+    
+    def calculate_segments(self,values,starts):
+        return(segment.get_segment_min(values,starts))
 
     
 class Mean(base.AbstractUnivariateSetFunction):
@@ -39,6 +46,9 @@ class Mean(base.AbstractUnivariateSetFunction):
     def calculate(self,values):
         return(np.ma.mean(values,axis=0))
     
+    def calculate_segments(self,values,starts):
+        return(segment.get_segment_mean(values,starts))
+    
     
 class Median(base.AbstractUnivariateSetFunction):
     description = 'Compute median value of the set.'
@@ -54,3 +64,6 @@ class StandardDeviation(base.AbstractUnivariateSetFunction):
     
     def calculate(self,values):
         return(np.ma.std(values,axis=0))
+    
+    def calculate_segments(self,values,starts):
+        return(segment.get_segment_std(values,starts))
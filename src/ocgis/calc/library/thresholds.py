@@ -1,5 +1,6 @@
 from ocgis.calc import base
 import numpy as np
+from ocgis.calc import segment
 
 
 class Between(base.AbstractUnivariateSetFunction,base.AbstractParameterizedFunction):
@@ -15,10 +16,17 @@ class Between(base.AbstractUnivariateSetFunction,base.AbstractParameterizedFunct
         :param upper: The upper value of the range.
         :type upper: float
         '''
-        assert(lower <= upper)
-        idx = (values >= float(lower))*(values <= float(upper))
+        idx = self._get_selection_(values,lower,upper)
         return(np.ma.sum(idx,axis=0))
     
+    def calculate_segments(self,values,starts,lower=None,upper=None):
+        idx = self._get_selection_(values,lower,upper)
+        return(segment.get_segment_sum(idx,starts))
+    
+    def _get_selection_(self,values,lower,upper):
+        assert(lower <= upper)
+        return((values >= float(lower))*(values <= float(upper)))
+    
     
 class Threshold(base.AbstractUnivariateSetFunction,base.AbstractParameterizedFunction):
     description = 'Count of values where the logical operation returns TRUE.'
@@ -34,6 +42,15 @@ class Threshold(base.AbstractUnivariateSetFunction,base.AbstractParameterizedFun
         :type operation: str
         '''
         
+        idx = self._get_selection_(values,threshold,operation)
+        ret = np.ma.sum(idx,axis=0)
+        return(ret)
+    
+    def calculate_segments(self,values,starts,threshold=None,operation=None):
+        idx = self._get_selection_(values,threshold,operation)
+        return(segment.get_segment_sum(idx,starts))
+    
+    def _get_selection_(self,values,threshold,operation):
         ## perform requested logical operation
         if operation == 'gt':
             idx = values > threshold
@@ -45,9 +62,7 @@ class Threshold(base.AbstractUnivariateSetFunction,base.AbstractParameterizedFun
             idx = values <= threshold
         else:
             raise(NotImplementedError('The operation "{0}" was not recognized.'.format(operation)))
-        
-        ret = np.ma.sum(idx,axis=0)
-        return(ret)
+        return(idx)
         
     def _aggregate_spatial_(self,values,weights):
         return(np.ma.sum(values))
@@ -0,0 +1,78 @@
+'''
+Mask-aware reductions over contiguous segments of the time axis. Values are
+three-dimensional masked arrays (time,row,column) with each temporal group
+occupying a contiguous run of time steps. `starts` holds the index of the first
+time step of each group. Groups must not be empty. Returned masked arrays have
+shape (ngroups,row,column) and are masked where a group has no unmasked values.
+'''
+import numpy as np
+
+
+def get_segment_count(values,starts):
+    if _get_is_unmasked_(values):
+        ## avoid the reduction if all values are unmasked
+        lengths = np.diff(np.append(starts,values.shape[0]))
+        ret = np.empty([starts.shape[0]]+list(values.shape[1:]),dtype=np.int_)
+        ret[:] = lengths.reshape([-1]+[1]*(values.ndim-1))
+    else:
+        unmasked = np.invert(np.ma.getmaskarray(values))
+        ret = np.add.reduceat(unmasked,starts,axis=0,dtype=np.int_)
+    return(ret)
+
+def get_segment_sum(values,starts):
+    count = get_segment_count(values,starts)
+    return(np.ma.array(_get_segment_sum_(values,starts),mask=count == 0))
+
+def get_segment_max(values,starts):
+    count = get_segment_count(values,starts)
+    filled = _get_filled_(values,np.ma.maximum_fill_value(values))
+    ret = np.maximum.reduceat(filled,starts,axis=0)
+    return(np.ma.array(ret,mask=count == 0))
+
+def get_segment_min(values,starts):
+    count = get_segment_count(values,starts)
+    filled = _get_filled_(values,np.ma.minimum_fill_value(values))
+    ret = np.minimum.reduceat(filled,starts,axis=0)
+    return(np.ma.array(ret,mask=count == 0))
+
+def get_segment_mean(values,starts):
+    count = get_segment_count(values,starts)
+    ret = _get_segment_mean_(values,starts,count)
+    return(np.ma.array(ret,mask=count == 0))
+
+def get_segment_std(values,starts):
+    count = get_segment_count(values,starts)
+    mean = _get_segment_mean_(values,starts,count)
+    ## broadcast the segment means back to their time steps
+    lengths = np.diff(np.append(starts,values.shape[0]))
+    anomaly = values-np.repeat(mean,lengths,axis=0)
+    ret = np.sqrt(_get_segment_sum_(anomaly*anomaly,starts)*1./np.maximum(count,1))
+    return(np.ma.array(ret,mask=count == 0))
+
+def _get_segment_mean_(values,starts,count):
+    ## follows the arithmetic of the masked array mean
+    return(_get_segment_sum_(values,starts)*1./np.maximum(count,1))
+
+def _get_segment_sum_(values,starts):
+    filled = _get_filled_(values,0)
+    ## match the accumulator types used by array summation
+    kind = filled.dtype.kind
+    if kind == 'b' or (kind == 'i' and filled.dtype.itemsize < np.dtype(np.int_).itemsize):
+        dtype = np.int_
+    elif kind == 'u' and filled.dtype.itemsize < np.dtype(np.uint).itemsize:
+        dtype = np.uint
+    else:
+        dtype = filled.dtype
+    return(np.add.reduceat(filled,starts,axis=0,dtype=dtype))
+
+def _get_filled_(values,fill_value):
+    ## the fill copies the data and is skipped if nothing is masked
+    if _get_is_unmasked_(values):
+        ret = np.ma.getdata(values)
+    else:
+        ret = np.ma.filled(values,fill_value)
+    return(ret)
+
+def _get_is_unmasked_(values):
+    mask = np.ma.getmask(values)
+    return(mask is np.ma.nomask or not mask.any())
@@ -3,11 +3,20 @@ import itertools
 
 
 def get_tile_schema(nrow,ncol,tdim,origin=0):
+    '''
+    :param tdim: The tile dimension. An integer for square tiles or a sequence
+     with the number of rows and columns in a tile.
+    :type tdim: int or sequence
+    '''
+    try:
+        tdim_row,tdim_col = tdim
+    except TypeError:
+        tdim_row,tdim_col = tdim,tdim
     ret = {}
-    row_idx = np.arange(origin,nrow+tdim,step=tdim,dtype=int)
+    row_idx = np.arange(origin,nrow+tdim_row,step=tdim_row,dtype=int)
     if row_idx[-1] > nrow:
         row_idx[-1] = nrow
-    col_idx = np.arange(origin,ncol+tdim,step=tdim,dtype=int)
+    col_idx = np.arange(origin,ncol+tdim_col,step=tdim_col,dtype=int)
     if col_idx[-1] > ncol:
         col_idx[-1] = ncol
     row_slices = get_slices(row_idx)
@@ -27,4 +36,72 @@ def get_slices(arr):
             ret[idx] = [start,stop]
         except IndexError:
             break
-    return(ret)
\ No newline at end of file
+    return(ret)
+
+def get_tile_plan(request_dataset,ncalc,memory_budget):
+    '''
+    Derive a tile shape for computations on a request dataset limiting the memory
+    used by each tile. A grid cell requires memory for its masked input values
+    over the time, level, and realization axes plus one array of the same size
+    for each calculation. Tile rows and columns are multiples of the source's
+    netCDF chunk shape when the tile is at least one chunk wide.
+
+    :param request_dataset: The request dataset to tile.
+    :type request_dataset: :class:`ocgis.RequestDataset`
+    :param int ncalc: The number of calculations.
+    :param int memory_budget: The maximum memory for a tile in bytes.
+    :returns: A dictionary with the tile shape as (nrow,ncol) under "tile_dimension",
+     the grid shape, the source chunk shape or `None`, the estimated bytes per
+     grid cell and per tile, and the tile count.
+    :rtype: dict
+    '''
+    field = request_dataset.get()
+    shp = field.shape
+    variable_meta = request_dataset._source_metadata['variables'][request_dataset.variable]
+    itemsize = np.dtype(variable_meta['dtype']).itemsize
+    ## values are stored with a boolean mask
+    nvalues = shp[0]*shp[1]*shp[2]
+    bytes_per_cell = nvalues*(itemsize+1)*(1+ncalc)
+    max_cells = max(int(memory_budget)//bytes_per_cell,1)
+
+    nrow,ncol = shp[-2:]
+    chunks = get_spatial_chunks(request_dataset)
+    ## prefer complete rows which are contiguous on disk. otherwise, use square
+    ## tiles.
+    if max_cells >= ncol:
+        tile_col = ncol
+    else:
+        tile_col = max(int(np.sqrt(max_cells)),1)
+        if chunks is not None and tile_col >= chunks[1]:
+            tile_col -= tile_col%chunks[1]
+    tile_row = min(max(max_cells//tile_col,1),nrow)
+    if chunks is not None and tile_row >= chunks[0] and tile_row < nrow:
+        tile_row -= tile_row%chunks[0]
+
+    schema = get_tile_schema(nrow,ncol,(tile_row,tile_col))
+    ret = {'tile_dimension':(tile_row,tile_col),'shape':(nrow,ncol),'chunks':chunks,
+           'bytes_per_cell':bytes_per_cell,'bytes_per_tile':bytes_per_cell*tile_row*tile_col,
+           'tile_count':len(schema)}
+    return(ret)
+
+def get_spatial_chunks(request_dataset):
+    '''
+    :returns: The netCDF chunk shape of the request dataset's variable along the
+     row and column axes or `None` if the variable is not chunked.
+    :rtype: tuple
+    '''
+    dim_map = request_dataset._source_metadata['dim_map']
+    ds = request_dataset._open_()
+    try:
+        try:
+            chunking = ds.variables[request_dataset.variable].chunking()
+        ## multi-file and older datasets do not report chunking
+        except AttributeError:
+            chunking = 'contiguous'
+    finally:
+        request_dataset._close_(ds)
+    if chunking == 'contiguous' or chunking is None:
+        ret = None
+    else:
+        ret = (chunking[dim_map['Y']['pos']],chunking[dim_map['X']['pos']])
+    return(ret)
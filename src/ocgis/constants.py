@@ -37,6 +37,23 @@ calc_year_centroid_day = 1
 #: The number of values to use when calculating data resolution.
 resolution_limit = 100
 
+#: The number of values to process per batch when iterating columns.
+record_batch_size = 10000
+
+#: The buffer size in bytes for CSV output files.
+csv_buffer_size = 8388608
+
+#: The cost of a separate netCDF read expressed as a number of values. Gaps
+#: between selected indices are read when reading them is cheaper.
+nc_read_overhead = 100000
+
+#: The number of transformed rotated pole grids to keep in memory.
+rotated_pole_cache_size = 8
+
+#: The version of the cached metadata and index formats. Increment when the
+#: structure of cached content changes so existing cache files are not read.
+metadata_cache_version = 1
+
 #: The data type to use for NumPy integers.
 np_int = np.int32
 #: The data type to use for NumPy floats.
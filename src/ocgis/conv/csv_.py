@@ -7,6 +7,8 @@ import logging
 from ocgis.util.logging_ocgis import ocgis_lh
 import fiona
 from shapely.geometry.geo import mapping
+import numpy as np
+from ocgis import constants
 
 
 class OcgDialect(excel):
@@ -18,17 +20,26 @@ class CsvConverter(OcgConverter):
                     
     def _build_(self,coll):
         headers = [h.upper() for h in coll.headers]
-        f = open(self.path,'w')
+        f = open(self.path,'w',constants.csv_buffer_size)
         writer = csv.DictWriter(f,headers,dialect=OcgDialect)
         writer.writeheader()
-        ret = {'file_object':f,'csv_writer':writer}
+        ret = {'file_object':f,'csv_writer':writer,'headers':headers}
         return(ret)
         
     def _write_coll_(self,f,coll):
-        writer = f['csv_writer']
+        for geoms,geom_index,batch in self._iter_batches_(f,coll):
+            pass
         
-        for geom,row in coll.get_iter_dict(use_upper_keys=True):
-            writer.writerow(row)
+    def _iter_batches_(self,f,coll):
+        ## write blocks of rows from formatted string columns. the batches are
+        ## yielded after writing for converters writing additional outputs.
+        fobj = f['file_object']
+        headers = f['headers']
+        for geoms,geom_index,batch in coll.get_iter_batch(use_upper_keys=True,formatter=get_formatted_column):
+            columns = [batch[h].tolist() for h in headers]
+            fobj.write('\n'.join([','.join(row) for row in zip(*columns)]))
+            fobj.write('\n')
+            yield(geoms,geom_index,batch)
 
     def _finalize_(self,f):
         for fobj in f.itervalues():
@@ -43,7 +54,7 @@ class CsvPlusConverter(CsvConverter):
     def _build_(self,coll):
         ret = CsvConverter._build_(self,coll)
         
-        self._ugid_gid_store = {}
+        self._ugid_gid_store = set()
         
         if not self.ops.aggregate:
             fiona_path = os.path.join(self._get_or_create_shp_folder_(),self.prefix+'_gid.shp')
@@ -63,34 +74,66 @@ class CsvPlusConverter(CsvConverter):
         return(ret)
     
     def _write_coll_(self,f,coll):
-        writer = f['csv_writer']
         file_fiona = f['fiona_object']
         rstore = self._ugid_gid_store
         is_aggregated = self.ops.aggregate
         
-        for geom,row in coll.get_iter_dict(use_upper_keys=True):
-            writer.writerow(row)
-            if not is_aggregated:
-                did,gid,ugid = row['DID'],row['GID'],row['UGID']
+        for geoms,geom_index,batch in self._iter_batches_(f,coll):
+            if is_aggregated:
+                continue
+            
+            ## find the first row of each unique identifier combination in the
+            ## batch keeping the row order.
+            did,ugid,gid = batch['DID'],batch['UGID'],batch['GID']
+            keys = np.array(['|'.join(key) for key in zip(did,ugid,gid)])
+            _,first = np.unique(keys,return_index=True)
+            first.sort()
+            
+            for idx in first:
+                key = (did[idx],ugid[idx],gid[idx])
+                if key in rstore:
+                    continue
+                rstore.add(key)
+                
+                ## for multivariate calculation outputs the dataset identifier
+                ## is None and formatted as an empty string.
                 try:
-                    if gid in rstore[did][ugid]:
-                        continue
-                    else:
-                        raise(KeyError)
-                except KeyError:
-                    if did not in rstore:
-                        rstore[did] = {}
-                    if ugid not in rstore[did]:
-                        rstore[did][ugid] = []
-                    if gid not in rstore[did][ugid]:
-                        rstore[did][ugid].append(gid)
-                    
-                    ## for multivariate calculation outputs the dataset identifier
-                    ## is None.
-                    try:
-                        converted_did = int(did)
-                    except TypeError:
-                        converted_did = None
-                    feature = {'properties':{'GID':int(gid),'UGID':int(ugid),'DID':converted_did},
-                               'geometry':mapping(geom)}
-                    file_fiona.write(feature)
+                    converted_did = int(key[0])
+                except ValueError:
+                    converted_did = None
+                feature = {'properties':{'GID':int(key[2]),'UGID':int(key[1]),'DID':converted_did},
+                           'geometry':mapping(geoms[geom_index[idx]])}
+                file_fiona.write(feature)
+
+
+def get_formatted_column(arr):
+    '''
+    Format a column of row values as strings matching the output of
+    :class:`csv.DictWriter` for :class:`~ocgis.conv.csv_.OcgDialect`.
+    
+    :param arr: A one-dimensional array of row values.
+    :type arr: :class:`numpy.ndarray`
+    :rtype: :class:`numpy.ndarray` with an object data type
+    '''
+    ret = np.empty(arr.shape[0],dtype=object)
+    kind = arr.dtype.kind
+    if kind in 'iub':
+        ret[:] = arr.astype(str)
+    ## the csv module uses the representation of python floats
+    elif arr.dtype == np.float64:
+        ret[:] = map(repr,arr.tolist())
+    elif kind == 'f':
+        ret[:] = map(str,arr)
+    else:
+        for idx,element in enumerate(arr):
+            if element is None:
+                element = ''
+            elif isinstance(element,float):
+                element = repr(element)
+            else:
+                element = str(element)
+                ## minimal quoting for strings with special characters
+                if any([c in element for c in ',"\n']):
+                    element = '"{0}"'.format(element.replace('"','""'))
+            ret[idx] = element
+    return(ret)
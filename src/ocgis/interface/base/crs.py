@@ -1,4 +1,4 @@
-from osgeo.osr import SpatialReference
+from osgeo.osr import SpatialReference, CoordinateTransformation
 from fiona.crs import from_string, to_string
 import numpy as np
 from ocgis.util.logging_ocgis import ocgis_lh
@@ -60,6 +60,31 @@ class CoordinateReferenceSystem(object):
         sr.ImportFromProj4(to_string(self.value))
         return(sr)
     
+    def get_transformed_coordinates(self,to_crs,x,y):
+        '''
+        Transform coordinate arrays to another coordinate system with a single
+        batched call.
+        
+        :param to_crs: The destination coordinate system.
+        :type to_crs: :class:`ocgis.interface.base.crs.CoordinateReferenceSystem`
+        :param x: Array of x-coordinates (i.e. longitude).
+        :type x: :class:`numpy.ndarray`
+        :param y: Array of y-coordinates with the same shape as `x`.
+        :type y: :class:`numpy.ndarray`
+        :returns: Tuple of transformed float arrays `(x,y)` with the shape of the
+         inputs.
+        :rtype: tuple
+        '''
+        x = np.array(x,dtype=float)
+        y = np.array(y,dtype=float)
+        if x.size > 0 and to_crs != self:
+            transform = CoordinateTransformation(self.sr,to_crs.sr)
+            points = np.column_stack((x.flat,y.flat)).tolist()
+            points = np.array(transform.TransformPoints(points),dtype=float)
+            x = points[:,0].reshape(x.shape)
+            y = points[:,1].reshape(y.shape)
+        return(x,y)
+    
     
 class WGS84(CoordinateReferenceSystem):
     
@@ -376,6 +401,41 @@ class CFRotatedPole(CFCoordinateReferenceSystem):
         self._trans_proj = self._template.format(lon_pole=kwds['grid_north_pole_longitude'],
                                                  lat_pole=kwds['grid_north_pole_latitude'])
         
+    def get_transformed_coordinates(self,to_crs,x,y):
+        '''
+        Rotated longitude and latitude coordinates are unrotated to spherical
+        longitudes and latitudes using array operations equivalent to the PROJ.4
+        transformation in :attr:`_trans_proj`. The unrotated coordinates are
+        treated as WGS84 coordinates.
+        
+        See :meth:`ocgis.interface.base.crs.CoordinateReferenceSystem.get_transformed_coordinates`.
+        '''
+        rlon = np.radians(np.array(x,dtype=float))
+        rlat = np.radians(np.array(y,dtype=float))
+        lon_pole = np.radians(float(self.map_parameters_values['grid_north_pole_longitude']))
+        lat_pole = np.radians(float(self.map_parameters_values['grid_north_pole_latitude']))
+        
+        ## the oblique transformation is relative to a central meridian of 180
+        ## degrees
+        rlon = rlon-np.pi
+        cos_rlon = np.cos(rlon)
+        sin_rlat = np.sin(rlat)
+        cos_rlat = np.cos(rlat)
+        lon = np.arctan2(cos_rlat*np.sin(rlon),np.sin(lat_pole)*cos_rlat*cos_rlon+np.cos(lat_pole)*sin_rlat)
+        lat = np.arcsin(np.clip(np.sin(lat_pole)*sin_rlat-np.cos(lat_pole)*cos_rlat*cos_rlon,-1,1))
+        ## longitudes are adjusted to the range -180 to 180
+        lon = np.degrees(lon+lon_pole)
+        lon = np.where(np.abs(lon) > 180,lon-360*np.floor((lon+180)/360.),lon)
+        lat = np.degrees(lat)
+        
+        if isinstance(to_crs,CFRotatedPole):
+            exc = NotImplementedError('Transforming to rotated pole coordinates is not supported.')
+            ocgis_lh(exc=exc,logger='crs')
+        wgs84 = CFWGS84()
+        if to_crs != wgs84:
+            lon,lat = wgs84.get_transformed_coordinates(to_crs,lon,lat)
+        return(lon,lat)
+        
 #    @classmethod
 #    def _load_from_metadata_finalize_(cls,kwds,var,meta):
 #        import ipdb;ipdb.set_trace()
@@ -2,20 +2,18 @@ import base
 import numpy as np
 from ocgis.util.logging_ocgis import ocgis_lh
 from ocgis.util.helpers import iter_array, get_none_or_slice, \
-    get_formatted_slice, get_reduced_slice, make_poly
+    get_formatted_slice, get_reduced_slice, make_poly, get_bounds_from_1d,\
+    get_transformed_geometries
 from shapely.geometry.point import Point
 from ocgis import constants
-import itertools
 from shapely.geometry.polygon import Polygon
 from copy import copy, deepcopy
 from shapely.prepared import prep
 from shapely.geometry.multipoint import MultiPoint
 from shapely.geometry.multipolygon import MultiPolygon
 from ocgis.exc import ImproperPolygonBoundsError, EmptySubsetError
-from osgeo.ogr import CreateGeometryFromWkb
-from shapely import wkb
-from ocgis.util.spatial.index import build_index_grid, build_index,\
-    index_intersects
+from ocgis.util.spatial.index import SpatialIndex
+from ocgis.util.spatial.rasterize import get_rectilinear_intersects_mask
 import fiona
 from shapely.geometry.geo import mapping
 
@@ -167,13 +165,23 @@ class SpatialDimension(base.AbstractUidDimension):
                 ret.grid,slc = self.grid.get_subset_bbox(minx,miny,maxx,maxy,return_indices=True)
                 ## update the unique identifier to copy the grid uid
                 ret.uid = ret.grid.uid
-                ## attempt to mask the polygons
-                try:
-                    ret._geom._polygon = ret.geom.polygon.get_intersects_masked(polygon)
-                    grid_mask = ret.geom.polygon.value.mask
-                except ImproperPolygonBoundsError:
-                    ret._geom._point = ret.geom.point.get_intersects_masked(polygon)
-                    grid_mask = ret.geom.point.value.mask
+                ## rectilinear grids may be masked without constructing geometries.
+                ## geometries are then created with the mask when requested.
+                grid_mask = ret.grid.get_intersects_mask(polygon)
+                if grid_mask is not None:
+                    if grid_mask.all():
+                        ocgis_lh(exc=EmptySubsetError(self.name))
+                    ret.uid.mask = grid_mask.copy()
+                else:
+                    ## attempt to mask the polygons. candidate geometries are
+                    ## found using the spatial index of the source grid which is
+                    ## built once and reused by subsequent selections.
+                    try:
+                        ret._geom._polygon = ret.geom.polygon.get_intersects_masked(polygon,source=self.grid,slc=slc)
+                        grid_mask = ret.geom.polygon.value.mask
+                    except ImproperPolygonBoundsError:
+                        ret._geom._point = ret.geom.point.get_intersects_masked(polygon,source=self.grid,slc=slc)
+                        grid_mask = ret.geom.point.value.mask
                 ## transfer the geometry mask to the grid mask
                 ret.grid.value.mask[:,:,:] = grid_mask.copy()
         else:
@@ -216,31 +224,27 @@ class SpatialDimension(base.AbstractUidDimension):
     def update_crs(self,to_crs):
         ## if the crs values are the same, pass through
         if to_crs != self.crs:
-            to_sr = to_crs.sr
-            from_sr = self.crs.sr
-
-            if self.geom.point is not None:
-                self.geom.point.update_crs(to_sr,from_sr)
-            try:
-                self.geom.polygon.update_crs(to_sr,from_sr)
-            except ImproperPolygonBoundsError:
-                pass
-            
-            if self.grid is not None and self.geom.point is not None:
-                r_grid_value = self.grid.value.data
-                r_point_value = self.geom.point.value.data
-                for (idx_row,idx_col),geom in iter_array(r_point_value,return_value=True,use_mask=False):
-                    x,y = geom.x,geom.y
-                    r_grid_value[0,idx_row,idx_col] = y
-                    r_grid_value[1,idx_row,idx_col] = x
-                ## remove row and columns if they exist as this requires interpolation
-                ## to make them vectors again.
-                self.grid.row = None
-                self.grid.col = None
-            ## if there is not point dimension, then a grid representation is not
-            ## possible. mask the grid values accordingly.
-            elif self.grid is not None and self.geom.point is None:
-                self.grid.value.mask = True
+            ## geometries not yet constructed from the grid are rebuilt from the
+            ## transformed grid when requested
+            if self._grid is not None and self._get_is_geom_lazy_():
+                self._grid = self._get_transformed_grid_(to_crs)
+                self._geom = None
+            else:
+                if self.geom.point is not None:
+                    self.geom.point.update_crs(to_crs,self.crs)
+                try:
+                    self.geom.polygon.update_crs(to_crs,self.crs)
+                except ImproperPolygonBoundsError:
+                    pass
+                
+                ## grids populated from the point geometries are rebuilt from the
+                ## transformed points when requested
+                if self._grid is not None and self.geom.point is not None:
+                    self._grid = self._get_transformed_grid_(to_crs)
+                ## if there is not point dimension, then a grid representation is not
+                ## possible. mask the grid values accordingly.
+                elif self._grid is not None and self.geom.point is None:
+                    self._grid.value.mask = True
             
             self.crs = to_crs
                     
@@ -252,6 +256,50 @@ class SpatialDimension(base.AbstractUidDimension):
     def _format_uid_(self,value):
         return(np.atleast_2d(value))
     
+    def _get_is_geom_lazy_(self):
+        ## true if no geometry values have been constructed or set
+        if self._geom is None:
+            ret = True
+        else:
+            ret = True
+            for attr in ('_point','_polygon'):
+                target = getattr(self._geom,attr)
+                if target is not None and target._value is not None:
+                    ret = False
+        return(ret)
+    
+    def _get_transformed_grid_(self,to_crs):
+        ## transform the grid centroids and cell corners with a single call
+        grid = self.grid
+        value = grid.value.copy()
+        corners = grid.corners
+        r_value = value.data
+        if corners is None:
+            x,y = self.crs.get_transformed_coordinates(to_crs,r_value[1],r_value[0])
+        else:
+            corners = corners.copy()
+            r_corners = corners.data
+            ## stack the centroids as a fifth corner
+            x = np.concatenate((r_value[1][:,:,np.newaxis],r_corners[1]),axis=2)
+            y = np.concatenate((r_value[0][:,:,np.newaxis],r_corners[0]),axis=2)
+            x,y = self.crs.get_transformed_coordinates(to_crs,x,y)
+            r_corners[1] = x[:,:,1:]
+            r_corners[0] = y[:,:,1:]
+            x = x[:,:,0]
+            y = y[:,:,0]
+        r_value[1] = x
+        r_value[0] = y
+        
+        ret = copy(grid)
+        ret._value = value
+        ret._corners = corners
+        ret._index = {}
+        ## remove row and columns if they exist as this requires interpolation
+        ## to make them vectors again.
+        ret.row = None
+        ret.col = None
+        return(ret)
+    
     def _get_sliced_properties_(self,slc):
         if self.properties is not None:
             ## determine major axis
@@ -278,6 +326,8 @@ class SpatialGridDimension(base.AbstractUidValueDimension):
         self.col = kwds.pop('col',None)
         self._row_src_idx = kwds.pop('row_src_idx',None)
         self._col_src_idx = kwds.pop('col_src_idx',None)
+        self._corners = kwds.pop('corners',None)
+        self._index = {}
         
         super(SpatialGridDimension,self).__init__(*args,**kwds)
         
@@ -303,17 +353,33 @@ class SpatialGridDimension(base.AbstractUidValueDimension):
         if self._row_src_idx is not None:
             ret._row_src_idx = self._row_src_idx[slc[0]]
             ret._col_src_idx = self._col_src_idx[slc[1]]
+            
+        if self._corners is not None:
+            ret._corners = self._corners[:,slc[0],slc[1],:]
         
         ret.uid = uid
         ret._value = value
         ret.row = row
         ret.col = col
+        ret._index = {}
 
 #        ret = SpatialGridDimension(value=value,uid=uid,row=row,col=col,name_value=self.name_value,
 #                                   units=self.units,meta=self.meta,name=self.name,name_uid=self.name_uid)
             
         return(ret)
     
+    @property
+    def corners(self):
+        '''Corner coordinates of the grid cells with shape (2,nrow,ncol,4). The
+        first dimension holds row and column coordinates as with the grid value.
+        Corners are ordered (lower left, upper left, upper right, lower right).
+        `None` is returned if the corners may not be determined.'''
+        
+        if self._corners is None:
+            if self.row is not None and self.row.bounds is not None and self.col.bounds is not None:
+                self._corners = self._get_corners_()
+        return(self._corners)
+    
     @property
     def extent(self):
         if self.row is None:
@@ -438,6 +504,81 @@ class SpatialGridDimension(base.AbstractUidValueDimension):
             
         return(ret)
     
+    def get_index(self,abstraction='polygon'):
+        '''
+        :param str abstraction: If ``'polygon'``, index the cell extents using the
+         grid corners. If ``'point'``, index the cell centroids.
+        :returns: A spatial index of all grid cells including masked cells. Items
+         are ordered as the flattened grid. The index is cached and rebuilt only
+         if the grid values change.
+        :rtype: :class:`ocgis.util.spatial.index.SpatialIndex`
+        '''
+        if abstraction == 'polygon':
+            ref = self.corners
+        elif abstraction == 'point':
+            ref = self.value
+        else:
+            raise(NotImplementedError(abstraction))
+        
+        try:
+            ref_cached,ret = self._index[abstraction]
+            if ref_cached is not ref:
+                raise(KeyError)
+        except KeyError:
+            r_ref = ref.data
+            if abstraction == 'polygon':
+                bounds = [r_ref[1].min(axis=2),r_ref[0].min(axis=2),
+                          r_ref[1].max(axis=2),r_ref[0].max(axis=2)]
+            else:
+                bounds = [r_ref[1],r_ref[0],r_ref[1],r_ref[0]]
+            bounds = np.column_stack([b.reshape(-1) for b in bounds])
+            ret = SpatialIndex(bounds)
+            self._index[abstraction] = (ref,ret)
+        return(ret)
+    
+    def get_intersects_mask(self,polygon):
+        '''Compute the intersects mask for a rectilinear grid without creating
+        cell geometries. Cell polygons are used if bounds are available.
+        Otherwise, cell centroids are used.
+        
+        :param polygon: The selection geometry.
+        :type polygon: :class:`shapely.geometry.Polygon` or :class:`shapely.geometry.MultiPolygon`
+        :returns: Boolean mask with shape (nrow,ncol) with `True` values for cells
+         not intersecting the polygon. `None` is returned if the grid is not
+         rectilinear.
+        :rtype: :class:`numpy.ndarray`
+        '''
+        
+        if self.row is None:
+            return(None)
+        
+        if self.row.bounds is not None and self.col.bounds is not None:
+            row_bounds = self.row.bounds
+            col_bounds = self.col.bounds
+            row_coords = row_bounds.mean(axis=1)
+            col_coords = col_bounds.mean(axis=1)
+            ref_corners = self.corners.data
+            
+            def _get_geom_(idx_row,idx_col):
+                return(Polygon(zip(ref_corners[1,idx_row,idx_col],ref_corners[0,idx_row,idx_col])))
+        else:
+            row_coords = self.row.value
+            col_coords = self.col.value
+            row_bounds = get_bounds_from_1d(row_coords)
+            col_bounds = get_bounds_from_1d(col_coords)
+            if row_bounds is None or col_bounds is None:
+                return(None)
+            
+            def _get_geom_(idx_row,idx_col):
+                return(Point(col_coords[idx_col],row_coords[idx_row]))
+            
+        ret = get_rectilinear_intersects_mask(polygon,row_bounds,col_bounds,row_coords,
+                                              col_coords,_get_geom_)
+        ## masked grid elements are never selected
+        if ret is not None:
+            ret = np.logical_or(ret,np.ma.getmaskarray(self.value)[0])
+        return(ret)
+    
     def _format_private_value_(self,value):
         if value is None:
             ret = None
@@ -460,6 +601,32 @@ class SpatialGridDimension(base.AbstractUidValueDimension):
         
         return(state)
         
+    def _get_corners_(self):
+        ## bounds may be ordered in either direction
+        ref_row_bounds = self.row.bounds
+        ref_col_bounds = self.col.bounds
+        row_min = ref_row_bounds.min(axis=1)[:,np.newaxis]
+        row_max = ref_row_bounds.max(axis=1)[:,np.newaxis]
+        col_min = ref_col_bounds.min(axis=1)[np.newaxis,:]
+        col_max = ref_col_bounds.max(axis=1)[np.newaxis,:]
+        
+        shp = (2,ref_row_bounds.shape[0],ref_col_bounds.shape[0],4)
+        fill = np.empty(shp,dtype=ref_row_bounds.dtype)
+        fill[0,:,:,0] = row_min
+        fill[0,:,:,1] = row_max
+        fill[0,:,:,2] = row_max
+        fill[0,:,:,3] = row_min
+        fill[1,:,:,0] = col_min
+        fill[1,:,:,1] = col_min
+        fill[1,:,:,2] = col_max
+        fill[1,:,:,3] = col_max
+        
+        mask = np.empty(shp,dtype=bool)
+        mask[:,:,:,:] = np.ma.getmaskarray(self.value)[0][np.newaxis,:,:,np.newaxis]
+        fill = np.ma.array(fill,mask=mask)
+        
+        return(fill)
+    
     def _get_uid_(self):
         if self._value is None:
             shp = len(self.row),len(self.col)
@@ -547,6 +714,7 @@ class SpatialGeometryPointDimension(base.AbstractUidValueDimension):
     
     def __init__(self,*args,**kwds):
         self.grid = kwds.pop('grid',None)
+        self._index = None
         
         super(SpatialGeometryPointDimension,self).__init__(*args,**kwds)
         
@@ -556,59 +724,92 @@ class SpatialGeometryPointDimension(base.AbstractUidValueDimension):
         ret = np.ma.array(ret,mask=self.value.mask)
         return(ret)
         
-    def get_intersects_masked(self,polygon):
-        
-#        def _intersects_point_(prepared,target):
-#            return(prepared.intersects(target))
-        
-        def _intersects_polygon_(index,target):
-            return(index_intersects(target,index))
+    def get_index(self):
+        '''
+        :returns: A spatial index constructed from the bounding boxes of all
+         geometries including masked geometries. The index is cached and rebuilt
+         only if the geometry values change.
+        :rtype: :class:`ocgis.util.spatial.index.SpatialIndex`
+        '''
+        ref_value = self.value
+        if self._index is None or self._index[0] is not ref_value:
+            index = SpatialIndex.from_geometries(ref_value.data.flat)
+            self._index = (ref_value,index)
+        return(self._index[1])
+        
+    def get_intersects_masked(self,polygon,source=None,slc=None):
+        '''
+        :param polygon: The selection geometry.
+        :type polygon: :class:`shapely.geometry.Polygon` or :class:`shapely.geometry.MultiPolygon`
+        :param source: The grid these geometries were sliced from. If provided,
+         the grid's spatial index is queried in place of the geometry index.
+        :type source: :class:`ocgis.interface.base.dimension.spatial.SpatialGridDimension`
+        :param slc: Tuple of row and column slices locating these geometries in
+         `source`.
+        :type slc: tuple of slice
+        '''
         
         ## when the selection geometry is a point, we want to return touches as
         ## it may fall on a geometry boundary only.
         if type(polygon) in (Point,MultiPoint):
             raise(NotImplementedError)
-#            ref_intersects = _intersects_point_
-#            obj = prep(polygon)
-        elif type(polygon) in (Polygon,MultiPolygon):
-            ## construct the spatial index
-            index_grid = build_index_grid(None,polygon)
-            obj = build_index(polygon,index_grid)
-            ref_intersects = _intersects_polygon_
+        elif type(polygon) == Polygon:
+            parts = [polygon]
+        elif type(polygon) == MultiPolygon:
+            parts = list(polygon)
         else:
             raise(NotImplementedError)
         
         ret = copy(self)
         fill = np.ma.array(self.value,mask=True)
-        ref_fill_mask = fill.mask
-        prepared = prep(polygon)
-        
-        for (ii,jj),geom in iter_array(self.value,return_value=True):
-            if prepared.intersects(geom):
-                ## the mask value is the inverse of the intersects operation
-                ref_fill_mask[ii,jj] = not ref_intersects(obj,geom)
-        
-        if ref_fill_mask.all():
+        r_fill_mask = fill.mask.reshape(-1)
+        r_mask = np.ma.getmaskarray(self.value).reshape(-1)
+        r_data = self.value.data.reshape(-1)
+        
+        ## find the geometries with bounding boxes intersecting the bounding box
+        ## of a polygon part. only these are tested against the part.
+        bounds = [part.bounds for part in parts]
+        if source is None:
+            idx_part,idx_geom = self.get_index().query_many(bounds)
+        else:
+            idx_part,idx_geom = source.get_index(self._axis.lower()).query_many(bounds)
+            ## map the source grid indices to indices of these geometries
+            idx_row,idx_col = np.unravel_index(idx_geom,source.shape)
+            idx_row = idx_row-slc[0].indices(source.shape[0])[0]
+            idx_col = idx_col-slc[1].indices(source.shape[1])[0]
+            shp = self.value.shape
+            select = np.logical_and(np.logical_and(idx_row >= 0,idx_row < shp[0]),
+                                    np.logical_and(idx_col >= 0,idx_col < shp[1]))
+            idx_part = idx_part[select]
+            idx_geom = idx_row[select]*shp[1]+idx_col[select]
+        prepared = [prep(part) for part in parts]
+        for ip,ig in zip(idx_part,idx_geom):
+            if r_mask[ig] or not r_fill_mask[ig]:
+                continue
+            geom = r_data[ig]
+            ## the mask value is the inverse of the intersects operation
+            if prepared[ip].intersects(geom) and not parts[ip].touches(geom):
+                r_fill_mask[ig] = False
+        
+        if r_fill_mask.all():
             ocgis_lh(exc=EmptySubsetError(self.name))
             
         ret._value = fill
         ret.uid.mask = fill.mask.copy()
+        ## the geometries are unchanged and a constructed index remains valid
+        if self._index is not None and self._index[0] is self.value:
+            ret._index = (fill,self._index[1])
+        else:
+            ret._index = None
                 
         return(ret)
     
-    def update_crs(self,to_sr,from_sr):
-        ## we are modifying the original source data and need to copy the new
-        ## values.
-        new_value = self.value.copy()
+    def update_crs(self,to_crs,from_crs):
         ## be sure and project masked geometries to maintain underlying geometries
         ## for masked values.
-        r_value = new_value.data
-        r_loads = wkb.loads
-        for (idx_row,idx_col),geom in iter_array(r_value,return_value=True,use_mask=False):
-            ogr_geom = CreateGeometryFromWkb(geom.wkb)
-            ogr_geom.AssignSpatialReference(from_sr)
-            ogr_geom.TransformTo(to_sr)
-            r_value[idx_row,idx_col] = r_loads(ogr_geom.ExportToWkb())
+        new_value = self.value.copy()
+        r_value = new_value.data.reshape(-1)
+        r_value[:] = get_transformed_geometries(r_value,from_crs,to_crs)
         self._value = new_value
             
     def write_fiona(self,path,crs,driver='ESRI Shapefile'):
@@ -675,8 +876,10 @@ class SpatialGeometryPolygonDimension(SpatialGeometryPointDimension):
         super(SpatialGeometryPolygonDimension,self).__init__(*args,**kwds)
         
         if self._value is None:
+            ## transformed grids keep their cell corners without a row and column
             if self.grid.row is None:
-                ocgis_lh(exc=ImproperPolygonBoundsError('Polygon dimensions require a row and column dimension with bounds.'))
+                if self.grid.corners is None:
+                    ocgis_lh(exc=ImproperPolygonBoundsError('Polygon dimensions require a row and column dimension with bounds.'))
             else:
                 if self.grid.row.bounds is None:
                     ocgis_lh(exc=ImproperPolygonBoundsError('Polygon dimensions require row and column dimension bounds to have delta > 0.'))
@@ -695,12 +898,17 @@ class SpatialGeometryPolygonDimension(SpatialGeometryPointDimension):
         return(self.area/self.area.max())
     
     def _get_value_(self):
-        ref_row_bounds = self.grid.row.bounds
-        ref_col_bounds = self.grid.col.bounds
+        ## all cell corners are computed at once from the grid bounds. the
+        ## coordinates are interleaved into (x,y) sequences and converted to
+        ## python lists which are the fastest input for polygon construction.
+        ref_corners = self.grid.corners.data
+        coords = np.empty(list(ref_corners.shape[1:])+[2],dtype=ref_corners.dtype)
+        coords[:,:,:,0] = ref_corners[1]
+        coords[:,:,:,1] = ref_corners[0]
+        coords = coords.reshape(-1,4,2).tolist()
+        
         fill = self._get_geometry_fill_()
-        r_data = fill.data
-        for idx_row,idx_col in itertools.product(range(ref_row_bounds.shape[0]),range(ref_col_bounds.shape[0])):
-            row_min,row_max = ref_row_bounds[idx_row,:].min(),ref_row_bounds[idx_row,:].max()
-            col_min,col_max = ref_col_bounds[idx_col,:].min(),ref_col_bounds[idx_col,:].max()
-            r_data[idx_row,idx_col] = Polygon([(col_min,row_min),(col_min,row_max),(col_max,row_max),(col_max,row_min)])
+        r_data = fill.data.reshape(-1)
+        for idx,coord in enumerate(coords):
+            r_data[idx] = Polygon(coord)
         return(fill)
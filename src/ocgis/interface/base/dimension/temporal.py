@@ -1,12 +1,9 @@
 import base
 import numpy as np
-from collections import deque
-import itertools
 import datetime
 from ocgis import constants
 from ocgis.util.logging_ocgis import ocgis_lh
 from ocgis.exc import EmptySubsetError
-from ocgis.util.helpers import get_is_date_between
 
 
 class TemporalDimension(base.VectorDimension):
@@ -14,91 +11,64 @@ class TemporalDimension(base.VectorDimension):
     _axis = 'T'
         
     def get_grouping(self,grouping):
-        ## map date parts to index positions in date part storage array and flip
-        ## they key-value pairs
-        group_map = dict(zip(range(0,7),self._date_parts,))
+        ## map date parts to index positions in date part storage array
         group_map_rev = dict(zip(self._date_parts,range(0,7),))
         
-        ## this array will hold the value data constructed differently depending
-        ## on if temporal bounds are present
-        value = np.empty((self.value.shape[0],3),dtype=object)
+        ## the lower bound, value, and upper bound of each time step
+        value = self._get_grouping_value_()
         
-        ## reference the value and bounds datetime object arrays
-        value_datetime = self._get_datetime_value_()
-        value_datetime_bounds = self._get_datetime_bounds_()
-        
-        ## populate the value array depending on the presence of bounds
-        if self.bounds is None:
-            value[:,:] = value_datetime.reshape(-1,1)
-        else:
-            value[:,0] = value_datetime_bounds[:,0]
-            value[:,1] = value_datetime
-            value[:,2] = value_datetime_bounds[:,1]
-        
-        def _get_attrs_(dt):
-            return([dt.year,dt.month,dt.day,dt.hour,dt.minute,dt.second,dt.microsecond])
-        
-        ## extract the date parts
-        parts = np.empty((len(self.value),len(self._date_parts)),dtype=int)
-        for row in range(parts.shape[0]):
-            parts[row,:] = _get_attrs_(value[row,1])
+        ## extract the date parts once into an integer array
+        parts = self._get_value_date_parts_()
         
         ## grouping is different for date part combinations v. seasonal
         ## aggregation.
         if isinstance(grouping[0],basestring):
-            unique = deque()
-            for idx in range(parts.shape[1]):
-                if group_map[idx] in grouping:
-                    fill = np.unique(parts[:,idx])
-                else:
-    #                fill = np.array([0])
-                    fill = [None]
-                unique.append(fill)
-    
-            select = deque()
-            idx2_seq = range(len(self._date_parts))
-            for idx in itertools.product(*[range(len(u)) for u in unique]):
-                select.append([unique[idx2][idx[idx2]] for idx2 in idx2_seq])
-            select = np.array(select)
-            dgroups = deque()
+            ## group keys are compared in date part order to maintain ordering
+            ## of the groups by year, month, etc.
+            idx_cmp = sorted([group_map_rev[group] for group in grouping])
+            ## encode each unique date part combination as a single integer to
+            ## assign group labels to each time step.
+            unique = []
+            inverse = []
+            for idx in idx_cmp:
+                u,inv = np.unique(parts[:,idx],return_inverse=True)
+                unique.append(u)
+                inverse.append(inv)
+            dims = [u.shape[0] for u in unique]
+            codes = np.ravel_multi_index(inverse,dims)
+            codes_unique,group_index = np.unique(codes,return_inverse=True)
             
-            idx_cmp = [group_map_rev[group] for group in grouping]
-                
-            keep_select = []
-            for idx in range(select.shape[0]):
-                match = select[idx,idx_cmp] == parts[:,idx_cmp]
-                dgrp = match.all(axis=1)
-                if dgrp.any():
-                    keep_select.append(idx)
-                    dgroups.append(dgrp)
-            select = select[keep_select,:]
-            assert(len(dgroups) == select.shape[0])
+            ## the date part values for each group. date parts not used in the
+            ## grouping are none.
+            select = np.empty((codes_unique.shape[0],len(self._date_parts)),dtype=object)
+            for idx,u,inv in zip(idx_cmp,unique,np.unravel_index(codes_unique,dims)):
+                select[:,idx] = u[inv]
             
+            dgroups = TemporalGroupSelection(group_index,select.shape[0])
             dtype = [(dp,object) for dp in self._date_parts]
         ## this is for seasonal aggregations
         else:
-            dgroups = deque()
-            for group in grouping:
-                subgroup = np.zeros(value.shape[0],dtype=bool)
-                for idx in range(value.shape[0]):
-                    if parts[idx,1] in group:
-                        subgroup[idx] = True
-                dgroups.append(subgroup)
+            dgroups = [np.in1d(parts[:,1],group) for group in grouping]
+            ## group labels are only available if the seasons do not overlap
+            if len(dgroups) > 0 and np.sum(dgroups,axis=0).max() > 1:
+                group_index = None
+            else:
+                group_index = np.empty(value.shape[0],dtype=int)
+                group_index.fill(-1)
+                for idx,dgrp in enumerate(dgroups):
+                    group_index[dgrp] = idx
             dtype = [('months',object)]
         
         ## init arrays to hold values and bounds for the grouped data
         new_value = np.empty((len(dgroups),),dtype=dtype)
-        new_bounds = np.empty((len(dgroups),2),dtype=object)
-        
-        for idx,dgrp in enumerate(dgroups):
+        for idx in range(new_value.shape[0]):
             ## tuple conversion is required for structure arrays: http://docs.scipy.org/doc/numpy/user/basics.rec.html#filling-structured-arrays
             try:
                 new_value[idx] = tuple(select[idx])
             ## likely a seasonal aggregation with a different group representation
             except UnboundLocalError:
                 new_value[idx] = (grouping[idx],)
-            sel = value[dgrp][:,(0,2)]
-            new_bounds[idx,:] = [sel.min(),sel.max()]
+        new_bounds = self._get_grouping_bounds_(value,dgroups)
         
         new_bounds = np.atleast_2d(new_bounds).reshape(-1,2)
         date_parts = np.atleast_1d(new_value)
@@ -106,8 +76,8 @@ class TemporalDimension(base.VectorDimension):
 
         return(self._get_temporal_group_dimension_(
                     grouping=grouping,date_parts=date_parts,bounds=new_bounds,
-                    dgroups=dgroups,value=repr_dt,name_value='time',name_uid='tid',
-                    name=self.name,meta=self.meta,units=self.units))
+                    dgroups=dgroups,group_index=group_index,value=repr_dt,name_value='time',
+                    name_uid='tid',name=self.name,meta=self.meta,units=self.units))
         
     def get_iter(self,*args,**kwds):
         r_name_value = self.name_value
@@ -123,12 +93,8 @@ class TemporalDimension(base.VectorDimension):
     def get_time_region(self,time_region,return_indices=False):
         assert(isinstance(time_region,dict))
         
-        ## return the values to use for the temporal region subsetting.
-        value = self._get_datetime_value_()
-        bounds = self._get_datetime_bounds_()
-        
         ## switch to indicate if bounds or centroid datetimes are to be used.
-        use_bounds = False if bounds is None else True
+        use_bounds = False if self.bounds is None else True
         
         ## remove any none values in the time_region dictionary. this will save
         ## time in iteration.
@@ -136,32 +102,30 @@ class TemporalDimension(base.VectorDimension):
         time_region = {k:v for k,v in time_region.iteritems() if v is not None}
         assert(len(time_region) > 0)
         
-        ## this is the boolean selection array.
-        select = np.zeros(self.shape[0],dtype=bool)
-        
-        ## for each row, determine if the date criterion are met updating the
-        ## select matrix accordingly.
-        row_check = np.zeros(len(time_region),dtype=bool)
+        ## the integer date parts of the values or bounds
+        if use_bounds:
+            parts = self._get_bounds_date_parts_()
+        else:
+            parts = self._get_value_date_parts_()
         
-        for idx_row in range(select.shape[0]):
-            ## do the comparison for each time_region element.
+        ## this is the boolean selection array. a time step is selected if each
+        ## time_region element is met.
+        select = np.ones(self.shape[0],dtype=bool)
+        for k,v in time_region.iteritems():
+            idx_part = self._date_parts.index(k)
+            v = np.array(v).reshape(-1)
             if use_bounds:
-                row = bounds[idx_row,:]
+                ## a time step is included if a requested part is between its
+                ## bounds' parts. the upper bound's part is excluded unless the
+                ## bounds' parts are equal. see get_is_date_between in
+                ## ocgis.util.helpers.
+                lower = parts[:,0,idx_part]
+                upper = parts[:,1,idx_part]
+                between = np.logical_and(v >= lower.reshape(-1,1),v < upper.reshape(-1,1)).any(axis=1)
+                fill = np.where(lower == upper,np.in1d(lower,v),between)
             else:
-                row = value[idx_row]
-            for ii,(k,v) in enumerate(time_region.iteritems()):
-                if use_bounds:
-                    to_include = []
-                    for element in v:
-                        kwds = {k:element}
-                        to_include.append(get_is_date_between(row[0],row[1],**kwds))
-                    fill = any(to_include)
-                else:
-                    part = getattr(row,k)
-                    fill = True if part in v else False
-                row_check[ii] = fill
-            if row_check.all():
-                select[idx_row] = True
+                fill = np.in1d(parts[:,idx_part],v)
+            select = np.logical_and(select,fill)
                 
         if not select.any():
             ocgis_lh(logger='nc.temporal',exc=EmptySubsetError(origin='temporal'))
@@ -174,6 +138,74 @@ class TemporalDimension(base.VectorDimension):
         
         return(ret)
     
+    def _get_date_parts_(self,value):
+        '''
+        :param value: One-dimensional array of datetime objects.
+        :type value: :class:`numpy.ndarray`
+        :returns: Integer array with shape (n,7) holding the date parts in the
+         order of :attr:`_date_parts`.
+        :rtype: :class:`numpy.ndarray`
+        '''
+        try:
+            ## standard datetime objects are converted to numpy datetimes and the
+            ## date parts computed with array arithmetic
+            dt = value.astype('datetime64[us]')
+        ## calendar-aware datetime objects (i.e. netcdftime) are not convertible
+        except (TypeError,ValueError):
+            parts = np.empty((value.shape[0],len(self._date_parts)),dtype=int)
+            for idx,attr in enumerate(self._date_parts):
+                parts[:,idx] = [getattr(v,attr) for v in value.flat]
+        else:
+            parts = get_datetime64_date_parts(dt)
+        return(parts)
+    
+    def _get_value_date_parts_(self):
+        '''Intended for subclasses to overload the method for accessing the date
+        parts of the values. See :meth:`_get_date_parts_`.'''
+        return(self._get_date_parts_(self._get_datetime_value_()))
+    
+    def _get_bounds_date_parts_(self):
+        '''Intended for subclasses to overload the method for accessing the date
+        parts of the bounds. The returned array has shape (n,2,7).'''
+        bounds = self._get_datetime_bounds_()
+        parts = self._get_date_parts_(bounds.reshape(-1))
+        return(parts.reshape(bounds.shape[0],2,parts.shape[-1]))
+    
+    def _get_grouping_value_(self):
+        '''
+        :returns: Array with shape (n,3) holding the lower bound, value, and upper
+         bound of each time step. The value is repeated if there are no bounds.
+        :rtype: :class:`numpy.ndarray`
+        '''
+        value = np.empty((self.value.shape[0],3),dtype=object)
+        value_datetime = self._get_datetime_value_()
+        if self.bounds is None:
+            value[:,:] = value_datetime.reshape(-1,1)
+        else:
+            value_datetime_bounds = self._get_datetime_bounds_()
+            value[:,0] = value_datetime_bounds[:,0]
+            value[:,1] = value_datetime
+            value[:,2] = value_datetime_bounds[:,1]
+        return(value)
+    
+    def _get_grouping_bounds_(self,value,dgroups):
+        ## the bounds of a group are the minimum and maximum of its time steps'
+        ## lower and upper bounds
+        new_bounds = np.empty((len(dgroups),2),dtype=object)
+        lower = np.minimum(value[:,0],value[:,2])
+        upper = np.maximum(value[:,0],value[:,2])
+        if isinstance(dgroups,TemporalGroupSelection):
+            ## date part groups are never empty. sort the time steps by group
+            ## and reduce over the group segments.
+            order = np.argsort(dgroups.group_index,kind='mergesort')
+            starts = np.searchsorted(dgroups.group_index[order],np.arange(len(dgroups)))
+            new_bounds[:,0] = np.minimum.reduceat(lower[order],starts)
+            new_bounds[:,1] = np.maximum.reduceat(upper[order],starts)
+        else:
+            for idx,dgrp in enumerate(dgroups):
+                new_bounds[idx,:] = [lower[dgrp].min(),upper[dgrp].max()]
+        return(new_bounds)
+    
     def _get_datetime_bounds_(self):
         '''Intended for subclasses to overload the method for accessing the datetime
         value. For example, netCDF times are floats that must be converted.'''
@@ -259,6 +291,60 @@ class TemporalGroupDimension(TemporalDimension):
     def __init__(self,*args,**kwds):
         self.grouping = kwds.pop('grouping')
         self.dgroups = kwds.pop('dgroups')
+        self.group_index = kwds.pop('group_index',None)
         self.date_parts = kwds.pop('date_parts')
                 
         TemporalDimension.__init__(self,*args,**kwds)
+
+
+def get_datetime64_date_parts(dt):
+    '''
+    :param dt: One-dimensional array of datetimes.
+    :type dt: :class:`numpy.ndarray` with dtype `datetime64[us]`
+    :returns: Integer array with shape (n,7) holding the year, month, day, hour,
+     minute, second, and microsecond.
+    :rtype: :class:`numpy.ndarray`
+    '''
+    parts = np.empty((dt.shape[0],7),dtype=int)
+    year = dt.astype('datetime64[Y]')
+    month = dt.astype('datetime64[M]')
+    day = dt.astype('datetime64[D]')
+    microseconds = (dt-day).astype(np.int64)
+    parts[:,0] = year.astype(np.int64)+1970
+    parts[:,1] = (month-year).astype(np.int64)+1
+    parts[:,2] = (day-month).astype(np.int64)+1
+    parts[:,3] = microseconds//3600000000
+    parts[:,4] = (microseconds//60000000)%60
+    parts[:,5] = (microseconds//1000000)%60
+    parts[:,6] = microseconds%1000000
+    return(parts)
+
+
+class TemporalGroupSelection(object):
+    '''
+    Sequence of boolean time step selection arrays derived from integer group
+    labels. Selection arrays are created on access.
+    
+    :param group_index: Group label for each time step. Time steps not in a group
+     have a negative label.
+    :type group_index: :class:`numpy.ndarray`
+    :param int ngroups: The number of groups.
+    '''
+    
+    def __init__(self,group_index,ngroups):
+        self.group_index = group_index
+        self.ngroups = ngroups
+        
+    def __getitem__(self,idx):
+        if idx < 0:
+            idx += self.ngroups
+        if idx < 0 or idx >= self.ngroups:
+            raise(IndexError('group index out of range'))
+        return(self.group_index == idx)
+    
+    def __iter__(self):
+        for idx in range(self.ngroups):
+            yield(self[idx])
+    
+    def __len__(self):
+        return(self.ngroups)
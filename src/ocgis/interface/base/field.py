@@ -1,5 +1,5 @@
 from ocgis.util.helpers import get_default_or_apply, get_none_or_slice,\
-    get_formatted_slice, get_reduced_slice, assert_raise
+    get_formatted_slice, get_reduced_slice, assert_raise, iter_array
 import numpy as np
 from copy import copy, deepcopy
 from collections import deque
@@ -13,6 +13,7 @@ from shapely.geometry.point import Point
 from ocgis.exc import ImproperPolygonBoundsError
 import logging
 from ocgis.util.logging_ocgis import ocgis_lh
+from ocgis.interface.base.dimension.spatial import SpatialGeometryDimension
         
 
 class Field(object):
@@ -150,6 +151,127 @@ class Field(object):
                     to_yld['value'] = ref_idx
                     yield(to_yld)
                 
+    def get_iter_batch(self,add_masked_value=True,value_keys=None,batch_size=None,formatter=None):
+        '''
+        Columnar alternative to :meth:`~ocgis.interface.base.field.Field.get_iter`.
+        Rows are produced in the same order with the same keys but are grouped into
+        batches of parallel arrays.
+        
+        :param bool add_masked_value: If `True`, masked values are included using
+         the default fill value. Otherwise, masked values are skipped.
+        :param value_keys: Names of the fields for structured value arrays returned
+         by keyed output functions. Masked elements are skipped for these arrays.
+        :type value_keys: sequence of str
+        :param int batch_size: The number of values to process per batch. Defaults
+         to :attr:`ocgis.constants.record_batch_size`.
+        :param formatter: Function taking a column array and returning an array of
+         the same length. It is applied to each column except "geom_index".
+         Dimension columns are formatted once and then gathered for each batch.
+        :type formatter: function
+        :returns: Tuples of the field's unmasked geometries and a batch dictionary
+         mapping row keys to arrays. The "geom_index" array indexes the geometry
+         array in place of the "geom" key.
+        :rtype: tuple
+        '''
+        
+        def _get_dimension_columns_(target):
+            attr = getattr(self,target)
+            if attr is None:
+                ret = ({},1)
+            else:
+                rows = [yld for _,yld in attr.get_iter()]
+                ret = ({key:_format_(_get_column_([row[key] for row in rows])) for key in rows[0]},len(rows))
+            return(ret)
+        
+        def _format_(arr):
+            if formatter is not None:
+                arr = formatter(arr)
+            return(arr)
+        
+        batch_size = batch_size or constants.record_batch_size
+        has_value_keys = False if value_keys is None else True
+        
+        ## dimension columns are constructed once using the dimension iterators
+        ## and gathered for each batch.
+        dimensions = map(_get_dimension_columns_,['realization','temporal','level'])
+        if self.level is None:
+            dimensions[2][0].update({key:_format_(_get_column_([None])) for key in constants.level_headers})
+        
+        ## the spatial columns only include unmasked geometries
+        geoms,spatial_rows,spatial_cols,gids = [],[],[],[]
+        for row_idx,col_idx,geom,gid in self.spatial.get_geom_iter():
+            spatial_rows.append(row_idx)
+            spatial_cols.append(col_idx)
+            geoms.append(geom)
+            gids.append(gid)
+        geoms = _get_column_(geoms,dtype=object)
+        spatial_rows = np.array(spatial_rows,dtype=int)
+        spatial_cols = np.array(spatial_cols,dtype=int)
+        gids = _format_(_get_column_(gids))
+        
+        formatted_fill_value = _format_(_get_column_([constants.fill_value]))[0]
+        
+        shp = [d[1] for d in dimensions]+[geoms.shape[0]]
+        size = np.prod(shp)
+        r_gid_name = self.spatial.name_uid
+        for variable in self.variables.itervalues():
+            yld = self._get_variable_iter_yield_(variable)
+            ref_value = variable.value
+            for start in range(0,size,batch_size):
+                idx = np.unravel_index(np.arange(start,min(start+batch_size,size)),shp)
+                value = ref_value[idx[0],idx[1],idx[2],spatial_rows[idx[3]],spatial_cols[idx[3]]]
+                mask = np.ma.getmaskarray(value)
+                value = np.ma.getdata(value)
+                
+                ## select the values to return. structure array values may return
+                ## more than one row per element.
+                if has_value_keys:
+                    select = np.invert(mask)
+                    repeats = np.array([element.shape[0] for element in value[select]],dtype=int)
+                elif add_masked_value:
+                    select = None
+                    ## formatted columns keep the value data type and fill
+                    ## masked positions after formatting
+                    if mask.any() and formatter is None:
+                        value = value.astype(object)
+                        value[mask] = constants.fill_value
+                else:
+                    select = np.invert(mask)
+                    
+                def _get_batch_column_(arr):
+                    if select is not None:
+                        arr = arr[select]
+                        if has_value_keys:
+                            arr = np.repeat(arr,repeats)
+                    return(arr)
+                
+                idx = [_get_batch_column_(i) for i in idx]
+                batch = {}
+                nrows = idx[0].shape[0]
+                for key,v in yld.iteritems():
+                    batch[key] = np.repeat(_format_(_get_column_([v])),nrows)
+                for ii,(columns,_) in enumerate(dimensions):
+                    for key,column in columns.iteritems():
+                        batch[key] = column[idx[ii]]
+                batch['geom_index'] = idx[3]
+                batch[r_gid_name] = gids[idx[3]]
+                
+                if has_value_keys:
+                    elements = value[select]
+                    for vk in value_keys:
+                        if elements.shape[0] == 0:
+                            batch[vk] = np.array([])
+                        else:
+                            batch[vk] = np.concatenate([element[vk] for element in elements])
+                        batch[vk] = _format_(batch[vk])
+                else:
+                    batch['value'] = _format_(_get_batch_column_(value))
+                    if add_masked_value and formatter is not None and mask.any():
+                        batch['value'][mask] = formatted_fill_value
+                
+                if nrows > 0:
+                    yield(geoms,batch)
+                
     def get_shallow_copy(self):
         return(copy(self))
     
@@ -161,20 +283,32 @@ class Field(object):
         ret.variables = variables
         return(ret)
     
-    def _get_spatial_operation_(self,attr,polygon):
-        ref = getattr(self.spatial,attr)
-        ret = copy(self)
-        ret.spatial,slc = ref(polygon,return_indices=True)
-        slc = [slice(None),slice(None),slice(None)] + list(slc)
-        ret.variables = self.variables._get_sliced_variables_(slc)
-
-        ## we need to update the value mask with the geometry mask
-        self._set_new_value_mask_(ret,ret.spatial.get_mask())
+    def _get_masked_spatial_subset_(self,row_slc,col_slc,mask):
+        ## the subset shares data with this field. masks are always new arrays
+        ## so this field's masks are not modified.
+        ret = self[:,:,:,row_slc,col_slc]
+        ret.spatial = copy(ret.spatial)
+        grid = copy(ret.spatial.grid)
+        grid._value = np.ma.array(grid.value.data,mask=np.logical_or(np.ma.getmaskarray(grid.value),mask))
+        grid.uid = np.ma.array(np.ma.getdata(grid.uid),mask=np.logical_or(np.ma.getmaskarray(grid.uid),mask))
+        ret.spatial.grid = grid
+        ret.spatial.uid = grid.uid
+        ## geometries are rebuilt from the masked grid when requested
+        ret.spatial._geom = None
+        
+        new_variables = []
+        for variable in ret.variables.itervalues():
+            new_variable = copy(variable)
+            r_value = variable.value
+            new_variable._value = np.ma.array(r_value.data,mask=np.logical_or(np.ma.getmaskarray(r_value),mask),
+                                              fill_value=r_value.fill_value)
+            new_variables.append(new_variable)
+        ret.variables = VariableCollection(variables=new_variables)
         
         return(ret)
     
-    def get_spatially_aggregated(self,new_spatial_uid=None):
-
+    def _get_spatially_aggregated_spatial_(self,new_spatial_uid):
+        
         def _get_geometry_union_(value):
             to_union = [geom for geom in value.compressed().flat]
             processed_to_union = deque()
@@ -195,59 +329,147 @@ class Field(object):
             return(ret)
         
         ret = copy(self)
-        ## the spatial dimension needs to be deep copied so the grid may be
-        ## dereferenced.
-        ret.spatial = deepcopy(self.spatial)
         ## this is the new spatial identifier for the spatial dimension.
         new_spatial_uid = new_spatial_uid or 1
-        ## aggregate the geometry containers if possible.
-        if ret.spatial.geom.point is not None:
-            unioned = _get_geometry_union_(ret.spatial.geom.point.value)
-            ret.spatial.geom.point._value = unioned
-            ret.spatial.geom.point.uid = new_spatial_uid
-            
+        ## aggregate the geometry containers if possible. the aggregated spatial
+        ## dimension is a shallow copy referencing only the unioned geometries.
+        point = self.spatial.geom.point
+        if point is not None:
+            unioned = _get_geometry_union_(point.value)
+            point = copy(point)
+            point.grid = None
+            point._index = None
+            point._value = unioned
+            point.uid = new_spatial_uid
+            ## the geometry type of the point dimension is now MultiPoint
+            point._geom_type = 'MultiPoint'
+        
+        polygon = None
         try:
-            if ret.spatial.geom.polygon is not None:
-                unioned = _get_geometry_union_(ret.spatial.geom.polygon.value)
-                ret.spatial.geom.polygon._value = _get_geometry_union_(ret.spatial.geom.polygon.value)
-                ret.spatial.geom.polygon.uid = new_spatial_uid
+            polygon = self.spatial.geom.polygon
+            if polygon is not None:
+                unioned = _get_geometry_union_(polygon.value)
+                polygon = copy(polygon)
+                polygon.grid = None
+                polygon._index = None
+                polygon._value = unioned
+                polygon.uid = new_spatial_uid
         except ImproperPolygonBoundsError:
             msg = 'No polygon representation to aggregate.'
             ocgis_lh(msg=msg,logger='field',level=logging.WARN)
         
+        ret.spatial = copy(self.spatial)
+        ret.spatial._geom = SpatialGeometryDimension(point=point,polygon=polygon)
         ## update the spatial uid
         ret.spatial.uid = new_spatial_uid
         ## there are no grid objects for aggregated spatial dimensions.
         ret.spatial.grid = None
         ret.spatial._geom_to_grid = False
-        ## next the values are aggregated.
+        
+        return(ret)
+    
+    def _get_spatial_operation_(self,attr,polygon):
+        ref = getattr(self.spatial,attr)
+        ret = copy(self)
+        ret.spatial,slc = ref(polygon,return_indices=True)
+        slc = [slice(None),slice(None),slice(None)] + list(slc)
+        ret.variables = self.variables._get_sliced_variables_(slc)
+
+        ## we need to update the value mask with the geometry mask
+        self._set_new_value_mask_(ret,ret.spatial.get_mask())
+        
+        return(ret)
+    
+    def get_spatially_aggregated(self,new_spatial_uid=None):
+        ret = self._get_spatially_aggregated_spatial_(new_spatial_uid)
+        
+        ## next the values are aggregated with a weighted average over the
+        ## spatial axes. this is equivalent to calling numpy.ma.average on each
+        ## two-dimensional slice.
         shp = list(ret.shape)
         shp[-2] = 1
         shp[-1] = 1
-        itrs = [range(dim) for dim in shp[0:3]]
-        weights = self.spatial.weights
-        ref_average = np.ma.average
+        weights = np.ma.filled(self.spatial.weights,0.0).astype(float).reshape(-1)
         
         ## old values for the variables will be stored in the _raw container, but
         ## to avoid reference issues, we need to copy the variables
         new_variables = []
         for variable in ret.variables.itervalues():
             r_value = variable.value
-            fill = np.ma.array(np.zeros(shp),mask=False,dtype=variable.value.dtype)
-            for idx_r,idx_t,idx_l in itertools.product(*itrs):
-                fill[idx_r,idx_t,idx_l] = ref_average(r_value[idx_r,idx_t,idx_l],weights=weights)
+            r_value = r_value.reshape(shp[0:3]+[-1])
+            unmasked = np.invert(np.ma.getmaskarray(r_value))
+            numerator = np.where(unmasked,r_value.data*weights,0).sum(axis=-1)
+            denominator = (unmasked*weights).sum(axis=-1)
+            ## averages without any unmasked and weighted values are masked
+            mask = denominator == 0
+            denominator[mask] = 1
+            fill = np.ma.array(numerator/denominator,mask=mask).astype(variable.value.dtype)
+            fill = fill.reshape(shp)
             new_variable = copy(variable)
             new_variable._value = fill
             new_variables.append(new_variable)
         ret.variables = VariableCollection(variables=new_variables)
         
-        ## the geometry type of the point dimension is now MultiPoint
-        ret.spatial.geom.point._geom_type = 'MultiPoint'
-        
         ## we want to keep a copy of the raw data around for later calculations.
         ret._raw = copy(self)
                 
         return(ret)
+    
+    def iter_spatially_aggregated(self,weights,new_spatial_uids,clip_polygons=None):
+        '''
+        Spatially aggregate the field for each row of a weight matrix. The variable
+        values are aggregated for all rows at once and only the geometries are
+        processed per row.
+        
+        :param weights: The weight matrix with a row for each selection geometry.
+        :type weights: :class:`ocgis.util.spatial.weights.SpatialWeights`
+        :param new_spatial_uids: The spatial identifier for each row.
+        :type new_spatial_uids: sequence of int
+        :param clip_polygons: If provided, the cell geometries of each row are
+         clipped by the polygon with the same index before they are unioned.
+        :type clip_polygons: sequence of :class:`shapely.geometry.Polygon`
+        :returns: An aggregated field for each row. `None` is yielded for rows
+         without any cells.
+        :rtype: :class:`ocgis.interface.base.field.Field`
+        '''
+        
+        aggregated = {}
+        for variable in self.variables.itervalues():
+            aggregated[variable.alias] = weights.get_aggregated(variable.value)
+        
+        for idx,new_spatial_uid in enumerate(new_spatial_uids):
+            cells,_ = weights.get_row(idx)
+            if cells.shape[0] == 0:
+                yield(None)
+                continue
+            
+            ## subset the field by the bounding box of the row's cells and mask
+            ## the cells outside the row
+            idx_row,idx_col = np.unravel_index(cells,weights.shape)
+            row_slc = slice(idx_row.min(),idx_row.max()+1)
+            col_slc = slice(idx_col.min(),idx_col.max()+1)
+            mask = np.ones((row_slc.stop-row_slc.start,col_slc.stop-col_slc.start),dtype=bool)
+            mask[idx_row-row_slc.start,idx_col-col_slc.start] = False
+            sub = self._get_masked_spatial_subset_(row_slc,col_slc,mask)
+            
+            if clip_polygons is not None:
+                ref_value = sub.spatial.geom.polygon.value
+                for (row_idx,col_idx),geom in iter_array(ref_value,return_value=True):
+                    ref_value[row_idx,col_idx] = geom.intersection(clip_polygons[idx])
+            
+            ret = sub._get_spatially_aggregated_spatial_(new_spatial_uid)
+            shp = list(ret.shape)
+            shp[-2] = 1
+            shp[-1] = 1
+            new_variables = []
+            for variable in ret.variables.itervalues():
+                new_variable = copy(variable)
+                new_variable._value = aggregated[variable.alias][:,:,:,idx].reshape(shp)
+                new_variables.append(new_variable)
+            ret.variables = VariableCollection(variables=new_variables)
+            ret._raw = sub
+            
+            yield(ret)
 
     def _get_value_from_source_(self,*args,**kwds):
         raise(NotImplementedError)
@@ -276,6 +498,22 @@ class Field(object):
         return(yld)
 
 
+def _get_column_(values,dtype=None):
+    ## a one-dimensional array for a sequence of row values. values such as
+    ## geometries and tuples are stored as objects.
+    ret = np.empty(len(values),dtype=dtype or object)
+    for idx,value in enumerate(values):
+        ret[idx] = value
+    if dtype is None:
+        try:
+            converted = np.array(values)
+            if converted.ndim == 1 and converted.dtype != object:
+                ret = converted
+        except ValueError:
+            pass
+    return(ret)
+
+
 class DerivedField(Field):
     
     def _get_variable_iter_yield_(self,variable):
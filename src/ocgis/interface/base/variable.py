@@ -80,6 +80,9 @@ class Variable(AbstractSourcedVariable):
         self.units = units
         self.meta = meta or {}
         self.uid = uid
+        ## set by calculations streaming the values from source. `True` if all
+        ## values read by the calculation are masked.
+        self._streamed_all_masked = None
         
         super(Variable,self).__init__(value=value,data=data,debug=debug,did=did)
         
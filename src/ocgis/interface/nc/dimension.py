@@ -39,4 +39,4 @@ class NcVectorDimension(VectorDimension):
                     else:
                         ocgis_lh(exc=e,logger='interface.nc')
         finally:
-            ds.close()
+            self._data._close_(ds)
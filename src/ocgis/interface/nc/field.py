@@ -2,6 +2,8 @@ from ocgis.interface.base.field import Field
 import numpy as np
 from copy import deepcopy
 from ocgis.util.logging_ocgis import ocgis_lh
+from ocgis.util.helpers import get_hyperslabs
+import itertools
 
 
 class NcField(Field):
@@ -22,10 +24,6 @@ class NcField(Field):
             axis_slc['R'] = self.realization._src_idx
         if self.level is not None:
             axis_slc['Z'] = self.level._src_idx
-        ## check for singletons in the indices and convert those from NumPy arrays.
-        ## an index error is raised otherwise.
-        axis_slc = {k:v if len(v) > 1 else slice(v[0],v[0]+1) for k,v in axis_slc.iteritems()}
-        
         dim_map = data._source_metadata['dim_map']
         slc = [None for v in dim_map.values() if v is not None]
         axes = deepcopy(slc)
@@ -42,7 +40,7 @@ class NcField(Field):
         ds = data._open_()
         try:
             try:
-                raw = ds.variables[variable_name].__getitem__(slc)
+                raw = get_hyperslab_value(ds.variables[variable_name],slc)
             except IndexError:
                 ocgis_lh(logger='nc.field',exc=IndexError('variable: {0}'.format(variable_name)))
             if not isinstance(raw,np.ma.MaskedArray):
@@ -69,4 +67,54 @@ class NcField(Field):
 #            if self.spatial._geom is not None:
 #                self._set_new_value_mask_(self,self.spatial.get_mask())
         finally:
-            ds.close()
+            data._close_(ds)
+
+
+def get_hyperslab_value(variable,idx):
+    '''
+    Read the values of a netCDF variable for source indices on each of its
+    dimensions. Increasing indices are read as contiguous hyperslabs and stitched
+    together. See :func:`~ocgis.util.helpers.get_hyperslabs`.
+    
+    :param variable: The netCDF variable to read.
+    :type variable: :class:`netCDF4.Variable`
+    :param idx: Integer index arrays with one array for each variable dimension.
+    :type idx: sequence of :class:`numpy.ndarray`
+    :rtype: :class:`numpy.ndarray` or :class:`numpy.ma.MaskedArray`
+    '''
+    shape = [len(i) for i in idx]
+    size = np.prod(shape)
+    
+    ## the hyperslabs for each dimension with the positions of the block values
+    ## in the output array
+    blocks = []
+    for ii,i in enumerate(idx):
+        i = np.asarray(i)
+        if np.all(np.diff(i) > 0):
+            plane = size/shape[ii]
+            dim_blocks = []
+            position = 0
+            for slc,local in get_hyperslabs(i,plane=plane):
+                count = slc.stop-slc.start if local is None else local.shape[0]
+                dim_blocks.append((slc,local,slice(position,position+count)))
+                position += count
+        else:
+            ## unordered indices are passed through
+            dim_blocks = [(i,None,slice(None))]
+        blocks.append(dim_blocks)
+    
+    ret = None
+    for combination in itertools.product(*blocks):
+        value = variable.__getitem__([c[0] for c in combination])
+        for axis,(_,local,_) in enumerate(combination):
+            if local is not None:
+                value = value.take(local,axis=axis)
+        if all([len(b) == 1 for b in blocks]):
+            ret = value
+        else:
+            if ret is None:
+                ret = np.ma.array(np.empty(shape,dtype=value.dtype),mask=False)
+                if isinstance(value,np.ma.MaskedArray):
+                    ret.fill_value = value.fill_value
+            ret[tuple([c[2] for c in combination])] = value
+    return(ret)
@@ -1,19 +1,23 @@
-from ocgis.interface.base.dimension.temporal import TemporalDimension
+from ocgis.interface.base.dimension.temporal import TemporalDimension,\
+    get_datetime64_date_parts
 from ocgis.interface.nc.dimension import NcVectorDimension
 import numpy as np
 import netCDF4 as nc
 import datetime
+import re
 from ocgis.util.helpers import iter_array, get_none_or_slice
 
 
 class NcTemporalDimension(NcVectorDimension,TemporalDimension):
-    _attrs_slice = ('uid','_value','_src_idx','_value_datetime')
+    _attrs_slice = ('uid','_value','_src_idx','_value_datetime','_value_date_parts')
     
     def __init__(self,*args,**kwds):
         self.calendar = kwds.pop('calendar')
         self.format_time = kwds.pop('format_time',True)
         self._value_datetime = kwds.pop('value_datetime',None)
         self._bounds_datetime = kwds.pop('bounds_datetime',None)
+        self._value_date_parts = None
+        self._bounds_date_parts = None
         
         NcVectorDimension.__init__(self,*args,**kwds)
         
@@ -44,16 +48,53 @@ class NcTemporalDimension(NcVectorDimension,TemporalDimension):
             self._value_datetime = np.atleast_1d(self.get_datetime(self.value))
         return(self._value_datetime)
     
+    @property
+    def value_date_parts(self):
+        '''Integer array with shape (n,7) holding the date parts of the values.
+        See :meth:`get_date_parts`.'''
+        if self._value_date_parts is None:
+            self._value_date_parts = self.get_date_parts(self.value)
+        return(self._value_date_parts)
+    
+    @property
+    def bounds_date_parts(self):
+        '''Integer array with shape (n,2,7) holding the date parts of the bounds
+        or `None` if there are no bounds.'''
+        if self.bounds is not None:
+            if self._bounds_date_parts is None:
+                self._bounds_date_parts = self.get_date_parts(self.bounds)
+        return(self._bounds_date_parts)
+    
     def get_between(self,lower,upper,return_indices=False):
         lower,upper = tuple(self.get_nc_time([lower,upper]))
         return(NcVectorDimension.get_between(self,lower,upper,return_indices=return_indices))
         
+    def get_date_parts(self,arr):
+        '''
+        :param arr: Numeric time values.
+        :type arr: :class:`numpy.ndarray`
+        :returns: Integer array with the shape of ``arr`` plus a last axis holding
+         the year, month, day, hour, minute, second, and microsecond. See
+         :func:`~ocgis.interface.nc.temporal.get_date_parts_from_offsets`.
+        :rtype: :class:`numpy.ndarray`
+        '''
+        ret = get_date_parts_from_offsets(arr,self.units,self.calendar)
+        if ret is None:
+            value = self.get_datetime(arr)
+            ret = TemporalDimension._get_date_parts_(self,value.reshape(-1))
+            ret = ret.reshape(value.shape+(ret.shape[-1],))
+        return(ret)
+        
     def get_datetime(self,arr):
-        arr = np.atleast_1d(nc.num2date(arr,self.units,calendar=self.calendar))
-        dt = datetime.datetime
-        for idx,t in iter_array(arr,return_value=True):
-            arr[idx] = dt(t.year,t.month,t.day,
-                          t.hour,t.minute,t.second)
+        parts = get_date_parts_from_offsets(arr,self.units,self.calendar)
+        if parts is None:
+            arr = np.atleast_1d(nc.num2date(arr,self.units,calendar=self.calendar))
+            dt = datetime.datetime
+            for idx,t in iter_array(arr,return_value=True):
+                arr[idx] = dt(t.year,t.month,t.day,
+                              t.hour,t.minute,t.second)
+        else:
+            arr = get_datetime_from_date_parts(parts)
         return(arr)
     
     def get_nc_time(self,values):
@@ -63,6 +104,7 @@ class NcTemporalDimension(NcVectorDimension,TemporalDimension):
     def _format_slice_state_(self,state,slc):
         state = NcVectorDimension._format_slice_state_(self,state,slc)
         state.bounds_datetime = get_none_or_slice(state._bounds_datetime,(slc,slice(None)))
+        state._bounds_date_parts = get_none_or_slice(state._bounds_date_parts,(slc,slice(None),slice(None)))
         return(state)
     
     def _get_datetime_bounds_(self):
@@ -79,6 +121,28 @@ class NcTemporalDimension(NcVectorDimension,TemporalDimension):
             ret = self.value
         return(ret)
     
+    def _get_grouping_bounds_(self,value,dgroups):
+        ## group bounds are computed from the numeric values. only the group
+        ## bounds are converted to datetime objects.
+        ret = TemporalDimension._get_grouping_bounds_(self,value,dgroups)
+        return(self.get_datetime(ret.astype(value.dtype)))
+    
+    def _get_grouping_value_(self):
+        value = np.empty((self.value.shape[0],3),dtype=self.value.dtype)
+        if self.bounds is None:
+            value[:,:] = self.value.reshape(-1,1)
+        else:
+            value[:,0] = self.bounds[:,0]
+            value[:,1] = self.value
+            value[:,2] = self.bounds[:,1]
+        return(value)
+    
+    def _get_bounds_date_parts_(self):
+        return(self.bounds_date_parts)
+    
+    def _get_value_date_parts_(self):
+        return(self.value_date_parts)
+    
     def _get_temporal_group_dimension_(self,*args,**kwds):
         kwds['calendar'] = self.calendar
         kwds['units'] = self.units
@@ -102,6 +166,114 @@ class NcTemporalGroupDimension(NcTemporalDimension):
     def __init__(self,*args,**kwds):
         self.grouping = kwds.pop('grouping')
         self.dgroups = kwds.pop('dgroups')
+        self.group_index = kwds.pop('group_index',None)
         self.date_parts = kwds.pop('date_parts')
                 
         NcTemporalDimension.__init__(self,*args,**kwds)
+
+
+## microseconds in each time unit
+_time_unit_microseconds = {'days':86400000000,'day':86400000000,'d':86400000000,
+                           'hours':3600000000,'hour':3600000000,'hrs':3600000000,'hr':3600000000,'h':3600000000,
+                           'minutes':60000000,'minute':60000000,'mins':60000000,'min':60000000,
+                           'seconds':1000000,'second':1000000,'secs':1000000,'sec':1000000,'s':1000000}
+## month lengths for calendars without leap years
+_calendar_month_lengths = {'noleap':[31,28,31,30,31,30,31,31,30,31,30,31],
+                           '365_day':[31,28,31,30,31,30,31,31,30,31,30,31],
+                           'all_leap':[31,29,31,30,31,30,31,31,30,31,30,31],
+                           '366_day':[31,29,31,30,31,30,31,31,30,31,30,31],
+                           '360_day':[30]*12}
+_calendar_gregorian = ('standard','gregorian','proleptic_gregorian')
+## the first date of the gregorian calendar in mixed julian/gregorian calendars
+_gregorian_start = np.datetime64('1582-10-15','us')
+## time units with a reference date in universal time
+_re_time_units = re.compile(r'^\s*(\w+)\s+since\s+(\d+)-(\d+)-(\d+)'
+                            r'(?:[ T]+(\d+):(\d+)(?::(\d+(?:\.\d*)?))?)?'
+                            r'\s*(?:Z|UTC|GMT|[+-]0+(?::?0+)?)?\s*$',re.IGNORECASE)
+
+
+def get_date_parts_from_offsets(arr,units,calendar):
+    '''
+    Compute date parts from numeric time values with array arithmetic. Datetime
+    objects are not created. Supported calendars are the standard, gregorian,
+    proleptic_gregorian, noleap, 365_day, all_leap, 366_day, and 360_day
+    calendars. Values are rounded to the nearest microsecond.
+    
+    :param arr: Numeric time values.
+    :type arr: :class:`numpy.ndarray`
+    :param str units: The time units (i.e. "days since 1850-1-1").
+    :param str calendar: The time calendar.
+    :returns: Integer array with the shape of ``arr`` plus a last axis holding
+     the year, month, day, hour, minute, second, and microsecond or `None` if
+     the calendar, units, or values are not supported.
+    :rtype: :class:`numpy.ndarray`
+    '''
+    calendar = str(calendar).lower()
+    if calendar not in _calendar_gregorian and calendar not in _calendar_month_lengths:
+        return(None)
+    match = _re_time_units.match(str(units))
+    if match is None:
+        return(None)
+    factor = _time_unit_microseconds.get(match.group(1).lower())
+    if factor is None:
+        return(None)
+    
+    arr = np.atleast_1d(arr)
+    if isinstance(arr,np.ma.MaskedArray):
+        if np.ma.getmaskarray(arr).any():
+            return(None)
+        arr = arr.data
+    offsets = np.round(arr.astype(np.float64).reshape(-1)*factor).astype(np.int64)
+    
+    year,month,day = [int(g) for g in match.group(2,3,4)]
+    hour,minute = [int(g or 0) for g in match.group(5,6)]
+    second = float(match.group(7) or 0)
+    offsets += ((hour*60+minute)*60)*1000000+int(round(second*1000000))
+    
+    if calendar in _calendar_gregorian:
+        try:
+            base = np.datetime64('{0:04d}-{1:02d}-{2:02d}'.format(year,month,day),'us')
+        except ValueError:
+            return(None)
+        dt = base+offsets.astype('timedelta64[us]')
+        ## dates before the gregorian calendar use the julian calendar
+        if calendar != 'proleptic_gregorian':
+            if base < _gregorian_start or (dt.shape[0] > 0 and dt.min() < _gregorian_start):
+                return(None)
+        parts = get_datetime64_date_parts(dt)
+    else:
+        lengths = _calendar_month_lengths[calendar]
+        if month < 1 or month > 12 or day < 1 or day > lengths[month-1]:
+            return(None)
+        cumulative = np.cumsum([0]+lengths)
+        days_per_year = cumulative[-1]
+        day_microseconds = _time_unit_microseconds['days']
+        offsets += (year*days_per_year+cumulative[month-1]+day-1)*day_microseconds
+        days = offsets//day_microseconds
+        microseconds = offsets-days*day_microseconds
+        years = days//days_per_year
+        day_of_year = days-years*days_per_year
+        months = np.searchsorted(cumulative,day_of_year,side='right')
+        parts = np.empty((offsets.shape[0],7),dtype=int)
+        parts[:,0] = years
+        parts[:,1] = months
+        parts[:,2] = day_of_year-cumulative[months-1]+1
+        parts[:,3] = microseconds//3600000000
+        parts[:,4] = (microseconds//60000000)%60
+        parts[:,5] = (microseconds//1000000)%60
+        parts[:,6] = microseconds%1000000
+    return(parts.reshape(arr.shape+(7,)))
+
+def get_datetime_from_date_parts(parts):
+    '''
+    :param parts: Date parts as returned by :func:`~ocgis.interface.nc.temporal.get_date_parts_from_offsets`.
+    :type parts: :class:`numpy.ndarray`
+    :returns: Object array of :class:`datetime.datetime` without microseconds.
+    :rtype: :class:`numpy.ndarray`
+    '''
+    dt = datetime.datetime
+    ret = np.empty(parts.shape[0:-1],dtype=object)
+    flat = ret.reshape(-1)
+    for idx,row in enumerate(parts.reshape(-1,parts.shape[-1])[:,0:6].tolist()):
+        flat[idx] = dt(*row)
+    return(ret)
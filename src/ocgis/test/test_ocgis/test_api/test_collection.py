@@ -11,6 +11,7 @@ from copy import copy
 from ocgis.calc.library.math import Divide
 from ocgis.test.test_ocgis.test_interface.test_base.test_field import AbstractTestField
 from ocgis.calc.library.thresholds import Threshold
+import pickle
 
 
 class TestSpatialCollection(AbstractTestField):
@@ -27,6 +28,21 @@ class TestSpatialCollection(AbstractTestField):
         self.assertIsInstance(sp.geoms[25],MultiPolygon)
         self.assertIsInstance(sp.properties[25],dict)
         self.assertEqual(sp[25]['tmax'].variables['tmax'].value.shape,(2, 31, 2, 3, 4))
+        
+    def test_pickle(self):
+        field = self.get_field(with_value=True)
+        sc = ShpCabinet()
+        meta = sc.get_meta('state_boundaries')
+        sp = SpatialCollection(meta=meta,key='state_boundaries')
+        for row in sc.iter_geoms('state_boundaries',select_ugid=[2,25]):
+            sp.add_field(row['properties']['UGID'],row['geom'],field.variables.keys()[0],
+                         field,properties=row['properties'])
+        sp2 = pickle.loads(pickle.dumps(sp,pickle.HIGHEST_PROTOCOL))
+        self.assertEqual(sp2.keys(),[2,25])
+        self.assertEqual(sp2.key,'state_boundaries')
+        self.assertEqual(sp2.headers,sp.headers)
+        self.assertTrue(sp2.geoms[25].equals(sp.geoms[25]))
+        self.assertNumpyAll(sp2[25]['tmax'].variables['tmax'].value,sp[25]['tmax'].variables['tmax'].value)
     
     def test_iteration(self):
         field = self.get_field(with_value=True)
@@ -49,6 +65,40 @@ class TestSpatialCollection(AbstractTestField):
             self.assertEqual(len(row),2)
             self.assertEqual(len(row[1]),len(constants.raw_headers))
             
+    def test_iteration_batch(self):
+        field = self.get_field(with_value=True,month_count=2)
+        field.variables['tmax'].value.mask[0,1,0,1,1] = True
+        field.temporal.name_uid = 'tid'
+        field.level.name_uid = 'lid'
+        field.spatial.name_uid = 'gid'
+        
+        tgd = field.temporal.get_grouping(['month'])
+        ret = Mean(field=field,tgd=tgd,alias='my_mean').execute()
+        kwds = copy(field.__dict__)
+        kwds.pop('_raw')
+        kwds.pop('_variables')
+        kwds['temporal'] = tgd
+        kwds['variables'] = ret
+        cfield = DerivedField(**kwds)
+        cfield.temporal.name_uid = 'tid'
+        cfield.temporal.name_value = 'time'
+        
+        for f,headers in [(field,constants.raw_headers),(cfield,constants.calc_headers)]:
+            sp = SpatialCollection(headers=headers)
+            for ugid in [4,7]:
+                sp.add_field(ugid,None,f.variables.keys()[0],f)
+            ## the batches contain the same rows as the dictionary iterator
+            rows = list(sp.get_iter_dict(use_upper_keys=True))
+            ctr = 0
+            for geoms,geom_index,batch in sp.get_iter_batch(use_upper_keys=True,batch_size=100):
+                self.assertEqual(set(batch.keys()),set([h.upper() for h in headers]))
+                for ii in range(geom_index.shape[0]):
+                    geom,row = rows[ctr]
+                    self.assertTrue(geoms[geom_index[ii]].equals(geom))
+                    self.assertEqual({k:v[ii] for k,v in batch.iteritems()},row)
+                    ctr += 1
+            self.assertEqual(ctr,len(rows))
+            
     def test_calculation_iteration(self):
         field = self.get_field(with_value=True,month_count=2)
         field.variables.add_variable(Variable(value=field.variables['tmax'].value+5,
@@ -1,6 +1,8 @@
 import unittest
 from ocgis.test.base import TestBase
-from ocgis.api.request.nc import NcRequestDataset
+from ocgis.api.request.nc import NcRequestDataset, close_pooled_datasets,\
+    _dataset_pool
+from ocgis import env, constants
 import netCDF4 as nc
 from ocgis.interface.base.crs import WGS84, CFWGS84, CFLambertConformal
 import numpy as np
@@ -13,6 +15,10 @@ from ocgis.exc import EmptySubsetError, ImproperPolygonBoundsError,\
     DimensionNotFound
 import datetime
 from unittest.case import SkipTest
+import os
+import itertools
+from ocgis.interface.nc.temporal import get_date_parts_from_offsets
+from ocgis.api.request.aggregation import get_file_index, _file_index_cache
 
 
 class TestNcRequestDataset(TestBase):
@@ -73,13 +79,160 @@ class TestNcRequestDataset(TestBase):
         
         ds.close()
         
+    def test_load_pooled(self):
+        uri = self.test_data.get_uri('cancm4_tas')
+        env.MAX_OPEN_DATASETS = 1
+        try:
+            rd = NcRequestDataset(variable='tas',uri=uri)
+            field = rd.get()[:,0:10,:,0:5,0:5]
+            ds = rd._open_()
+            ## the dataset is reused and remains open after values are loaded
+            self.assertIs(rd._open_(),ds)
+            self.assertEqual(field.variables['tas'].value.shape,(1,10,1,5,5))
+            self.assertIs(rd._open_(),ds)
+            self.assertEqual(_dataset_pool.keys(),[(uri,)])
+            ## opening another dataset evicts the least recently used
+            rd2 = NcRequestDataset(variable='tasmax',uri=self.test_data.get_uri('cancm4_tasmax_2001'))
+            rd2._open_()
+            self.assertEqual(len(_dataset_pool),1)
+            self.assertIsNot(rd._open_(),ds)
+        finally:
+            close_pooled_datasets()
+            env.reset()
+        
+    def test_load_metadata_cache(self):
+        uri = self.test_data.get_uri('cancm4_tas')
+        env.DIR_METADATA = self._test_dir
+        try:
+            rd = NcRequestDataset(variable='tas',uri=uri)
+            field = rd.get()
+            cached = [f for f in os.listdir(self._test_dir) if f.startswith('ocgis_metadata_')]
+            self.assertEqual(len(cached),1)
+            ## the cached metadata is used without opening the dataset
+            rd2 = NcRequestDataset(variable='tas',uri=uri)
+            def _open_():
+                raise(AssertionError('dataset opened'))
+            rd2._open_ = _open_
+            field2 = rd2.get()
+            self.assertEqual(rd2._source_metadata,rd._source_metadata)
+            self.assertEqual(field2.shape,field.shape)
+            ## an overloaded dimension map has its own entry
+            dimension_map = {'T':'time','Y':'lat','X':'lon'}
+            rd3 = NcRequestDataset(variable='tas',uri=uri,dimension_map=dimension_map)
+            self.assertEqual(rd3.get().shape,field.shape)
+            cached = [f for f in os.listdir(self._test_dir) if f.startswith('ocgis_metadata_')]
+            self.assertEqual(len(cached),2)
+            ## unreadable cache files are replaced
+            path = rd._get_metadata_cache_path_()
+            with open(path,'wb') as f:
+                f.write('not a pickle')
+            rd4 = NcRequestDataset(variable='tas',uri=uri)
+            self.assertEqual(rd4._source_metadata,rd._source_metadata)
+            rd5 = NcRequestDataset(variable='tas',uri=uri)
+            rd5._open_ = _open_
+            self.assertEqual(rd5._source_metadata,rd._source_metadata)
+            ## a new cache format version does not read existing files
+            version = constants.metadata_cache_version
+            try:
+                constants.metadata_cache_version = version+1
+                self.assertNotEqual(rd._get_metadata_cache_path_(),path)
+            finally:
+                constants.metadata_cache_version = version
+        finally:
+            env.reset()
+        
     def test_multifile_load(self):
         uri = self.test_data.get_uri('narccap_pr_wrfg_ncep')
         rd = NcRequestDataset(uri,'pr')
         field = rd.get()
         self.assertEqual(field.temporal.extent_datetime,(datetime.datetime(1981, 1, 1, 0, 0), datetime.datetime(1991, 1, 1, 0, 0)))
         self.assertAlmostEqual(field.temporal.resolution,0.125)
-        
+
+    def test_multifile_load_pruned(self):
+        uri = self.test_data.get_uri('narccap_pr_wrfg_ncep')
+        env.MAX_OPEN_DATASETS = 1
+        try:
+            rd = NcRequestDataset(uri,'pr',time_range=[dt(1982,1,1),dt(1982,12,31)])
+            field = rd.get()[:,:,:,0:5,0:5]
+            value = field.variables['pr'].value
+            ## only the first file is opened to read the time values and subset
+            ds = rd._open_()
+            self.assertEqual(ds._datasets.keys(),[0])
+            mfds = nc.MFDataset(uri)
+            try:
+                idx = field.temporal._src_idx
+                actual = mfds.variables['pr'][idx,0:5,0:5]
+                self.assertNumpyAll(value.reshape(*actual.shape),actual)
+                ## reads spanning files are stitched together
+                boundary = ds.index['lengths'][0]
+                slc = slice(boundary-2,boundary+2)
+                self.assertNumpyAll(ds.variables['pr'][slc,0,0:3],mfds.variables['pr'][slc,0,0:3])
+                self.assertNumpyAll(ds.variables['time'][[0,boundary]],mfds.variables['time'][[0,boundary]])
+                self.assertEqual(ds._datasets.keys(),[0,1])
+            finally:
+                mfds.close()
+        finally:
+            close_pooled_datasets()
+            env.reset()
+
+    def test_multifile_file_index_cache(self):
+        uri = self.test_data.get_uri('narccap_pr_wrfg_ncep')
+        env.DIR_METADATA = self._test_dir
+        _file_index_cache.clear()
+        try:
+            index = get_file_index(uri)
+            cached = [f for f in os.listdir(self._test_dir) if f.startswith('ocgis_file_index_')]
+            self.assertEqual(len(cached),1)
+            ## unreadable cache files are rebuilt and replaced
+            with open(os.path.join(self._test_dir,cached[0]),'wb') as f:
+                f.write('not a pickle')
+            _file_index_cache.clear()
+            ret = get_file_index(uri)
+            self.assertEqual(ret['lengths'],index['lengths'])
+            self.assertNumpyAll(ret['coordinates']['time'],index['coordinates']['time'])
+            _file_index_cache.clear()
+            self.assertEqual(get_file_index(uri)['lengths'],index['lengths'])
+        finally:
+            _file_index_cache.clear()
+            env.reset()
+
+    def test_multifile_load_underscore_attributes(self):
+        ## global and variable attributes starting with an underscore are read
+        ## from the first file
+        uris = []
+        for ii in range(2):
+            path = os.path.join(self._test_dir,'foo_{0}.nc'.format(ii))
+            ds = nc.Dataset(path,'w')
+            try:
+                ds._CoordSysBuilder = 'ucar.nc2.dataset.conv.CF1Convention'
+                ds.createDimension('time')
+                ds.createDimension('lat',3)
+                ds.createDimension('lon',4)
+                time = ds.createVariable('time',float,('time',))
+                time.units = 'days since 2000-01-01'
+                time.calendar = 'standard'
+                time[:] = np.arange(ii*5,ii*5+5)
+                lat = ds.createVariable('lat',float,('lat',))
+                lat[:] = [40,39,38]
+                lon = ds.createVariable('lon',float,('lon',))
+                lon[:] = [-100,-99,-98,-97]
+                foo = ds.createVariable('foo',float,('time','lat','lon'),fill_value=1e20)
+                foo[:] = np.random.rand(5,3,4)
+            finally:
+                ds.close()
+            uris.append(path)
+        rd = NcRequestDataset(uris,'foo')
+        self.assertEqual(rd._source_metadata['dataset']['_CoordSysBuilder'],'ucar.nc2.dataset.conv.CF1Convention')
+        field = rd.get()
+        self.assertEqual(field.shape,(1,10,1,3,4))
+        ds = rd._open_()
+        try:
+            self.assertEqual(ds.variables['foo']._FillValue,1e20)
+            self.assertEqual(ds.getncattr('_CoordSysBuilder'),'ucar.nc2.dataset.conv.CF1Convention')
+        finally:
+            rd._close_(ds)
+            close_pooled_datasets()
+
     def test_load_datetime_slicing(self):
         ref_test = self.test_data['cancm4_tas']
         uri = self.test_data.get_uri('cancm4_tas')
@@ -93,6 +246,38 @@ class TestNcRequestDataset(TestBase):
         self.assertEqual(slced.temporal.value_datetime,np.array([dt(2001,8,28,12)]))
         self.assertNumpyAll(slced.temporal.bounds_datetime,np.array([dt(2001,8,28),dt(2001,8,29)]))
     
+    def test_load_date_parts(self):
+        ## date parts computed from the numeric values match netcdftime
+        values = np.array([0,0.5,31.25,59,365,366.75,1000.125,36524.5])
+        units = ['days since 1850-1-1','hours since 2000-01-01 06:00:00','days since 2000-1-1T00:00:00Z']
+        calendars = ['standard','gregorian','proleptic_gregorian','noleap','365_day','all_leap','360_day']
+        for unit,calendar in itertools.product(units,calendars):
+            if unit.startswith('hours'):
+                ref = values*24
+            else:
+                ref = values
+            parts = get_date_parts_from_offsets(ref,unit,calendar)
+            for row,t in zip(parts,nc.num2date(ref,unit,calendar=calendar)):
+                self.assertEqual(tuple(row[0:6]),(t.year,t.month,t.day,t.hour,t.minute,t.second))
+        ## unsupported calendars and units use netcdftime
+        self.assertIsNone(get_date_parts_from_offsets(values,'days since 1850-1-1','julian'))
+        self.assertIsNone(get_date_parts_from_offsets(values,'months since 1850-1-1','noleap'))
+        self.assertIsNone(get_date_parts_from_offsets(values,'days since 1000-1-1','standard'))
+
+        ref_test = self.test_data['cancm4_tas']
+        uri = self.test_data.get_uri('cancm4_tas')
+        rd = NcRequestDataset(variable=ref_test['variable'],uri=uri)
+        field = rd.get()
+        temporal = field.temporal
+        ## grouping does not require datetime objects for each time step
+        grouped = temporal.get_grouping(['month'])
+        self.assertIsNone(temporal._value_datetime)
+        self.assertEqual(len(grouped.dgroups),12)
+        self.assertEqual(grouped.bounds_datetime[0].tolist(),[dt(2001,1,1),dt(2010,2,1)])
+        self.assertEqual(temporal[30:35].value_date_parts[:,1].tolist(),[1,2,2,2,2])
+        for t,row in zip(nc.num2date(temporal.value,temporal.units,calendar=temporal.calendar),temporal.value_datetime):
+            self.assertEqual(row,dt(t.year,t.month,t.day,t.hour,t.minute,t.second))
+
     def test_load_value_datetime_after_slicing(self):
         ref_test = self.test_data['cancm4_tas']
         uri = self.test_data.get_uri('cancm4_tas')
@@ -132,6 +317,24 @@ class TestNcRequestDataset(TestBase):
         
         ds.close()
         
+    def test_load_hyperslabs(self):
+        uri = self.test_data.get_uri('cancm4_tas')
+        ds = nc.Dataset(uri,'r')
+        overhead = constants.nc_read_overhead
+        try:
+            tidx = np.array([0,1,2,3,400,401,800,3649])
+            to_test = ds.variables['tas'][tidx,3:10,1:5]
+            to_test = np.ma.array(to_test.reshape(1,8,1,7,4),mask=False)
+            ## read as a single block and as separate blocks
+            for read_overhead in [1,10000000]:
+                constants.nc_read_overhead = read_overhead
+                rd = NcRequestDataset(variable='tas',uri=uri)
+                field = rd.get()[:,tidx,:,3:10,1:5]
+                self.assertNumpyAll(field.variables['tas'].value,to_test)
+        finally:
+            constants.nc_read_overhead = overhead
+            ds.close()
+        
     def test_load_time_range(self):
         ref_test = self.test_data['cancm4_tas']
         uri = self.test_data.get_uri('cancm4_tas')
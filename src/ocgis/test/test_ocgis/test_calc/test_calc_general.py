@@ -292,6 +292,24 @@ class TestOcgCalculationEngine(TestBase):
             ## aggregated data should have a (1,1) spatial dimension
             if agg is True:
                 self.assertNumpyAll(value.shape[-2:],(1,1))
+                
+    def test_stream_calc(self):
+        calc = [{'func':'mean','name':'mean'},{'func':'threshold','name':'threshold','kwds':{'operation':'gte','threshold':200}}]
+        calc_grouping = ['month']
+        rets = []
+        for stream_calc in [False,True]:
+            ocgis.env.STREAM_CALC = stream_calc
+            try:
+                rd = self.test_data.get_rd('cancm4_tas')
+                ops = OcgOperations(dataset=rd,geom='state_boundaries',select_ugid=[25],
+                                    calc=calc,calc_grouping=calc_grouping,calc_sample_size=True)
+                rets.append(ops.execute()[25]['tas'])
+            finally:
+                ocgis.env.reset()
+        ## the streamed calculation does not load the complete source values
+        self.assertIsNone(rets[1].variables['mean_tas'].parents['tas']._value)
+        for alias in ['mean_tas','n_mean_tas','threshold_tas','n_threshold_tas']:
+            self.assertNumpyAll(rets[0].variables[alias].value,rets[1].variables[alias].value)
 
 
 #class TestDynamicDailyKernelPercentileThreshold(TestBase):
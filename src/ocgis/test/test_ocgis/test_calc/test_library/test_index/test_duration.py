@@ -8,9 +8,71 @@ import csv
 from ocgis.api.request.base import RequestDataset
 import webbrowser
 from ocgis.test.test_ocgis.test_calc.test_calc_general import AbstractCalcBase
+from ocgis.test.test_base import dev
+from ocgis.util.logging_ocgis import ocgis_lh
+from ocgis.util.helpers import iter_array
+import time
 
 
 class TestDuration(AbstractCalcBase):
+    
+    def test_get_consecutive(self):
+        duration = Duration()
+        values = np.array([[1,5,5,2,5,5,5],
+                           [5,1,5,1,5,1,1],
+                           [1,1,1,1,1,1,1],
+                           [5,5,1,5,5,5,5]],dtype=float).T.reshape(7,2,2)
+        mask = np.zeros(values.shape,dtype=bool)
+        ## masked time steps do not count towards a duration
+        mask[4,1,1] = True
+        values = np.ma.array(values,mask=mask)
+        idx_cell,durations = duration._get_consecutive_(values,4,'gte')
+        ## only a single duration is reported for cells without a series
+        ## longer than one. the third cell has no occurrences.
+        self.assertEqual(idx_cell.tolist(),[0,0,1,2,3,3])
+        self.assertEqual(durations.tolist(),[2,3,1,0,2,3])
+        ret = duration.calculate(values,4,operation='gte',summary='median')
+        self.assertNumpyAll(ret.flatten(),np.ma.array([2.5,1.,0.,2.5],dtype=np.float32))
+        ret = duration.calculate(values,4,operation='gte',summary='std')
+        self.assertNumpyAll(ret.flatten(),np.ma.array([0.5,1.,0.,0.5],dtype=np.float32))
+
+    @dev
+    def test_get_consecutive_benchmark(self):
+        
+        def _get_loop_(values,threshold):
+            ## the previous implementation found the durations separately for
+            ## each grid cell
+            ref = np.arange(0,values.shape[0])
+            arr = values > threshold
+            store = np.zeros(values.shape[-2:],dtype=np.float32).flatten()
+            for ii,(rowidx,colidx) in enumerate(iter_array(values[0,:,:],use_mask=False)):
+                vec = arr[:,rowidx,colidx].reshape(-1)
+                if np.any(np.diff(ref[vec]) == 1):
+                    diff_idx = np.diff(vec)
+                    if diff_idx.shape != ref.shape:
+                        diff_idx = np.append(diff_idx,[False])
+                    split_idx = ref[diff_idx] + 1
+                    splits = np.array_split(vec,split_idx)
+                    store[ii] = np.mean([a.sum() for a in splits if np.all(a)])
+                elif np.any(vec):
+                    store[ii] = 1
+            return(store.reshape(values.shape[-2:]))
+        
+        ## one year of daily values on a 100x100 grid
+        values = np.ma.array(np.random.rand(365,100,100),mask=False)
+        duration = Duration()
+        
+        t1 = time.time()
+        loop = _get_loop_(values,0.5)
+        t_loop = time.time()-t1
+        
+        t1 = time.time()
+        ret = duration.calculate(values,0.5,operation='gt',summary='mean')
+        t_vectorized = time.time()-t1
+        
+        self.assertNumpyAllClose(np.ma.getdata(ret).reshape(loop.shape),loop)
+        ocgis_lh('{0} cells: loop={1:.2f}s vectorized={2:.2f}s speedup={3:.2f}'.format(loop.size,t_loop,t_vectorized,t_loop/t_vectorized),
+                 logger='test.benchmark')
 
     def test_duration(self):
         duration = Duration()
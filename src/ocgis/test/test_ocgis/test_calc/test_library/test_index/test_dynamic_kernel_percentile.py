@@ -7,7 +7,9 @@ import datetime
 import numpy as np
 from ocgis.calc.library.index.dynamic_kernel_percentile import DynamicDailyKernelPercentileThreshold
 from ocgis.test.test_simple.test_simple import nc_scope
-from ocgis.test.test_base import longrunning
+from ocgis.test.test_base import longrunning, dev
+from ocgis.util.logging_ocgis import ocgis_lh
+import time
 
 
 class TestDynamicDailyKernelPercentileThreshold(TestBase):
@@ -56,6 +58,60 @@ class TestDynamicDailyKernelPercentileThreshold(TestBase):
         ret = rr(cday_index,target_cday_index,width)
         self.assertNumpyAll(ret,np.array([363,361,362,0,364]))
     
+    def test_get_daily_percentile(self):
+        ## two years of daily data with a leap day
+        temporal = [datetime.datetime(2003,1,1,12)+datetime.timedelta(days=ii) for ii in range(731)]
+        temporal = np.array(temporal)
+        all_values = np.random.RandomState(1).rand(1,731,1,2,3)
+        all_values = np.ma.array(all_values,mask=False)
+        dperc = DynamicDailyKernelPercentileThreshold.get_daily_percentile(all_values,temporal,10,5)
+        self.assertEqual(dperc.shape,(366,))
+        self.assertEqual(dperc['percentile'].shape,(366,1,1,2,3))
+        self.assertNumpyAll(dperc['index'],np.arange(366))
+        self.assertEqual((dperc['month'][59],dperc['day'][59]),(2,29))
+        ## the window for the first calendar day wraps to the end of the year
+        for target,window in [(0,[(1,1),(1,2),(1,3),(12,30),(12,31)]),
+                              (59,[(2,27),(2,28),(2,29),(3,1),(3,2)])]:
+            select = [(dt.month,dt.day) in window for dt in temporal]
+            ref = np.percentile(all_values[:,np.array(select)],10,axis=1)
+            self.assertNumpyAll(dperc['percentile'][target],ref)
+    
+    @dev
+    def test_get_daily_percentile_benchmark(self):
+        klass = DynamicDailyKernelPercentileThreshold
+        
+        def _get_loop_(all_values,temporal,percentile,width):
+            ## the previous implementation tested the window membership of each
+            ## date separately for each calendar day
+            cday_keys = np.unique([dt.month*100+dt.day for dt in temporal.flat])
+            cday_index = np.arange(cday_keys.shape[0])
+            ret = []
+            for target_cday_index in cday_index:
+                window_days = klass._get_calendar_day_window_(cday_index,target_cday_index,width)
+                select = np.zeros(all_values.shape[1],dtype=bool)
+                for ii,dt in enumerate(temporal.flat):
+                    dt_cday = cday_index[cday_keys == dt.month*100+dt.day]
+                    select[ii] = dt_cday in window_days
+                ret.append(np.percentile(all_values[:,select],percentile,axis=1))
+            return(np.array(ret))
+        
+        ## three years of daily values on a 20x30 grid
+        temporal = [datetime.datetime(2001,1,1,12)+datetime.timedelta(days=ii) for ii in range(1095)]
+        temporal = np.array(temporal)
+        all_values = np.ma.array(np.random.rand(1,1095,1,20,30),mask=False)
+        
+        t1 = time.time()
+        loop = _get_loop_(all_values,temporal,10,5)
+        t_loop = time.time()-t1
+        
+        t1 = time.time()
+        dperc = klass.get_daily_percentile(all_values,temporal,10,5)
+        t_vectorized = time.time()-t1
+        
+        self.assertNumpyAll(dperc['percentile'],loop)
+        ocgis_lh('{0} calendar days: loop={1:.2f}s vectorized={2:.2f}s speedup={3:.2f}'.format(dperc.shape[0],t_loop,t_vectorized,t_loop/t_vectorized),
+                 logger='test.benchmark')
+    
     def test_calculate(self):
         ## daily data for three years is wanted for the test. subset a CMIP5
         ## decadal simulation to use for input into the computation.
@@ -1,5 +1,6 @@
 import unittest
-from ocgis.calc.library.statistics import Mean, FrequencyPercentile
+from ocgis.calc.library.statistics import Mean, FrequencyPercentile, Max, Min,\
+    StandardDeviation, Median
 from ocgis.interface.base.variable import DerivedVariable, Variable
 import numpy as np
 import itertools
@@ -8,6 +9,34 @@ from ocgis.test.test_ocgis.test_interface.test_base.test_field import AbstractTe
 
 class Test(AbstractTestField):
     
+    def test_calculate_segments(self):
+        field = self.get_field(with_value=True,month_count=2)
+        value = field.variables['tmax'].value
+        value.mask = np.random.rand(*value.shape) > 0.8
+        ## a fully masked group for a single cell
+        value.mask[:,0:31,:,0,0] = True
+        for grouping in [['month'],['month','year'],[[1],[2]]]:
+            tgd = field.temporal.get_grouping(grouping)
+            for klass in [Max,Min,Mean,StandardDeviation]:
+                fnc = klass(field=field,tgd=tgd,calc_sample_size=True)
+                self.assertIsNotNone(fnc._get_segments_())
+                ret = fnc.execute()
+                ## compare to the calculation performed for each group
+                fnc = klass(field=field,tgd=tgd,calc_sample_size=True)
+                fnc.calculate_segments = None
+                ret_loop = fnc.execute()
+                for key in ret.keys():
+                    self.assertNumpyAll(ret[key].value.mask,ret_loop[key].value.mask)
+                    self.assertNumpyAllClose(ret[key].value.filled(0),ret_loop[key].value.filled(0))
+                self.assertTrue(ret['{0}_tmax'.format(klass.key)].value.mask[:,0,:,0,0].all())
+        
+        ## segments are not used for overlapping groups or functions without a
+        ## segment calculation
+        tgd = field.temporal.get_grouping([[1,2],[2]])
+        self.assertIsNone(Mean(field=field,tgd=tgd)._get_segments_())
+        tgd = field.temporal.get_grouping(['month'])
+        self.assertIsNone(Median(field=field,tgd=tgd)._get_segments_())
+        
     def test_FrequencyPercentile(self):
         field = self.get_field(with_value=True,month_count=2)
         grouping = ['month']
@@ -0,0 +1,53 @@
+import unittest
+from ocgis.test.base import TestBase
+from ocgis.conv.csv_ import get_formatted_column, OcgDialect
+import numpy as np
+import datetime
+import csv
+from StringIO import StringIO
+from ocgis.test.test_ocgis.test_interface.test_base.test_field import AbstractTestField
+
+
+class Test(TestBase):
+
+    def test_get_formatted_column(self):
+        columns = [np.array([1,2,3]),
+                   np.array([1.0,1e20,0.1]),
+                   np.array([1.0,1e20,0.1],dtype=np.float32),
+                   np.array([None,'foo','a,"b"'],dtype=object),
+                   np.array([datetime.datetime(2000,3,1,12),None,0.1],dtype=object)]
+        for column in columns:
+            buf = StringIO()
+            writer = csv.writer(buf,dialect=OcgDialect)
+            ## a leading field avoids quoting of single empty fields
+            for element in column:
+                writer.writerow(['x',element])
+            formatted = get_formatted_column(column)
+            self.assertEqual(formatted.shape,column.shape)
+            self.assertEqual(''.join(['x,'+f+'\n' for f in formatted]),buf.getvalue())
+
+
+class TestBatchFormatting(AbstractTestField):
+    
+    def test_get_iter_batch_float32_masked(self):
+        ## masked values are filled after formatting so the column keeps the
+        ## float32 representation of the csv module
+        field = self.get_field(with_value=True)
+        variable = field.variables['tmax']
+        value = np.ma.array(variable.value.data.astype(np.float32),mask=False)
+        value.mask[0,0,0,1,:] = True
+        variable._value = value
+        
+        buf = StringIO()
+        writer = csv.writer(buf,dialect=OcgDialect)
+        for row in field.get_iter(add_masked_value=True):
+            writer.writerow(['x',row['value']])
+        formatted = np.concatenate([batch['value'] for _,batch in
+                                    field.get_iter_batch(add_masked_value=True,batch_size=7,formatter=get_formatted_column)])
+        self.assertEqual(''.join(['x,'+f+'\n' for f in formatted]),buf.getvalue())
+        self.assertEqual(sum([f == '1e+20' for f in formatted]),4)
+
+
+if __name__ == "__main__":
+    #import sys;sys.argv = ['', 'Test.testName']
+    unittest.main()
@@ -1,6 +1,6 @@
 import unittest
 from ocgis.interface.base.crs import CoordinateReferenceSystem, WGS84,\
-    CFAlbersEqualArea, CFLambertConformal
+    CFAlbersEqualArea, CFLambertConformal, CFRotatedPole, CFWGS84
 from ocgis.interface.base.dimension.base import VectorDimension
 from ocgis.interface.base.dimension.spatial import SpatialGridDimension,\
     SpatialDimension
@@ -111,6 +111,21 @@ class TestCFLambertConformalConic(TestBase):
         self.assertEqual(crs.map_parameters_values,{u'latitude_of_projection_origin': 47.5, u'longitude_of_central_meridian': -97.0, u'false_easting': 3325000.0, u'false_northing': 2700000.0, 'units': u'm'})
         ds.close()
         
+        
+class TestCFRotatedPole(TestBase):
+    
+    def test_get_transformed_coordinates(self):
+        crs = CFRotatedPole(grid_north_pole_longitude=83.,grid_north_pole_latitude=42.5)
+        ## the rotated origin, pole, and points east and west of the origin
+        rlon = np.array([[0.,0.],[10.,-10.]])
+        rlat = np.array([[0.,90.],[0.,0.]])
+        lon,lat = crs.get_transformed_coordinates(CFWGS84(),rlon,rlat)
+        self.assertEqual(lon.shape,(2,2))
+        self.assertNumpyAllClose(lon,np.array([[-97.,83.],[-82.37229289,-111.62770711]]))
+        self.assertNumpyAllClose(lat,np.array([[47.5,42.5],[46.55846854,46.55846854]]))
+        with self.assertRaises(NotImplementedError):
+            crs.get_transformed_coordinates(crs,rlon,rlat)
+        
 
 if __name__ == "__main__":
     #import sys;sys.argv = ['', 'Test.testName']
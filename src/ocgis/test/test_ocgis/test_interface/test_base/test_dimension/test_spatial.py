@@ -12,6 +12,12 @@ from ocgis.exc import EmptySubsetError, ImproperPolygonBoundsError
 from ocgis.test.base import TestBase
 from ocgis.interface.base.crs import CoordinateReferenceSystem
 from ocgis.interface.base.dimension.base import VectorDimension
+from shapely.geometry.polygon import Polygon
+from shapely.geometry.multipolygon import MultiPolygon
+import itertools
+import time
+from ocgis.test.test_base import dev
+from ocgis.util.logging_ocgis import ocgis_lh
 
 
 class TestSpatialBase(TestBase):
@@ -188,6 +194,52 @@ class TestSpatialDimension(TestSpatialBase):
         with self.assertRaises(EmptySubsetError):
             spdim.get_intersects_masked(Point(1000,1000).buffer(1))
             
+    def test_get_index(self):
+        sdim = self.get_sdim(bounds=True)
+        spdim = sdim.geom.polygon
+        index = spdim.get_index()
+        self.assertEqual(len(index),12)
+        self.assertNumpyAll(index.bounds[0],np.array(spdim.value[0,0].bounds))
+        ## the index is cached
+        self.assertTrue(index is spdim.get_index())
+        ## masking geometries does not change the index
+        msked = spdim.get_intersects_masked(make_poly((37.75,38.25),(-100.25,-99.75)))
+        self.assertTrue(msked.get_index() is index)
+        ## a new index is required if the geometry values change
+        sub = spdim[0:2,0:2]
+        self.assertEqual(len(sub.get_index()),4)
+        
+    def test_get_intersects_source_index(self):
+        ## grids without row and column dimensions are masked using the spatial
+        ## index of the source grid
+        sdim = self.get_sdim(bounds=True)
+        grid = SpatialGridDimension(value=sdim.grid.value.copy(),corners=sdim.grid.corners.copy())
+        index = grid.get_index()
+        self.assertEqual(len(index),12)
+        self.assertNumpyAll(index.bounds[0],np.array(sdim.geom.polygon.value[0,0].bounds))
+        sdim_irregular = SpatialDimension(grid=grid)
+        polys = [make_poly((37.75,38.25),(-100.25,-99.75)),
+                 make_poly((38.5,39.5),(-100.5,-98.5))]
+        for poly in polys:
+            ret = sdim_irregular.get_intersects(poly)
+            actual = self.get_sdim(bounds=True).get_intersects(poly)
+            self.assertNumpyAll(ret.uid.compressed(),actual.uid.compressed())
+            ## the index is built once for all selections
+            self.assertTrue(grid.get_index() is index)
+        
+    def test_get_intersects_masked_multipolygon(self):
+        sdim = self.get_sdim(bounds=True)
+        spdim = sdim.geom.polygon
+        polygon = MultiPolygon([make_poly((37.75,38.25),(-100.25,-99.75)),
+                                make_poly((39.75,40.25),(-97.25,-96.75))])
+        msked = spdim.get_intersects_masked(polygon)
+        self.assertNumpyAll(msked.uid.compressed(),np.array([4,9]))
+        ## geometries touching the selection polygon are masked
+        polygon = MultiPolygon([make_poly((38.5,39.5),(-100.5,-99.5)),
+                                make_poly((39.5,40.5),(-96.5,-95.5))])
+        msked = spdim.get_intersects_masked(polygon)
+        self.assertNumpyAll(msked.uid.compressed(),np.array([5]))
+            
     def test_update_crs(self):
         geoms,properties = self.get_2d_state_boundaries()
         crs = CoordinateReferenceSystem(epsg=4326)
@@ -207,6 +259,22 @@ class TestSpatialDimension(TestSpatialBase):
             self.assertNumpyNotAll(sdim.grid.value,orig)
             self.assertEqual(sdim.grid.row,None)
 
+    def test_update_crs_lazy_geometries(self):
+        to_crs = CoordinateReferenceSystem(epsg=2163)
+        ## the second dimension has geometries constructed before the transformation
+        sdims = [self.get_sdim(bounds=True) for ii in range(2)]
+        sdims[1].geom.polygon.value
+        for sdim in sdims:
+            sdim.crs = CoordinateReferenceSystem(epsg=4326)
+            sdim.update_crs(to_crs)
+        ## geometries are rebuilt from the transformed grid and its corners
+        self.assertIsNone(sdims[0]._geom)
+        self.assertNumpyAllClose(sdims[0].grid.value,sdims[1].grid.value)
+        for target in ['point','polygon']:
+            geoms = [getattr(sdim.geom,target).value.data.flat for sdim in sdims]
+            for geom,ref in zip(*geoms):
+                self.assertTrue(geom.almost_equals(ref))
+
     def test_grid_value(self):
         for b in [True,False]:
             row = self.get_row(bounds=b)
@@ -416,7 +484,97 @@ class TestSpatialGridDimension(TestSpatialBase):
         col = VectorDimension(value=100,name='col')
         grid = SpatialGridDimension(row=row,col=col,name='grid')
         self.assertNumpyAll(grid.value,np.ma.array([[[10]],[[100]]],mask=False))
+        
+    def test_corners(self):
+        sdim = self.get_sdim(bounds=True)
+        corners = sdim.grid.corners
+        self.assertEqual(corners.shape,(2,3,4,4))
+        self.assertNumpyAll(corners[:,0,0,:],np.array([[39.5,40.5,40.5,39.5],[-100.5,-100.5,-99.5,-99.5]]))
+        self.assertFalse(corners.mask.any())
+        ## corners must describe the polygon geometries
+        poly = sdim.geom.polygon.value
+        for idx_row,idx_col in iter_array(poly):
+            coords = zip(corners[1,idx_row,idx_col].tolist(),corners[0,idx_row,idx_col].tolist())
+            self.assertTrue(poly[idx_row,idx_col].equals(Polygon(coords)))
+        ## corners are sliced with the grid
+        self.assertNumpyAll(sdim.grid[1,2:4].corners,corners[:,1:2,2:4,:])
+        
+        sdim = self.get_sdim(bounds=False)
+        self.assertIsNone(sdim.grid.corners)
+        
+    def test_get_intersects_mask(self):
+        polys = [make_poly((37.75,38.25),(-100.25,-99.75)),
+                 make_poly((38.5,39.5),(-100.5,-98.5)),
+                 Point(-99,39).buffer(1.2),
+                 Point(-99,39).buffer(2).difference(Point(-99,39).buffer(0.5)),
+                 make_poly((37,41),(-101,-96))]
+        for b,poly in itertools.product([True,False],polys):
+            sdim = self.get_sdim(bounds=b)
+            mask = sdim.grid.get_intersects_mask(poly)
+            ## the mask must match the mask computed from the geometries
+            if b:
+                target = sdim.geom.polygon
+            else:
+                target = sdim.geom.point
+            to_test = target.get_intersects_masked(poly).value.mask
+            self.assertNumpyAll(mask,to_test)
+
+        ## grids without row and column dimensions are not supported
+        sdim = self.get_sdim(bounds=False)
+        grid = SpatialGridDimension(value=sdim.grid.value)
+        self.assertIsNone(grid.get_intersects_mask(polys[0]))
 
+    def test_polygon_construction(self):
+        ## polygons constructed from the grid corners match polygons constructed
+        ## cell-by-cell from the row and column bounds
+        value = np.linspace(-100,-91,10)
+        half = (value[1]-value[0])/2.0
+        bounds = np.array([value-half,value+half]).T
+        row = VectorDimension(value=value,bounds=bounds,name='row')
+        col = VectorDimension(value=value,bounds=bounds[:,::-1],name='col')
+        grid = SpatialGridDimension(row=row,col=col)
+        polygons = SpatialGeometryPolygonDimension(grid=grid).value
+        self.assertEqual(polygons.shape,(10,10))
+        for idx_row,idx_col in itertools.product(range(10),range(10)):
+            row_min,row_max = row.bounds[idx_row,:].min(),row.bounds[idx_row,:].max()
+            col_min,col_max = col.bounds[idx_col,:].min(),col.bounds[idx_col,:].max()
+            desired = Polygon([(col_min,row_min),(col_min,row_max),(col_max,row_max),(col_max,row_min)])
+            self.assertTrue(polygons[idx_row,idx_col].equals(desired))
+
+    @dev
+    def test_polygon_construction_benchmark(self):
+        
+        def _get_polygons_loop_(row_bounds,col_bounds):
+            fill = np.empty((row_bounds.shape[0],col_bounds.shape[0]),dtype=object)
+            for idx_row,idx_col in itertools.product(range(row_bounds.shape[0]),range(col_bounds.shape[0])):
+                row_min,row_max = row_bounds[idx_row,:].min(),row_bounds[idx_row,:].max()
+                col_min,col_max = col_bounds[idx_col,:].min(),col_bounds[idx_col,:].max()
+                fill[idx_row,idx_col] = Polygon([(col_min,row_min),(col_min,row_max),(col_max,row_max),(col_max,row_min)])
+            return(fill)
+        
+        for n in [100,1000,4000]:
+            value = np.linspace(-100,-80,n)
+            half = (value[1]-value[0])/2.0
+            bounds = np.array([value-half,value+half]).T
+            row = VectorDimension(value=value,bounds=bounds,name='row')
+            col = VectorDimension(value=value,bounds=bounds,name='col')
+            
+            t1 = time.time()
+            loop = _get_polygons_loop_(row.bounds,col.bounds)
+            t_loop = time.time()-t1
+            corners = [loop[0,0],loop[-1,-1]]
+            del loop
+            
+            grid = SpatialGridDimension(row=row,col=col)
+            t1 = time.time()
+            vectorized = SpatialGeometryPolygonDimension(grid=grid).value
+            t_vectorized = time.time()-t1
+            
+            self.assertEqual(vectorized.shape,(n,n))
+            self.assertTrue(vectorized[0,0].equals(corners[0]))
+            self.assertTrue(vectorized[-1,-1].equals(corners[1]))
+            ocgis_lh('{0}x{0} polygons: loop={1:.2f}s vectorized={2:.2f}s speedup={3:.2f}'.format(n,t_loop,t_vectorized,t_loop/t_vectorized),
+                     logger='test.benchmark')
 
 if __name__ == "__main__":
     #import sys;sys.argv = ['', 'Test.testName']
@@ -2,7 +2,8 @@ from ocgis.test.base import TestBase
 from datetime import datetime as dt
 from ocgis.interface.base.dimension.temporal import TemporalDimension
 import numpy as np
-from ocgis.util.helpers import get_date_list
+from ocgis.util.helpers import get_date_list, get_is_date_between
+from ocgis.exc import EmptySubsetError
 import datetime
 
 
@@ -57,6 +58,29 @@ class TestTemporalDimension(TestBase):
         tg = td.get_grouping([[3,4,5]])
         self.assertEqual(tg.value[0],dt(2005,4,16))
     
+    def test_get_grouping(self):
+        dates = get_date_list(dt(2012,11,1),dt(2013,2,28),1)
+        td = TemporalDimension(value=dates)
+        tg = td.get_grouping(['month','year'])
+        self.assertEqual([tuple(dp)[0:2] for dp in tg.date_parts],[(2012,11),(2012,12),(2013,1),(2013,2)])
+        self.assertNumpyAll(np.bincount(tg.group_index),np.array([30,31,31,28]))
+        self.assertEqual(len(tg.dgroups),4)
+        for idx,dgrp in enumerate(tg.dgroups):
+            self.assertNumpyAll(dgrp,tg.group_index == idx)
+            months = set([d.month for d in td.value[dgrp]])
+            self.assertEqual(months,set([tg.date_parts[idx]['month']]))
+        self.assertNumpyAll(tg.dgroups[-1],tg.dgroups[3])
+        with self.assertRaises(IndexError):
+            tg.dgroups[4]
+        self.assertEqual(tg.bounds[1].tolist(),[dt(2012,12,1),dt(2012,12,31)])
+        
+        ## seasons may overlap in which case group labels are not available
+        tg = td.get_grouping([[12,1],[1,2]])
+        self.assertIsNone(tg.group_index)
+        self.assertNumpyAll(tg.dgroups[0],np.array([d.month in [12,1] for d in dates]))
+        tg = td.get_grouping([[12,1],[2]])
+        self.assertEqual(set(tg.group_index),set([-1,0,1]))
+        
     def test_get_time_region_value_only(self):
         dates = get_date_list(dt(2002,1,31),dt(2009,12,31),1)
         td = TemporalDimension(value=dates)
@@ -76,6 +100,25 @@ class TestTemporalDimension(TestBase):
         
         self.assertEqual(ret.extent,(datetime.datetime(2003,9,20),datetime.datetime(2003,10,31)))
 
+    def test_get_time_region_bounds(self):
+        dates = np.array(get_date_list(dt(2002,1,15),dt(2004,12,15),30))
+        bounds = np.empty((dates.shape[0],2),dtype=object)
+        bounds[:,0] = dates-datetime.timedelta(days=15)
+        bounds[:,1] = dates+datetime.timedelta(days=15)
+        td = TemporalDimension(value=dates,bounds=bounds)
+        for time_region in [{'month':[8]},{'month':[12,1],'year':[2003]},{'year':[2004]}]:
+            ret,indices = td.get_time_region(time_region,return_indices=True)
+            ## time steps are selected if any requested part is between the bounds
+            actual = []
+            for idx,row in enumerate(bounds):
+                check = [any([get_is_date_between(row[0],row[1],**{k:e}) for e in v]) for k,v in time_region.iteritems()]
+                if all(check):
+                    actual.append(idx)
+            self.assertEqual(indices.tolist(),actual)
+            self.assertNumpyAll(ret.value,dates[actual])
+        with self.assertRaises(EmptySubsetError):
+            td.get_time_region({'year':[1999]})
+
 
 class TestTemporalGroupDimension(TestBase):
     
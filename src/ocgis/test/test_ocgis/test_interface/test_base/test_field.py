@@ -15,6 +15,10 @@ from shapely.ops import cascaded_union
 from ocgis.interface.base.variable import Variable, VariableCollection
 from ocgis.interface.base.dimension.temporal import TemporalDimension
 from copy import deepcopy
+from ocgis.test.test_base import dev
+from ocgis.util.logging_ocgis import ocgis_lh
+import time
+from ocgis.util.spatial.weights import SpatialWeights
 
 
 class AbstractTestField(TestBase):
@@ -191,6 +195,27 @@ class TestField(AbstractTestField):
         self.assertEqual(set(real.keys()),set(rows[100].keys()))
         self.assertEqual(set(field.variables['tmax'].value.flatten().tolist()),set([r['value'] for r in rows]))
         
+    def test_get_iter_batch(self):
+        for with_level,add_masked_value in itertools.product([True,False],[True,False]):
+            field = self.get_field(with_value=True,with_level=with_level)
+            value = field.variables['tmax'].value
+            value.mask[0,1,:,0,1] = True
+            field.spatial.grid.value.mask[:,2,3] = True
+            field.spatial.grid.uid.mask[2,3] = True
+            rows = list(field.get_iter(add_masked_value=add_masked_value))
+            batches = list(field.get_iter_batch(add_masked_value=add_masked_value,batch_size=500))
+            self.assertEqual(sum([b['value'].shape[0] for g,b in batches]),len(rows))
+            ## the masked geometry is not in the geometry array
+            self.assertEqual(batches[0][0].shape,(11,))
+            ctr = 0
+            for geoms,batch in batches:
+                self.assertEqual(set(batch.keys()),set(rows[0].keys()+['geom_index'])-set(['geom']))
+                for ii in range(batch['value'].shape[0]):
+                    row = rows[ctr]
+                    self.assertTrue(geoms[batch['geom_index'][ii]].equals(row.pop('geom')))
+                    self.assertEqual({k:v[ii] for k,v in batch.iteritems() if k != 'geom_index'},row)
+                    ctr += 1
+            
     def test_get_intersects_domain_polygon(self):
         regular = make_poly((36.61,41.39),(-101.41,-95.47))
         field = self.get_field(with_value=True)
@@ -264,6 +289,103 @@ class TestField(AbstractTestField):
             
             to_test = field.variables['tmax'].value[0,0,0,:,:].mean()
             self.assertNumpyAll(to_test,agg.variables['tmax'].value[0,0,0,0,0])
+            
+    def test_get_aggregated_masked(self):
+        field = self.get_field(with_value=True)
+        value = field.variables['tmax'].value
+        value.mask[0,0,0,1:,:] = True
+        value.mask[0,1,0,:,:] = True
+        agg = field.get_spatially_aggregated()
+        to_test = agg.variables['tmax'].value
+        self.assertNumpyAll(to_test[0,0,0,0,0],value[0,0,0,0,:].mean())
+        self.assertTrue(to_test.mask[0,1,0,0,0])
+        self.assertEqual(to_test.mask.sum(),1)
+        ## the original geometries are not modified
+        self.assertEqual(field.spatial.geom.polygon.shape,(3,4))
+        self.assertEqual(agg.spatial.geom.polygon.shape,(1,1))
+        
+    def test_iter_spatially_aggregated(self):
+        irregular = wkt.loads('POLYGON((-100.106049 38.211305,-99.286894 38.251591,-99.286894 38.258306,-99.286894 38.258306,-99.260036 39.252035,-98.769886 39.252035,-98.722885 37.734583,-100.092620 37.714440,-100.106049 38.211305))')
+        outside = make_poly((10,11),(10,11))
+        polygons = [irregular,outside,make_poly((37.5,40.5),(-100.5,-96.5))]
+        value = self.get_field(with_value=True).variables['tmax'].value
+        value.mask[0,3,0,1,1] = True
+        for clip in [False,True]:
+            field = self.get_field(with_value=True)
+            field.variables['tmax']._value = value.copy()
+            weights = SpatialWeights.from_spatial(field.spatial,polygons,clip=clip)
+            clip_polygons = polygons if clip else None
+            ret = list(field.iter_spatially_aggregated(weights,[1,2,3],clip_polygons=clip_polygons))
+            self.assertEqual(ret[1],None)
+            for idx in [0,2]:
+                ## the aggregation matches a spatial operation on a new field
+                desired = self.get_field(with_value=True)
+                desired.variables['tmax']._value = value.copy()
+                if clip:
+                    desired = desired.get_clip(polygons[idx])
+                else:
+                    desired = desired.get_intersects(polygons[idx])
+                desired = desired.get_spatially_aggregated(new_spatial_uid=idx+1)
+                self.assertEqual(ret[idx].shape,(2,31,2,1,1))
+                self.assertNumpyAllClose(ret[idx].variables['tmax'].value,desired.variables['tmax'].value)
+                self.assertNumpyAll(ret[idx]._raw.variables['tmax'].value.mask,desired._raw.variables['tmax'].value.mask)
+                self.assertNumpyAll(ret[idx].spatial.uid,desired.spatial.uid)
+                to_test = ret[idx].spatial.geom.polygon.value[0,0]
+                self.assertAlmostEqual(to_test.area,desired.spatial.geom.polygon.value[0,0].area)
+            ## the field's masks are not modified
+            self.assertNumpyAll(field.variables['tmax'].value.mask,value.mask)
+            self.assertFalse(field.spatial.get_mask().any())
+
+    def test_get_spatially_aggregated_weighted_average(self):
+        ## the aggregated values match a weighted average of each spatial slice
+        value = np.linspace(-100,-96,5)
+        bounds = np.array([value-0.5,value+0.5]).T
+        row = VectorDimension(value=value,bounds=bounds,name='row')
+        col = VectorDimension(value=value,bounds=bounds,name='col')
+        spatial = SpatialDimension(grid=SpatialGridDimension(row=row,col=col))
+        temporal = TemporalDimension(value=get_date_list(dt(2000,1,1,12),dt(2000,1,10,12),1),name='time')
+        value = np.ma.array(np.random.RandomState(1).rand(1,temporal.shape[0],1,5,5),mask=False)
+        value.mask[0,1,0,0:2,:] = True
+        value.mask[0,2,0,:,:] = True
+        var = Variable('tas',value=value)
+        field = Field(variables=VariableCollection(variables=var),temporal=temporal,spatial=spatial)
+        weights = field.spatial.weights
+        ret = field.get_spatially_aggregated().variables['tas'].value
+        self.assertEqual(ret.shape,(1,10,1,1,1))
+        for idx_t in range(value.shape[1]):
+            desired = np.ma.average(value[0,idx_t,0],weights=weights)
+            if desired is np.ma.masked:
+                self.assertTrue(ret.mask[0,idx_t,0,0,0])
+            else:
+                self.assertAlmostEqual(ret[0,idx_t,0,0,0],desired)
+
+    @dev
+    def test_get_spatially_aggregated_benchmark(self):
+        ## thirty years of daily values on a 30x30 grid as for an aggregate=True
+        ## request
+        value = np.linspace(-100,-70,30)
+        bounds = np.array([value-0.5,value+0.5]).T
+        row = VectorDimension(value=value,bounds=bounds,name='row')
+        col = VectorDimension(value=value,bounds=bounds,name='col')
+        spatial = SpatialDimension(grid=SpatialGridDimension(row=row,col=col))
+        temporal = TemporalDimension(value=get_date_list(dt(1971,1,1,12),dt(2000,12,31,12),1),name='time')
+        value = np.ma.array(np.random.rand(1,temporal.shape[0],1,30,30),mask=False)
+        var = Variable('tas',value=value)
+        field = Field(variables=VariableCollection(variables=var),temporal=temporal,spatial=spatial)
+        weights = field.spatial.weights
+        
+        ## the previous implementation averaged each spatial slice separately
+        t1 = time.time()
+        loop = [np.ma.average(value[0,idx_t,0],weights=weights) for idx_t in range(value.shape[1])]
+        t_loop = time.time()-t1
+        
+        t1 = time.time()
+        ret = field.get_spatially_aggregated()
+        t_vectorized = time.time()-t1
+        
+        self.assertNumpyAllClose(ret.variables['tas'].value.reshape(-1),np.array(loop))
+        ocgis_lh('{0} slices: loop={1:.2f}s vectorized={2:.2f}s speedup={3:.2f}'.format(value.shape[1],t_loop,t_vectorized,t_loop/t_vectorized),
+                 logger='test.benchmark')
         
     def test_subsetting(self):
         for wv in [True,False]:
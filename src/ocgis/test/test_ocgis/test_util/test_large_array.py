@@ -1,6 +1,10 @@
 from ocgis.test.base import TestBase
 import ocgis
-from ocgis.util.large_array import compute
+from ocgis.util.large_array import compute, get_manifest_path
+from ocgis.util import large_array
+import os
+import json
+import itertools
 import netCDF4 as nc
 import numpy as np
 from ocgis.calc import tile
@@ -53,9 +57,82 @@ class Test(TestBase):
             tile_ds.close()
         std_ds.close()
     
+    @longrunning
+    def test_compute_parallel(self):
+        rd = RequestDatasetCollection(self.test_data.get_rd('cancm4_tasmax_2011'))
+        calc = [{'func':'mean','name':'my_mean'},
+                {'func':'freq_perc','name':'perc_90','kwds':{'percentile':90,}}]
+        calc_grouping = ['month']
+        
+        std_file = compute(rd,calc,calc_grouping,25,prefix='serial')
+        for max_in_flight in [None,1]:
+            tile_file = compute(rd,calc,calc_grouping,25,prefix='parallel_{0}'.format(max_in_flight),
+                                nprocs=3,max_in_flight=max_in_flight)
+            self.assertNcEqual(std_file,tile_file)
+    
+    @longrunning
+    def test_compute_resume(self):
+        rd = RequestDatasetCollection(self.test_data.get_rd('cancm4_tasmax_2011'))
+        calc = [{'func':'mean','name':'my_mean'}]
+        calc_grouping = ['month']
+        std_file = compute(rd,calc,calc_grouping,25,prefix='std')
+        self.assertFalse(os.path.exists(get_manifest_path(std_file)))
+        
+        ## interrupt the run after three tiles are written
+        write_tile = large_array._write_tile_
+        ctr = [0]
+        def _write_tile_(*args):
+            if ctr[0] == 3:
+                raise(KeyboardInterrupt)
+            write_tile(*args)
+            ctr[0] += 1
+        large_array._write_tile_ = _write_tile_
+        try:
+            with self.assertRaises(KeyboardInterrupt):
+                compute(rd,calc,calc_grouping,25,prefix='interrupted')
+        finally:
+            large_array._write_tile_ = write_tile
+        fill_file = os.path.join(self._test_dir,'interrupted','interrupted.nc')
+        with open(get_manifest_path(fill_file),'r') as f:
+            self.assertEqual(json.load(f)['completed'],[0,1,2])
+        
+        ## the tiling must match
+        with self.assertRaises(ValueError):
+            compute(rd,calc,calc_grouping,30,resume=fill_file)
+        ret = compute(rd,calc,calc_grouping,25,resume=fill_file)
+        self.assertEqual(ret,fill_file)
+        self.assertNcEqual(std_file,fill_file)
+        self.assertFalse(os.path.exists(get_manifest_path(fill_file)))
+    
     def get_random_integer(self,low=1,high=100):
         return(int(np.random.random_integers(low,high)))
 
+    def test_tile_get_tile_plan(self):
+        rd = self.test_data.get_rd('cancm4_tasmax_2011')
+        shp = rd.get().shape
+        ## the complete grid fits in memory
+        plan = tile.get_tile_plan(rd,2,1e12)
+        self.assertEqual(plan['tile_dimension'],shp[-2:])
+        self.assertEqual(plan['tile_count'],1)
+        ## the tile memory is limited by the budget
+        for ncalc,budget in itertools.product([1,4],[1e6,5e7]):
+            plan = tile.get_tile_plan(rd,ncalc,budget)
+            self.assertLessEqual(plan['bytes_per_tile'],budget)
+            self.assertEqual(plan['bytes_per_cell'],shp[1]*5*(1+ncalc))
+            schema = tile.get_tile_schema(shp[-2],shp[-1],plan['tile_dimension'])
+            self.assertEqual(len(schema),plan['tile_count'])
+        
+    @longrunning
+    def test_compute_memory_budget(self):
+        rd = RequestDatasetCollection(self.test_data.get_rd('cancm4_tasmax_2011'))
+        calc = [{'func':'mean','name':'my_mean'}]
+        calc_grouping = ['month']
+        std_file = compute(rd,calc,calc_grouping,25,prefix='std')
+        with self.assertRaises(ValueError):
+            compute(rd,calc,calc_grouping,prefix='no_budget')
+        tile_file = compute(rd,calc,calc_grouping,prefix='budget',memory_budget=5e7)
+        self.assertNcEqual(std_file,tile_file)
+        
     def test_tile_get_tile_schema(self):
         schema = tile.get_tile_schema(5,5,2)
         self.assertEqual(len(schema),9)
@@ -63,6 +140,10 @@ class Test(TestBase):
         schema = tile.get_tile_schema(25,1,2)
         self.assertEqual(len(schema),13)
         
+        schema = tile.get_tile_schema(5,5,(5,2))
+        self.assertEqual(len(schema),3)
+        self.assertEqual(schema[2],{'row':[0,5],'col':[4,5]})
+        
     def test_tile_sum(self):
         ntests = 1000
         for ii in range(ntests):
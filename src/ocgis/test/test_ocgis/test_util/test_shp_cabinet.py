@@ -1,7 +1,10 @@
 import unittest
 from ocgis.test.base import TestBase
-from ocgis.util.shp_cabinet import ShpCabinet
+from ocgis.util.shp_cabinet import ShpCabinet, _feature_indices
+from ocgis import env
 from unittest.case import SkipTest
+import os
+import shutil
 
 
 class TestShpCabinet(TestBase):
@@ -20,6 +23,57 @@ class TestShpCabinet(TestBase):
         geoms = list(it)
         self.assertEqual(len(geoms),1)
         self.assertEqual(geoms[0]['properties']['STATE_NAME'],'New Hampshire')
+        ## features are yielded in file order
+        geoms = list(sc.iter_geoms('state_boundaries',select_ugid=[13,1]))
+        self.assertEqual([g['properties']['UGID'] for g in geoms],[1,13])
+        
+    def test_iter_geoms_bbox(self):
+        sc = ShpCabinet()
+        nh = list(sc.iter_geoms('state_boundaries',select_ugid=[13]))[0]['geom']
+        geoms = list(sc.iter_geoms('state_boundaries',bbox=nh.bounds))
+        names = set([g['properties']['STATE_NAME'] for g in geoms])
+        self.assertTrue(set(['New Hampshire','Vermont','Maine']).issubset(names))
+        self.assertTrue(all([g['geom'].envelope.intersects(nh.envelope) for g in geoms]))
+        geoms = list(sc.iter_geoms('state_boundaries',select_ugid=[13,1],bbox=nh.bounds))
+        self.assertEqual(len(geoms),1)
+        
+    def test_get_feature_index(self):
+        sc = ShpCabinet()
+        index = sc.get_feature_index('state_boundaries')
+        self.assertEqual(index['fid'].shape,(51,))
+        self.assertEqual(index['bbox'].shape,(51,4))
+        self.assertEqual(sorted(index['ugid'].tolist()),range(1,52))
+        ## the index is reused until the shapefile changes
+        self.assertIs(sc.get_feature_index('state_boundaries'),index)
+        
+    def test_get_feature_index_cache(self):
+        env.DIR_METADATA = self._test_dir
+        _feature_indices.clear()
+        try:
+            sc = ShpCabinet()
+            index = sc.get_feature_index('state_boundaries')
+            cached = [f for f in os.listdir(self._test_dir) if f.startswith('ocgis_feature_index_')]
+            self.assertEqual(len(cached),1)
+            ## unreadable cache files are rebuilt and replaced
+            with open(os.path.join(self._test_dir,cached[0]),'wb') as f:
+                f.write('not a pickle')
+            _feature_indices.clear()
+            self.assertNumpyAll(sc.get_feature_index('state_boundaries')['fid'],index['fid'])
+            nh = list(sc.iter_geoms('state_boundaries',select_ugid=[13]))
+            self.assertEqual(len(nh),1)
+        finally:
+            _feature_indices.clear()
+            env.reset()
+        
+    def test_keys_refreshed(self):
+        sc = ShpCabinet(path=self._test_dir)
+        self.assertEqual(sc.keys(),[])
+        with self.assertRaises(ValueError):
+            sc.get_shp_path('state_boundaries')
+        src = os.path.split(ShpCabinet().get_shp_path('state_boundaries'))[0]
+        shutil.copytree(src,os.path.join(self._test_dir,'state_boundaries'))
+        self.assertIn('state_boundaries',sc.keys())
+        self.assertTrue(sc.get_shp_path('state_boundaries').startswith(self._test_dir))
             
     def test_iter_all(self):
         raise(SkipTest('dev - long'))
@@ -0,0 +1,42 @@
+import numpy as np
+import itertools
+from ocgis.test.base import TestBase
+from ocgis.util.spatial.index import SpatialIndex
+from shapely.geometry.point import Point
+
+
+class TestSpatialIndex(TestBase):
+    
+    def get_bounds(self,n):
+        np.random.seed(1)
+        lower = np.random.rand(n,2)*100
+        upper = lower+np.random.rand(n,2)*5
+        return(np.hstack((lower,upper)))
+    
+    def test_query(self):
+        index = SpatialIndex([[0,0,1,1],[1,1,2,2],[5,5,6,6]])
+        self.assertEqual(index.query([0.5,0.5,1.5,1.5]).tolist(),[0,1])
+        ## touching boxes are returned
+        self.assertEqual(index.query([2,2,3,3]).tolist(),[1])
+        self.assertEqual(index.query([10,10,11,11]).tolist(),[])
+        
+    def test_query_many(self):
+        queries = self.get_bounds(20)
+        for n,node_capacity in itertools.product([0,1,16,17,500],[2,16]):
+            bounds = self.get_bounds(n)
+            index = SpatialIndex(bounds,node_capacity=node_capacity)
+            self.assertEqual(len(index),n)
+            idx_query,idx_item = index.query_many(queries)
+            actual = zip(idx_query.tolist(),idx_item.tolist())
+            desired = []
+            for ii,jj in itertools.product(range(queries.shape[0]),range(n)):
+                q,b = queries[ii],bounds[jj]
+                if q[0] <= b[2] and q[2] >= b[0] and q[1] <= b[3] and q[3] >= b[1]:
+                    desired.append((ii,jj))
+            self.assertEqual(actual,desired)
+            
+    def test_from_geometries(self):
+        geoms = [Point(1,1),Point(3,3).buffer(1)]
+        index = SpatialIndex.from_geometries(geoms)
+        self.assertNumpyAll(index.bounds,np.array([[1.,1.,1.,1.],[2.,2.,4.,4.]]))
+        self.assertEqual(index.query([0,0,2,2]).tolist(),[0,1])
@@ -0,0 +1,118 @@
+import os
+import numpy as np
+from shapely.geometry import box
+from ocgis.test.base import TestBase
+from ocgis.util.spatial.weights import SpatialWeights, get_spatial_weights
+from ocgis.interface.base.dimension.base import VectorDimension
+from ocgis.interface.base.dimension.spatial import SpatialGridDimension,\
+    SpatialDimension
+from ocgis.interface.base.dimension.temporal import TemporalDimension
+from ocgis.interface.base.variable import Variable, VariableCollection
+from ocgis.interface.base.field import Field
+from ocgis.util.helpers import get_date_list
+from datetime import datetime as dt
+
+
+class TestSpatialWeights(TestBase):
+
+    def get_spatial(self,n=4):
+        value = np.arange(n,dtype=float)
+        bounds = np.array([value-0.5,value+0.5]).T
+        row = VectorDimension(value=value,bounds=bounds,name='row')
+        col = VectorDimension(value=value,bounds=bounds,name='col')
+        return(SpatialDimension(grid=SpatialGridDimension(row=row,col=col)))
+
+    def test_from_spatial(self):
+        spatial = self.get_spatial()
+        ## the second polygon only touches cells and the third is outside the grid
+        polygons = [box(0,0,1.5,0.75),box(1.5,1.5,2.5,2.5),box(10,10,11,11)]
+        sw = SpatialWeights.from_spatial(spatial,polygons)
+        self.assertEqual(len(sw),3)
+        self.assertEqual(sw.shape,(4,4))
+        self.assertNumpyAll(sw.indptr,np.array([0,4,5,5]))
+        self.assertNumpyAll(sw.get_row(0)[0],np.array([0,1,4,5]))
+        self.assertNumpyAll(sw.get_row(0)[1],np.ones(4))
+        self.assertNumpyAll(sw.get_row(1)[0],np.array([10]))
+        self.assertEqual(sw.get_row(2)[0].shape,(0,))
+
+        sw = SpatialWeights.from_spatial(spatial,polygons,clip=True)
+        self.assertNumpyAll(sw.get_row(0)[1],np.array([0.25,0.5,0.125,0.25]))
+
+    def test_get_aggregated(self):
+        spatial = self.get_spatial()
+        polygons = [box(0,0,1.5,0.75),box(10,10,11,11),box(1.5,1.5,2.5,2.5)]
+        sw = SpatialWeights.from_spatial(spatial,polygons,clip=True)
+        value = np.ma.array(np.random.RandomState(1).rand(1,3,1,4,4),mask=False)
+        value.mask[0,1,0,0,0:2] = True
+        value.mask[0,2,0,:,:] = True
+        ret = sw.get_aggregated(value)
+        self.assertEqual(ret.shape,(1,3,1,3))
+        self.assertEqual(ret.dtype,value.dtype)
+        ## empty rows and fully masked values are masked
+        self.assertTrue(ret.mask[:,:,:,1].all())
+        self.assertTrue(ret.mask[0,2].all())
+        self.assertEqual(ret.mask.sum(),5)
+        for idx_t in range(2):
+            for idx_polygon in [0,2]:
+                cells,weights = sw.get_row(idx_polygon)
+                desired = np.ma.average(value[0,idx_t,0].reshape(-1)[cells],weights=weights)
+                self.assertAlmostEqual(ret[0,idx_t,0,idx_polygon],desired)
+
+    def test_get_aggregated_field(self):
+        ## weighted aggregation matches a spatial operation followed by aggregation
+        spatial = self.get_spatial()
+        polygons = [box(0,0,1.5,0.75),box(0.2,0.2,3.1,2.3)]
+        value = np.ma.array(np.random.RandomState(1).rand(1,3,1,4,4),mask=False)
+        value.mask[0,1,0,1,1] = True
+        temporal = TemporalDimension(value=get_date_list(dt(2000,1,1,12),dt(2000,1,3,12),1),name='time')
+        for clip in [False,True]:
+            sw = SpatialWeights.from_spatial(spatial,polygons,clip=clip)
+            ret = sw.get_aggregated(value)
+            for idx_polygon,polygon in enumerate(polygons):
+                var = Variable('tas',value=value.copy())
+                field = Field(variables=VariableCollection(variables=var),temporal=temporal,spatial=self.get_spatial())
+                if clip:
+                    sub = field.get_clip(polygon)
+                else:
+                    sub = field.get_intersects(polygon)
+                desired = sub.get_spatially_aggregated().variables['tas'].value
+                self.assertNumpyAllClose(ret[:,:,:,idx_polygon],desired.reshape(1,3,1))
+
+    def test_save_load(self):
+        spatial = self.get_spatial()
+        polygons = [box(0,0,1.5,0.75),box(10,10,11,11)]
+        sw = SpatialWeights.from_spatial(spatial,polygons)
+        path = os.path.join(self._test_dir,'weights.npz')
+        sw.save(path)
+        loaded = SpatialWeights.load(path)
+        for attr in ['indptr','indices','weights']:
+            self.assertNumpyAll(getattr(loaded,attr),getattr(sw,attr))
+        self.assertEqual(loaded.shape,sw.shape)
+
+    def test_get_spatial_weights(self):
+        spatial = self.get_spatial()
+        polygons = [box(0,0,1.5,0.75),box(1.5,1.5,2.5,2.5)]
+        cache_dir = os.path.join(self._test_dir,'cache')
+        os.mkdir(cache_dir)
+        sw = get_spatial_weights(spatial,polygons,cache_dir=cache_dir)
+        self.assertEqual(len(os.listdir(cache_dir)),1)
+        ## the cached matrix is loaded
+        cached = get_spatial_weights(spatial,polygons,cache_dir=cache_dir)
+        self.assertNumpyAll(cached.indices,sw.indices)
+        self.assertEqual(len(os.listdir(cache_dir)),1)
+        ## different weightings, polygons, and grids are cached separately
+        get_spatial_weights(spatial,polygons,clip=True,cache_dir=cache_dir)
+        get_spatial_weights(spatial,polygons[0:1],cache_dir=cache_dir)
+        get_spatial_weights(self.get_spatial(n=5),polygons,cache_dir=cache_dir)
+        self.assertEqual(len(os.listdir(cache_dir)),4)
+        ## unreadable cache files are recomputed and replaced
+        path = os.path.join(cache_dir,os.listdir(cache_dir)[0])
+        with open(path,'wb') as f:
+            f.write('not an npz')
+        get_spatial_weights(spatial,polygons,cache_dir=cache_dir)
+        get_spatial_weights(spatial,polygons,clip=True,cache_dir=cache_dir)
+        get_spatial_weights(spatial,polygons[0:1],cache_dir=cache_dir)
+        get_spatial_weights(self.get_spatial(n=5),polygons,cache_dir=cache_dir)
+        self.assertEqual(len(os.listdir(cache_dir)),4)
+        for fn in os.listdir(cache_dir):
+            self.assertIsInstance(SpatialWeights.load(os.path.join(cache_dir,fn)),SpatialWeights)
@@ -1,7 +1,7 @@
 #from ocgis.interface.shp import ShpDataset
 import numpy as np
 from ocgis.util.helpers import format_bool, iter_array, validate_time_subset,\
-    get_formatted_slice, get_is_date_between
+    get_formatted_slice, get_is_date_between, get_bounds_from_1d, get_hyperslabs
 import itertools
 from ocgis.test.base import TestBase
 #from ocgis.util.spatial.wrap import Wrapper
@@ -10,6 +10,15 @@ from datetime import datetime as dt
 
 class TestHelpers(TestBase):
     
+    def test_get_bounds_from_1d(self):
+        ret = get_bounds_from_1d(np.array([1.,2.,4.]))
+        self.assertNumpyAll(ret,np.array([[0.5,1.5],[1.5,3.],[3.,5.]]))
+        ret = get_bounds_from_1d(np.array([4.,2.,1.]))
+        self.assertNumpyAll(ret,np.array([[5.,3.],[3.,1.5],[1.5,0.5]]))
+        ## not enough coordinates or not monotonic
+        self.assertIsNone(get_bounds_from_1d(np.array([1.])))
+        self.assertIsNone(get_bounds_from_1d(np.array([1.,3.,2.])))
+    
     def test_get_is_date_between(self):
         lower = dt(1971,1,1)
         upper = dt(2000,2,1)
@@ -47,6 +56,22 @@ class TestHelpers(TestBase):
         ret = get_formatted_slice((1,),1)
         self.assertEqual(ret,slice(1))
     
+    def test_get_hyperslabs(self):
+        idx = np.array([1,2,3,5,40,41])
+        ret = get_hyperslabs(idx,overhead=2)
+        self.assertEqual([r[0] for r in ret],[slice(1,6),slice(40,42)])
+        self.assertNumpyAll(ret[0][1],np.array([0,1,2,4]))
+        self.assertEqual(ret[1][1],None)
+        ## each run is read separately if reading gaps is expensive
+        ret = get_hyperslabs(idx,plane=10,overhead=10)
+        self.assertEqual([r[0] for r in ret],[slice(1,4),slice(5,6),slice(40,42)])
+        self.assertTrue(all([r[1] is None for r in ret]))
+        ## a single read
+        ret = get_hyperslabs(idx,overhead=100)
+        self.assertEqual([r[0] for r in ret],[slice(1,42)])
+        self.assertNumpyAll(idx[0]+ret[0][1],idx)
+        self.assertEqual(get_hyperslabs(np.array([7])),[(slice(7,8),None)])
+        
     def test_validate_time_subset(self):
         time_range = [dt(2000,1,1),dt(2001,1,1)]
         self.assertTrue(validate_time_subset(time_range,{'year':[2000,2001]}))
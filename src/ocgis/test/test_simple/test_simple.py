@@ -1,6 +1,7 @@
 import unittest
 from ocgis.api.operations import OcgOperations
 from ocgis.api.interpreter import OcgInterpreter
+from ocgis.api.subset import SubsetOperation
 import itertools
 import numpy as np
 import datetime
@@ -340,6 +341,47 @@ class TestSimple(TestSimpleBase):
         self.assertEqual(ref.spatial.abstraction_geometry.value.flatten()[0].area,1.0)
         self.assertEqual(ref.variables[self.var].value.flatten().mean(),2.5)
         
+    def test_parallel(self):
+        geom = [{'geom':make_poly((37.5,39.5),(-104.5,-102.5)),'properties':{'UGID':1}},
+                {'geom':make_poly((38,39),(-104,-103)),'properties':{'UGID':2}},
+                {'geom':make_poly((38,40),(-103,-101)),'properties':{'UGID':3}}]
+        kwds = {'geom':geom,'calc':[{'func':'mean','name':'my_mean'}],'calc_grouping':['month']}
+        ret_serial = self.get_ret(kwds=deepcopy(kwds))
+        
+        env.SERIAL = False
+        env.CORES = 2
+        try:
+            ret_parallel = self.get_ret(kwds=deepcopy(kwds))
+        finally:
+            env.reset()
+            
+        self.assertEqual(ret_serial.keys(),ret_parallel.keys())
+        for ugid in ret_serial.keys():
+            self.assertNumpyAll(ret_serial.gvu(ugid,'my_mean_foo'),ret_parallel.gvu(ugid,'my_mean_foo'))
+            self.assertNumpyAll(ret_serial[ugid]['foo'].spatial.uid,ret_parallel[ugid]['foo'].spatial.uid)
+
+        env.SERIAL = False
+        env.CORES = 2
+        env.ORDERED = False
+        try:
+            ret_unordered = self.get_ret(kwds=deepcopy(kwds))
+        finally:
+            env.reset()
+        self.assertEqual(set(ret_serial.keys()),set(ret_unordered.keys()))
+        for ugid in ret_serial.keys():
+            self.assertNumpyAll(ret_serial.gvu(ugid,'my_mean_foo'),ret_unordered.gvu(ugid,'my_mean_foo'))
+
+    def test_parallel_empty_time_subset(self):
+        ## an empty time subset is returned once and not once per selection geometry
+        ds = self.get_dataset(time_range=[datetime.datetime(2900,1,1),datetime.datetime(3100,1,1)])
+        geom = [{'geom':make_poly((37.5,39.5),(-104.5,-102.5)),'properties':{'UGID':1}},
+                {'geom':make_poly((38,39),(-104,-103)),'properties':{'UGID':2}}]
+        ops = OcgOperations(dataset=ds,geom=geom,allow_empty=True)
+        so = SubsetOperation(ops,serial=False,nprocs=2)
+        colls = list(so)
+        self.assertEqual(len(colls),1)
+        self.assertEqual(colls[0][1]['foo'],None)
+        
     def test_empty_intersection(self):
         geom = make_poly((20,25),(-90,-80))
 
@@ -979,6 +1021,23 @@ class TestSimpleMask(TestSimpleBase):
             self.get_ret(kwds={'geom':geom,'output_format':'numpy'})
         ret = self.get_ret(kwds={'geom':geom,'output_format':'numpy','allow_empty':True})
         self.assertTrue(ret[1]['foo'].variables['foo'].value.mask.all())
+
+    def test_empty_mask_stream_calc(self):
+        ## streamed calculations check for masked data as other calculations
+        geom = make_poly((37.762,38.222),(-102.281,-101.754))
+        kwds = {'geom':geom,'output_format':'numpy','calc':[{'func':'mean','name':'mean'}],
+                'calc_grouping':['month']}
+        for stream_calc in [False,True]:
+            env.STREAM_CALC = stream_calc
+            try:
+                with self.assertRaises(exc.MaskedDataError):
+                    self.get_ret(kwds=deepcopy(kwds))
+                kwds_empty = deepcopy(kwds)
+                kwds_empty['allow_empty'] = True
+                ret = self.get_ret(kwds=kwds_empty)
+                self.assertTrue(ret[1]['foo'].variables['mean_foo'].value.mask.all())
+            finally:
+                env.reset()
         
         
 class TestSimple360(TestSimpleBase):
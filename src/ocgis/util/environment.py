@@ -11,6 +11,7 @@ class Environment(object):
         self.DIR_TEST_DATA = EnvParm('DIR_TEST_DATA',None)
         self.SERIAL = EnvParm('SERIAL',True,formatter=self._format_bool_)
         self.CORES = EnvParm('CORES',6,formatter=int)
+        self.ORDERED = EnvParm('ORDERED',True,formatter=self._format_bool_)
         self.MODE = EnvParm('MODE','raw')
         self.PREFIX = EnvParm('PREFIX','ocgis_output')
         self.FILL_VALUE = EnvParm('FILL_VALUE',1e20,formatter=float)
@@ -19,6 +20,12 @@ class Environment(object):
         self.ENABLE_FILE_LOGGING = EnvParm('ENABLE_FILE_LOGGING',True,formatter=self._format_bool_)
         self.DEBUG = EnvParm('DEBUG',False,formatter=self._format_bool_)
         self.DIR_BIN = EnvParm('DIR_BIN',None)
+        self.USE_SPATIAL_WEIGHTS = EnvParm('USE_SPATIAL_WEIGHTS',False,formatter=self._format_bool_)
+        self.DIR_WEIGHTS = EnvParm('DIR_WEIGHTS',None)
+        self.MAX_OPEN_DATASETS = EnvParm('MAX_OPEN_DATASETS',0,formatter=int)
+        self.DIR_METADATA = EnvParm('DIR_METADATA',None)
+        self.STREAM_CALC = EnvParm('STREAM_CALC',False,formatter=self._format_bool_)
+        self.MEMORY_BUDGET = EnvParm('MEMORY_BUDGET',None,formatter=int)
         
         self.ops = None
         self._optimize_store = {}
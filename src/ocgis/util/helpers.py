@@ -1,6 +1,7 @@
 import numpy as np
 import itertools
 from shapely.geometry.polygon import Polygon
+from shapely.geometry.point import Point
 from collections import namedtuple
 import os
 import tempfile
@@ -15,6 +16,10 @@ import sys
 import datetime
 from copy import deepcopy
 from ocgis.util.logging_ocgis import ocgis_lh
+from ocgis import constants
+import logging
+import hashlib
+import cPickle as pickle
 from osgeo.ogr import CreateGeometryFromWkb
 from shapely.wkb import loads as wkb_loads
 import fiona
@@ -86,6 +91,70 @@ def project_shapely_geometry(geom,from_sr,to_sr):
         ret = wkb_loads(ogr_geom.ExportToWkb())
     return(ret)
 
+def get_transformed_geometries(geoms,from_crs,to_crs):
+    '''
+    Transform geometries to another coordinate system. The coordinates of all
+    points, polygons, and multi-polygons are transformed with a single call.
+    Other geometry types are transformed individually.
+    
+    :param geoms: Sequence of shapely geometries.
+    :param from_crs: The source coordinate system.
+    :type from_crs: :class:`ocgis.interface.base.crs.CoordinateReferenceSystem`
+    :param to_crs: The destination coordinate system.
+    :type to_crs: :class:`ocgis.interface.base.crs.CoordinateReferenceSystem`
+    :returns: The transformed geometries.
+    :rtype: list
+    '''
+    ## collect the coordinate sequences of all geometries. the layout stores the
+    ## number of rings for each polygon.
+    rings = []
+    layouts = []
+    for geom in geoms:
+        if isinstance(geom,Point) and not geom.is_empty:
+            layout = [1]
+            rings.append(np.array(geom.coords))
+        elif isinstance(geom,(Polygon,MultiPolygon)) and not geom.is_empty:
+            if isinstance(geom,Polygon):
+                polygons = [geom]
+            else:
+                polygons = list(geom)
+            layout = []
+            for polygon in polygons:
+                sub = [polygon.exterior]+list(polygon.interiors)
+                rings += [np.array(ring.coords) for ring in sub]
+                layout.append(len(sub))
+        else:
+            layout = None
+        layouts.append((geom,layout))
+    
+    if len(rings) > 0:
+        lengths = [ring.shape[0] for ring in rings]
+        coords = np.vstack([ring[:,0:2] for ring in rings])
+        x,y = from_crs.get_transformed_coordinates(to_crs,coords[:,0],coords[:,1])
+        rings = np.split(np.column_stack((x,y)),np.cumsum(lengths)[:-1])
+    
+    ret = []
+    idx = 0
+    for geom,layout in layouts:
+        if layout is None:
+            ## fall back to transforming the geometry individually
+            if hasattr(geom,'wkb') and not geom.is_empty:
+                geom = project_shapely_geometry(geom,from_crs.sr,to_crs.sr)
+        elif isinstance(geom,Point):
+            geom = Point(rings[idx][0])
+            idx += 1
+        else:
+            polygons = []
+            for nrings in layout:
+                polygons.append(Polygon(rings[idx],rings[idx+1:idx+nrings]))
+                idx += nrings
+            if isinstance(geom,Polygon):
+                geom = polygons[0]
+            else:
+                geom = MultiPolygon(polygons)
+        ret.append(geom)
+    return(ret)
+
 def assert_raise(test,**kwds):
     try:
         assert(test)
@@ -128,6 +197,31 @@ def get_none_or_2d(target):
         ret = np.atleast_2d(target)
     return(ret)
 
+def get_bounds_from_1d(centroids):
+    '''
+    Approximate bounds for monotonic 1-d coordinates using the midpoints between
+    neighboring coordinates. The outer bounds are extrapolated.
+
+    :param centroids: The 1-d coordinates.
+    :type centroids: :class:`numpy.ndarray`
+    :returns: Bounds with shape (n,2) or `None` if the coordinates are not strictly
+     monotonic or there are fewer than two coordinates.
+    :rtype: :class:`numpy.ndarray`
+    '''
+
+    centroids = np.asarray(centroids,dtype=float)
+    if centroids.shape[0] < 2:
+        return(None)
+    diff = np.diff(centroids)
+    if not (np.all(diff > 0) or np.all(diff < 0)):
+        return(None)
+    edges = np.empty(centroids.shape[0]+1,dtype=float)
+    edges[1:-1] = centroids[0:-1]+diff/2.0
+    edges[0] = centroids[0]-diff[0]/2.0
+    edges[-1] = centroids[-1]+diff[-1]/2.0
+    ret = np.column_stack((edges[0:-1],edges[1:]))
+    return(ret)
+
 def get_none_or_slice(target,slc):
     if target is None:
         ret = None
@@ -141,6 +235,46 @@ def get_reduced_slice(arr):
     ret = slice(arr_min,arr_max+1)
     return(ret)
 
+def get_hyperslabs(idx,plane=1,overhead=None):
+    '''
+    Group strictly increasing indices into contiguous slices for reading. Runs of
+    consecutive indices are merged when reading the values in the gap between
+    them is cheaper than a separate read.
+    
+    :param idx: Strictly increasing integer indices.
+    :type idx: :class:`numpy.ndarray`
+    :param int plane: The number of values read for each index.
+    :param int overhead: The cost of a separate read as a number of values.
+     Defaults to :attr:`ocgis.constants.nc_read_overhead`.
+    :returns: Sequence of tuples containing a slice and the indices of the
+     selected values in the sliced block. The indices are `None` if every value
+     in the block is selected.
+    :rtype: list
+    
+    >>> [(s,None if l is None else l.tolist()) for s,l in get_hyperslabs(np.array([1,2,3,5,40,41]),overhead=2)]
+    [(slice(1, 6, None), [0, 1, 2, 4]), (slice(40, 42, None), None)]
+    '''
+    if overhead is None:
+        from ocgis import constants
+        overhead = constants.nc_read_overhead
+    
+    ## the boundaries of runs of consecutive indices
+    breaks = np.where(np.diff(idx) > 1)[0]+1
+    ## runs are merged with the previous run if the gap is cheap to read
+    gaps = idx[breaks]-idx[breaks-1]-1
+    starts = np.concatenate(([0],breaks[gaps*plane >= overhead]))
+    stops = np.concatenate((starts[1:],[idx.shape[0]]))
+    
+    ret = []
+    for start,stop in zip(starts,stops):
+        lower,upper = int(idx[start]),int(idx[stop-1])+1
+        if upper-lower == stop-start:
+            local = None
+        else:
+            local = idx[start:stop]-lower
+        ret.append((slice(lower,upper),local))
+    return(ret)
+
 def get_formatted_slice(slc,n_dims):
     
     def _format_(slc):
@@ -323,6 +457,88 @@ class ProgressBar(object):
         sys.stdout.write("]\n")
         sys.stdout.flush()
 
+def get_file_signature(uri):
+    '''
+    :returns: The modification time and size of a local file or `None` for
+     remote datasets.
+    :rtype: tuple
+    '''
+    try:
+        stat = os.stat(uri)
+        ret = (stat.st_mtime,stat.st_size)
+    except OSError:
+        ret = None
+    return(ret)
+
+def get_cache_path(directory,prefix,key,extension='pkl'):
+    '''
+    :param str directory: The cache directory. If `None`, `None` is returned.
+    :param str prefix: The file name prefix.
+    :param key: An object with a string representation identifying the cached
+     content. It is hashed with :attr:`ocgis.constants.metadata_cache_version`.
+    :param str extension: The file name extension.
+    :rtype: str
+    '''
+    if directory is None:
+        ret = None
+    else:
+        h = hashlib.sha1()
+        h.update(str(constants.metadata_cache_version))
+        h.update(str(key))
+        ret = os.path.join(directory,'{0}_{1}.{2}'.format(prefix,h.hexdigest(),extension))
+    return(ret)
+
+def get_cached(path,build,load=None,save=None):
+    '''
+    Return the object cached at `path`. If the file does not exist or cannot be
+    read, the object is created and written to `path`.
+    
+    :param str path: The cache file path. If `None`, the object is created and
+     not cached.
+    :param build: Callable with no arguments returning the object.
+    :param load: Callable taking a path and returning the object. Defaults to
+     unpickling.
+    :param save: Callable taking the object and a path and writing the object.
+     Defaults to pickling.
+    '''
+    load = load or _load_pickle_
+    save = save or _save_pickle_
+    
+    ret = None
+    if path is not None and os.path.exists(path):
+        ## unreadable cache files are treated as cache misses and are replaced
+        try:
+            ret = load(path)
+        except Exception as e:
+            ocgis_lh(msg='unable to read cache file {0}: {1}'.format(path,e),
+                     logger='helpers',level=logging.WARN)
+    if ret is None:
+        ret = build()
+        if path is not None:
+            write_atomic(path,lambda tmp: save(ret,tmp))
+    return(ret)
+
+def write_atomic(path,write):
+    '''
+    Write a file to a temporary path and rename it to `path` so partially written
+    files are never read.
+    
+    :param str path: The destination path.
+    :param write: Callable taking the temporary path and writing the file.
+    '''
+    tmp = '{0}.{1}.tmp'.format(path,os.getpid())
+    write(tmp)
+    os.rename(tmp,path)
+
+def _load_pickle_(path):
+    with open(path,'rb') as f:
+        ret = pickle.load(f)
+    return(ret)
+
+def _save_pickle_(obj,path):
+    with open(path,'wb') as f:
+        pickle.dump(obj,f,pickle.HIGHEST_PROTOCOL)
+
 def locate(pattern, root=os.curdir, followlinks=True):
     '''Locate all files matching supplied filename pattern in and below
     supplied root directory.'''
@@ -1,28 +1,70 @@
 import ocgis
 from ocgis.calc import tile
 import netCDF4 as nc
-from ocgis.util.helpers import ProgressBar
+from ocgis.util.helpers import ProgressBar, write_atomic
 from ocgis.api.request.base import RequestDatasetCollection
 import numpy as np
+from ocgis.util.logging_ocgis import ocgis_lh
+from multiprocessing import Pool
+from collections import deque
+import time
+import json
+import os
 
 
-def compute(dataset,calc,calc_grouping,tile_dimension,verbose=False,prefix=None):
+## the tile computation arguments used by worker processes. this is set before
+## the process pool is created so the forked workers inherit it and only tile
+## identifiers need to be sent to the workers.
+_parallel_compute_arguments = None
+
+
+def compute(dataset,calc,calc_grouping,tile_dimension=None,verbose=False,prefix=None,
+            nprocs=1,max_in_flight=None,resume=None,memory_budget=None):
     '''
     :type dataset: RequestDatasetCollection
+    :param tile_dimension: The tile dimension. An integer for square tiles or a
+     sequence with the number of rows and columns in a tile. If `None`, the tile
+     shape is planned using the memory budget.
+    :type tile_dimension: int or sequence
+    :param int nprocs: The number of worker processes computing tiles. If greater
+     than one, tiles are computed in a process pool and written to the fill file
+     by the calling process.
+    :param int max_in_flight: The maximum number of tiles computed but not yet
+     written in the parallel case. Defaults to twice the number of processes.
+    :param str resume: Path to the fill file of an interrupted run. Tiles recorded
+     as written in the fill file's manifest are skipped. See :func:`~ocgis.util.large_array.get_manifest_path`.
+    :param int memory_budget: The maximum memory for a tile in bytes used when
+     no tile dimension is provided. Defaults to :attr:`ocgis.env.MEMORY_BUDGET`.
+     See :func:`~ocgis.calc.tile.get_tile_plan`.
     '''
+    global _parallel_compute_arguments
+
     assert(isinstance(dataset,RequestDatasetCollection))
     assert(type(calc) in (list,tuple))
-    
-    tile_dimension = int(tile_dimension)
-    if tile_dimension <= 0:
+
+    if tile_dimension is None:
+        memory_budget = memory_budget or ocgis.env.MEMORY_BUDGET
+        if memory_budget is None:
+            raise(ValueError('"tile_dimension" or a memory budget is required'))
+        tile_dimension = tile.get_tile_plan(dataset[0],len(calc),memory_budget)['tile_dimension']
+        if verbose: print('planned tile dimension: {0}'.format(tile_dimension))
+    try:
+        tile_dimension = [int(t) for t in tile_dimension]
+    except TypeError:
+        tile_dimension = [int(tile_dimension)]*2
+    if min(tile_dimension) <= 0:
         raise(ValueError('"tile_dimension" must be greater than 0'))
-    
+    nprocs = int(nprocs)
+    if nprocs <= 0:
+        raise(ValueError('"nprocs" must be greater than 0'))
+    max_in_flight = max_in_flight or 2*nprocs
+
     orig_oc = ocgis.env.OPTIMIZE_FOR_CALC
     ocgis.env.OPTIMIZE_FOR_CALC = False
-    
+
     try:
-        
-        ## tell the software we are optimizing for calculations   
+
+        ## tell the software we are optimizing for calculations
         ocgis.env.OPTIMIZE_FOR_CALC = True
         ods = dataset[0].get()
 #        ods = NcDataset(request_dataset=dataset[0])
@@ -30,46 +72,61 @@ def compute(dataset,calc,calc_grouping,tile_dimension,verbose=False,prefix=None)
 
         if verbose: print('getting schema...')
         schema = tile.get_tile_schema(shp[0],shp[1],tile_dimension)
-        if verbose: print('getting fill file...')
-        fill_file = ocgis.OcgOperations(dataset=dataset,file_only=True,
-                                      calc=calc,calc_grouping=calc_grouping,
-                                      output_format='nc',prefix=prefix).execute()
+        if resume is None:
+            if verbose: print('getting fill file...')
+            fill_file = ocgis.OcgOperations(dataset=dataset,file_only=True,
+                                          calc=calc,calc_grouping=calc_grouping,
+                                          output_format='nc',prefix=prefix).execute()
+            manifest = {'tile_dimension':tile_dimension,'shape':list(shp),
+                        'variables':_get_variable_shapes_(fill_file),'completed':[]}
+            _write_manifest_(fill_file,manifest)
+        else:
+            fill_file = resume
+            manifest = _get_resume_manifest_(fill_file,tile_dimension,shp)
         if verbose: print('output file is: {0}'.format(fill_file))
+        completed = set(manifest['completed'])
+        tile_ids = [tile_id for tile_id in schema.iterkeys() if tile_id not in completed]
+        lschema = len(tile_ids)
         if verbose:
-            lschema = len(schema)
             print('tile count: {0}'.format(lschema))
+        if nprocs == 1:
+            itr = (_compute_tile_(dataset,calc,calc_grouping,schema,tile_id) for tile_id in tile_ids)
+        else:
+            _parallel_compute_arguments = (dataset,calc,calc_grouping,schema)
+            pool = Pool(processes=nprocs)
+            itr = _iter_parallel_tiles_(pool,tile_ids,max_in_flight)
+        ## only the calling process writes to the fill file. it is opened after the
+        ## workers are forked.
         fds = nc.Dataset(fill_file,'a')
         if verbose:
             progress = ProgressBar('tiles progress')
-        for ctr,indices in enumerate(schema.itervalues(),start=1):
-            row = indices['row']
-            col = indices['col']
-            ret = ocgis.OcgOperations(dataset=dataset,slice=[None,None,None,row,col],
-                                calc=calc,calc_grouping=calc_grouping).execute()
-            for field_map in ret.itervalues():
-                for field in field_map.itervalues():
-                    for alias,variable in field.variables.iteritems():
-                        vref = fds.variables[alias]
-                        if len(vref.shape) == 3:
-                            vref[:,row[0]:row[1],col[0]:col[1]] = np.squeeze(variable.value)
-                        elif len(vref.shape) == 4:
-                            vref[:,:,row[0]:row[1],col[0]:col[1]] = np.squeeze(variable.value)
-                        else:
-                            raise(NotImplementedError(vref.shape))
-                        fds.sync()
-#                        import ipdb;ipdb.set_trace()
-#            for vref,v in iter_variable_values(ret[1],fds):
-#                if len(vref.shape) == 3:
-#                    vref[:,row[0]:row[1],col[0]:col[1]] = v
-#                elif len(vref.shape) == 4:
-#                    vref[:,:,row[0]:row[1],col[0]:col[1]] = v
-#                else:
-#                    raise(NotImplementedError(vref.shape))
-#                fds.sync()
-            if verbose:
-                progress.progress(int((float(ctr)/lschema)*100))
-                
-        fds.close()
+
+        t_start = time.time()
+        ncells = 0
+        try:
+            for ctr,(tile_id,values) in enumerate(itr,start=1):
+                row,col = schema[tile_id]['row'],schema[tile_id]['col']
+                _write_tile_(fds,row,col,values)
+                ## the tile is recorded after its values are synced to disk
+                manifest['completed'].append(tile_id)
+                _write_manifest_(fill_file,manifest)
+                if verbose:
+                    progress.progress(int((float(ctr)/lschema)*100))
+                ## report the throughput in grid cells per second
+                ncells += (row[1]-row[0])*(col[1]-col[0])
+                rate = ncells/max(time.time()-t_start,1e-6)
+                ocgis_lh('tile {0} written ({1} of {2}, {3:.1f} cells/s)'.format(tile_id,ctr,lschema,rate),
+                         'util.large_array')
+        finally:
+            ## close the fill file so an interrupted run may be resumed
+            fds.close()
+            if nprocs > 1:
+                pool.terminate()
+                pool.join()
+                _parallel_compute_arguments = None
+
+        ## the manifest is only needed to resume incomplete runs
+        os.remove(get_manifest_path(fill_file))
     finally:
         ocgis.env.OPTIMIZE_FOR_CALC = orig_oc
     if verbose:
@@ -77,6 +134,91 @@ def compute(dataset,calc,calc_grouping,tile_dimension,verbose=False,prefix=None)
         print('complete.')
     return(fill_file)
 
+def get_manifest_path(fill_file):
+    '''
+    :param str fill_file: Path to the fill file written by :func:`~ocgis.util.large_array.compute`.
+    :returns: Path to the manifest recording the written tiles of an incomplete
+     run. The manifest is removed when the run completes.
+    :rtype: str
+    '''
+    return(fill_file+'.manifest.json')
+
+def _get_resume_manifest_(fill_file,tile_dimension,shp):
+    ## the manifest of an interrupted run. the tiling and the fill file's
+    ## variables must match the manifest.
+    path = get_manifest_path(fill_file)
+    if not os.path.exists(path):
+        raise(ValueError('No tile manifest found for the fill file: {0}'.format(fill_file)))
+    with open(path,'r') as f:
+        manifest = json.load(f)
+    if manifest['tile_dimension'] != tile_dimension or manifest['shape'] != list(shp):
+        msg = 'The tiling does not match the manifest: tile_dimension={0}, shape={1}'
+        raise(ValueError(msg.format(manifest['tile_dimension'],manifest['shape'])))
+    if _get_variable_shapes_(fill_file) != manifest['variables']:
+        raise(ValueError('The variables in the fill file do not match the manifest: {0}'.format(fill_file)))
+    return(manifest)
+
+def _get_variable_shapes_(fill_file):
+    ds = nc.Dataset(fill_file,'r')
+    try:
+        ret = {k:list(v.shape) for k,v in ds.variables.iteritems()}
+    finally:
+        ds.close()
+    return(ret)
+
+def _write_manifest_(fill_file,manifest):
+    
+    def _write_(path):
+        with open(path,'w') as f:
+            json.dump(manifest,f)
+    
+    write_atomic(get_manifest_path(fill_file),_write_)
+
+def _compute_tile_(dataset,calc,calc_grouping,schema,tile_id):
+    ## compute the calculation values for a tile returning the tile identifier
+    ## and a list of (variable alias, value) tuples.
+    row = schema[tile_id]['row']
+    col = schema[tile_id]['col']
+    ret = ocgis.OcgOperations(dataset=dataset,slice=[None,None,None,row,col],
+                              calc=calc,calc_grouping=calc_grouping).execute()
+    values = []
+    for field_map in ret.itervalues():
+        for field in field_map.itervalues():
+            for alias,variable in field.variables.iteritems():
+                values.append((alias,np.squeeze(variable.value)))
+    return(tile_id,values)
+
+def _compute_tile_parallel_(tile_id):
+    ## compute a tile in a worker process. the remaining arguments are inherited
+    ## from the parent process.
+    dataset,calc,calc_grouping,schema = _parallel_compute_arguments
+    return(_compute_tile_(dataset,calc,calc_grouping,schema,tile_id))
+
+def _iter_parallel_tiles_(pool,tile_ids,max_in_flight):
+    ## submit tiles keeping at most max_in_flight computed tiles waiting to be
+    ## written. tiles are yielded in submission order.
+    pending = deque()
+    tile_ids = iter(tile_ids)
+    while True:
+        for tile_id in tile_ids:
+            pending.append(pool.apply_async(_compute_tile_parallel_,(tile_id,)))
+            if len(pending) >= max_in_flight:
+                break
+        if len(pending) == 0:
+            break
+        yield(pending.popleft().get())
+
+def _write_tile_(fds,row,col,values):
+    for alias,value in values:
+        vref = fds.variables[alias]
+        if len(vref.shape) == 3:
+            vref[:,row[0]:row[1],col[0]:col[1]] = value
+        elif len(vref.shape) == 4:
+            vref[:,:,row[0]:row[1],col[0]:col[1]] = value
+        else:
+            raise(NotImplementedError(vref.shape))
+    fds.sync()
+
 #def iter_variable_values(coll,fds):
 #    if type(coll) == CalcCollection:
 #        for variable in coll.variables.iterkeys():
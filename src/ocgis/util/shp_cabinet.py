@@ -9,6 +9,14 @@ from shapely.geometry.polygon import Polygon
 from shapely import wkb
 import fiona
 from ocgis.interface.base.crs import CoordinateReferenceSystem
+import numpy as np
+from ocgis.util.helpers import get_file_signature, get_cache_path, get_cached
+
+
+## cabinet directory indices keyed by cabinet path
+_cabinet_indices = {}
+## shapefile feature indices keyed by shapefile path
+_feature_indices = {}
 
 
 class ShpCabinetIterator(object):
@@ -64,12 +72,7 @@ class ShpCabinet(object):
         
         :rtype: list of str
         """
-        ret = []
-        for dirpath,dirnames,filenames in os.walk(self.path):
-            for fn in filenames:
-                if fn.endswith('shp'):
-                    ret.append(os.path.splitext(fn)[0])
-        return(ret)
+        return(list(self._get_cabinet_index_()['keys']))
     
     def get_meta(self,key):
         path = self.get_shp_path(key)
@@ -82,17 +85,109 @@ class ShpCabinet(object):
     def get_cfg_path(self,key):
         return(self._get_path_(key,ext='cfg'))
     
+    def get_feature_index(self,key):
+        '''
+        Return the feature index of a shapefile. The index is built by reading
+        the shapefile once and is cached in memory and in :attr:`ocgis.env.DIR_METADATA`
+        if it is set. It is rebuilt if the modification time or size of the
+        shapefile or its attribute table changes.
+        
+        :param str key: The shapefile identifier.
+        :returns: A dictionary with the feature identifiers under "fid", the
+         UGID values under "ugid" (`None` if there is no UGID attribute), and the
+         feature bounding boxes as (minx,miny,maxx,maxy) rows under "bbox".
+        :rtype: dict
+        '''
+        shp_path = self.get_shp_path(key)
+        signature = [get_file_signature(p) for p in (shp_path,os.path.splitext(shp_path)[0]+'.dbf')]
+        try:
+            ret = _feature_indices[shp_path]
+            if ret['signature'] != signature:
+                raise(KeyError)
+        except KeyError:
+            if None in signature:
+                cache_path = None
+            else:
+                cache_path = get_cache_path(env.DIR_METADATA,'ocgis_feature_index',
+                                            (os.path.abspath(shp_path),signature))
+            
+            def _build_():
+                ret = self._get_feature_index_(shp_path)
+                ret['signature'] = signature
+                return(ret)
+            
+            ret = get_cached(cache_path,_build_)
+            _feature_indices[shp_path] = ret
+        return(ret)
+    
+    def _get_cabinet_index_(self):
+        ## the shapefile keys and the paths of files by key and extension. the
+        ## index is rebuilt if the modification time of a directory changes.
+        try:
+            ret = _cabinet_indices[self.path]
+            for dirpath,mtime in ret['directories']:
+                if os.stat(dirpath).st_mtime != mtime:
+                    raise(KeyError)
+        except (KeyError,OSError):
+            ret = {'directories':[],'keys':[],'paths':{}}
+            for dirpath,dirnames,filenames in os.walk(self.path):
+                ret['directories'].append((dirpath,os.stat(dirpath).st_mtime))
+                for filename in filenames:
+                    key,ext = os.path.splitext(filename)
+                    if filename.endswith('shp'):
+                        ret['keys'].append(key)
+                    ## the first file found is used
+                    ret['paths'].setdefault((key,ext[1:]),os.path.join(dirpath,filename))
+            _cabinet_indices[self.path] = ret
+        return(ret)
+    
+    def _get_feature_index_(self,shp_path):
+        ds = ogr.Open(shp_path)
+        try:
+            lyr = ds.GetLayerByIndex(0)
+            defn = lyr.GetLayerDefn()
+            names = [defn.GetFieldDefn(ii).GetName() for ii in range(defn.GetFieldCount())]
+            has_ugid = 'UGID' in names
+            fid,ugid,bbox = [],[],[]
+            lyr.ResetReading()
+            for feature in lyr:
+                fid.append(feature.GetFID())
+                if has_ugid:
+                    ugid.append(feature.GetField('UGID'))
+                minx,maxx,miny,maxy = feature.GetGeometryRef().GetEnvelope()
+                bbox.append((minx,miny,maxx,maxy))
+        finally:
+            ds.Destroy()
+            ds = None
+        ret = {'fid':np.array(fid,dtype=int),
+               'ugid':np.array(ugid) if has_ugid else None,
+               'bbox':np.array(bbox,dtype=float).reshape(-1,4)}
+        return(ret)
+    
     def _get_path_(self,key,ext='shp'):
-        ret = None
-        for dirpath,dirnames,filenames in os.walk(self.path):
-            for filename in filenames:
-                if filename.endswith(ext) and os.path.splitext(filename)[0] == key:
-                    ret = os.path.join(dirpath,filename)
-                    return(ret)
+        ret = self._get_cabinet_index_()['paths'].get((key,ext))
         if ret is None:
             raise(ValueError('a shapefile with key "{0}" was not found under the directory: {1}'.format(key,self.path)))
+        return(ret)
+    
+    def _get_select_fids_(self,key,select_ugid,bbox):
+        ## the identifiers of features matching the selection in file order
+        index = self.get_feature_index(key)
+        select = np.ones(index['fid'].shape[0],dtype=bool)
+        if select_ugid is not None:
+            if index['ugid'] is None:
+                raise(ValueError('The shapefile with key "{0}" has no UGID attribute.'.format(key)))
+            select = np.logical_and(select,np.in1d(index['ugid'],select_ugid))
+        if bbox is not None:
+            minx,miny,maxx,maxy = bbox
+            ref = index['bbox']
+            select = np.logical_and(select,ref[:,0] <= maxx)
+            select = np.logical_and(select,ref[:,2] >= minx)
+            select = np.logical_and(select,ref[:,1] <= maxy)
+            select = np.logical_and(select,ref[:,3] >= miny)
+        return(index['fid'][select])
     
-    def iter_geoms(self,key,select_ugid=None):
+    def iter_geoms(self,key,select_ugid=None,bbox=None):
         """Iterate over geometries from a shapefile specified by `key`.
         
         >>> sc = ShpCabinet()
@@ -104,6 +199,9 @@ class ShpCabinet(object):
         :type key: str
         :param select_ugid: Sequence of unique identifiers matching values from the shapefile's UGID attribute.
         :type select_ugid: sequence
+        :param bbox: Only yield features with bounding boxes intersecting this
+         bounding box in the shapefile's coordinate system.
+        :type bbox: sequence of (minx,miny,maxx,maxy)
         :yields: dict
         """
         
@@ -122,15 +220,10 @@ class ShpCabinet(object):
         try:
             lyr = ds.GetLayerByIndex(0)
             lyr.ResetReading()
-            if select_ugid is not None:
-                lyr_name = lyr.GetName()
-                ## format where statement different for singletons
-                if len(select_ugid) == 1:
-                    sql_where = 'UGID = {0}'.format(select_ugid[0])
-                else:
-                    sql_where = 'UGID IN {0}'.format(tuple(select_ugid))
-                sql = 'SELECT * FROM {0} WHERE {1}'.format(lyr_name,sql_where)
-                features = ds.ExecuteSQL(sql)
+            if select_ugid is not None or bbox is not None:
+                ## only the selected features are read using the feature index
+                fids = self._get_select_fids_(key,select_ugid,bbox)
+                features = (lyr.GetFeature(int(fid)) for fid in fids)
             else:
                 features = lyr
             
@@ -1,147 +1,150 @@
 import numpy as np
-from shapely.geometry.multipolygon import MultiPolygon
-from ocgis.util.helpers import make_poly
-
-    
-def shapely_grid(dim,rtup,ctup,target=None):
-
-    if dim is None:
-        ## construct an average of 10 polygons
-        row_dim = np.ceil(np.abs(rtup[0]-rtup[1])/5.0)
-        col_dim = np.ceil(np.abs(ctup[0]-ctup[1])/5.0)
-        dim = np.mean([row_dim,col_dim])
-        
-    row_bounds = np.arange(rtup[0],rtup[1]+dim,dim)
-    min_row = row_bounds[0:-1]
-    max_row = row_bounds[1:]
-    row_bounds = np.hstack((min_row.reshape(-1,1),max_row.reshape(-1,1)))
-    col_bounds = np.arange(ctup[0],ctup[1]+dim,dim)
-    min_col = col_bounds[0:-1]
-    max_col = col_bounds[1:]
-    col_bounds = np.hstack((min_col.reshape(-1,1),max_col.reshape(-1,1)))
-    polygons = []
-    for ii in range(row_bounds.shape[0]):
-        rtup = (row_bounds[ii,0],row_bounds[ii,1])
-        for jj in range(col_bounds.shape[0]):
-            ctup = (col_bounds[jj,0],col_bounds[jj,1])
-            polygon = make_poly(rtup,ctup)
-            if target is not None and keep(target,polygon):
-                polygons.append(polygon)
-            elif target is None:
-                polygons.append(polygon)
-    
-    return(MultiPolygon(polygons))
-
-
-def build_index_grid(dim,target):
-    bounds = target.bounds
-    rtup = (bounds[1],bounds[3])
-    ctup = (bounds[0],bounds[2])
-    dim = dim if dim is None else float(dim)
-    grid = shapely_grid(dim,rtup,ctup,target=target)
-    return(grid)
-
-def build_index(target,grid):
-    tree = {}
-    for ii,polygon in enumerate(grid):
-        if keep(target,polygon):
-            tree.update({ii:{'box':polygon,'geom':target}})
-    return(tree)
-
-def keep(target,selection):
-    if selection.intersects(target) and not selection.touches(target):
-        ret = True
-    else:
-        ret = False
+
+
+class SpatialIndex(object):
+    '''
+    A packed R-tree constructed from bounding boxes using the Sort-Tile-Recursive
+    (STR) algorithm. The tree is immutable and queried in bulk with arrays of
+    bounding boxes.
+
+    :param bounds: Bounding boxes with shape (n,4) ordered as (minx,miny,maxx,maxy).
+    :type bounds: :class:`numpy.ndarray`
+    :param int node_capacity: Maximum number of children for a tree node.
+
+    >>> index = SpatialIndex([[0,0,1,1],[1,1,2,2],[5,5,6,6]])
+    >>> index.query([0.5,0.5,1.5,1.5]).tolist()
+    [0, 1]
+    '''
+
+    def __init__(self,bounds,node_capacity=16):
+        self.bounds = np.array(bounds,dtype=float).reshape(-1,4)
+        self.node_capacity = int(node_capacity)
+        assert(self.node_capacity > 1)
+
+        self._order = None
+        self._levels = None
+        self._build_()
+
+    def __len__(self):
+        return(self.bounds.shape[0])
+
+    @classmethod
+    def from_geometries(cls,geoms,**kwds):
+        '''
+        :param geoms: Sequence of shapely geometries.
+        :returns: :class:`ocgis.util.spatial.index.SpatialIndex`
+        '''
+        bounds = [geom.bounds for geom in geoms]
+        return(cls(bounds,**kwds))
+
+    def query(self,bounds):
+        '''
+        :param bounds: A bounding box as (minx,miny,maxx,maxy).
+        :returns: Sorted indices of the boxes intersecting `bounds`. Touching boxes
+         are included.
+        :rtype: :class:`numpy.ndarray`
+        '''
+        ret = self.query_many(np.reshape(bounds,(1,4)))[1]
+        ret.sort()
+        return(ret)
+
+    def query_many(self,bounds):
+        '''
+        Query the tree with many bounding boxes at once.
+
+        :param bounds: Bounding boxes with shape (m,4).
+        :returns: Tuple of integer arrays `(idx_query,idx_item)` with each pair
+         identifying an intersecting query and indexed box. Pairs are sorted by
+         query index.
+        :rtype: tuple
+        '''
+        bounds = np.array(bounds,dtype=float).reshape(-1,4)
+        empty = (np.array([],dtype=int),np.array([],dtype=int))
+        if len(self) == 0 or bounds.shape[0] == 0:
+            return(empty)
+
+        ## descend the tree level-by-level keeping all (query,node) pairs with
+        ## intersecting boxes
+        idx_query = np.arange(bounds.shape[0])
+        idx_node = np.zeros(bounds.shape[0],dtype=int)
+        for level in self._levels[::-1]:
+            select = _get_intersects_(bounds[idx_query],level['bounds'][idx_node])
+            idx_query,idx_node = idx_query[select],idx_node[select]
+            if idx_query.shape[0] == 0:
+                return(empty)
+            idx_query,idx_node = _get_expanded_(idx_query,level['start'][idx_node],
+                                                level['stop'][idx_node])
+
+        ## idx_node now references positions in the ordered input boxes
+        select = _get_intersects_(bounds[idx_query],self.bounds[self._order[idx_node]])
+        idx_query,idx_item = idx_query[select],self._order[idx_node[select]]
+        sort = np.lexsort((idx_item,idx_query))
+        return(idx_query[sort],idx_item[sort])
+
+    def _build_(self):
+        n = len(self)
+        if n == 0:
+            self._order = np.array([],dtype=int)
+            self._levels = []
+            return
+
+        ## order the input boxes and pack them into leaf nodes
+        order = _get_str_order_(self.bounds,self.node_capacity)
+        self._order = order
+        level = _get_packed_level_(self.bounds[order],self.node_capacity)
+        levels = [level]
+
+        ## pack the nodes until a single root node remains
+        while level['bounds'].shape[0] > 1:
+            ## nodes keep their child ranges when reordered
+            order = _get_str_order_(level['bounds'],self.node_capacity)
+            for key in ('bounds','start','stop'):
+                level[key] = level[key][order]
+            level = _get_packed_level_(level['bounds'],self.node_capacity)
+            levels.append(level)
+        self._levels = levels
+
+
+def _get_expanded_(idx_query,start,stop):
+    ## expand each query and range pair into one pair per range element
+    counts = stop-start
+    idx_query = np.repeat(idx_query,counts)
+    offsets = np.arange(idx_query.shape[0])-np.repeat(np.cumsum(counts)-counts,counts)
+    idx_child = np.repeat(start,counts)+offsets
+    return(idx_query,idx_child)
+
+def _get_intersects_(a,b):
+    ret = a[:,0] <= b[:,2]
+    ret &= a[:,2] >= b[:,0]
+    ret &= a[:,1] <= b[:,3]
+    ret &= a[:,3] >= b[:,1]
     return(ret)
 
-def index_intersects(target,index):
-    ret = False
-    for value in index.itervalues():
-        if target.intersects(value['box']):
-            if keep(target,value['geom']):
-                ret = True
-                break
+def _get_packed_level_(bounds,node_capacity):
+    ## group consecutive children into parent nodes. the parent stores the range
+    ## of its children's positions in the child level.
+    n = bounds.shape[0]
+    lower = np.arange(0,n,node_capacity)
+    upper = np.minimum(lower+node_capacity,n)
+    ret = {'bounds':np.empty((lower.shape[0],4),dtype=float),
+           'start':lower,
+           'stop':upper}
+    ret['bounds'][:,0] = np.minimum.reduceat(bounds[:,0],lower)
+    ret['bounds'][:,1] = np.minimum.reduceat(bounds[:,1],lower)
+    ret['bounds'][:,2] = np.maximum.reduceat(bounds[:,2],lower)
+    ret['bounds'][:,3] = np.maximum.reduceat(bounds[:,3],lower)
     return(ret)
 
-################################################################################
-
-#sc = ShpCabinet()
-
-#geom = sc.get_geom_dict('state_boundaries',{'id':[16]})[0]['geom']
-#geom = sc.get_geom_dict('world_countries')
-#geom = union_geom_dicts(geom)[0]['geom']
-#
-##target = Point(-99.77,41.22)
-#target = make_poly((40,41),(-99,-98))
-#
-#dims = np.arange(10,100,10)
-#build_times = []
-#int_times = []
-#for dim in dims.flat:
-#    print(dim)
-#    
-#    t1 = time.time()
-#    grid = build_index_grid(dim,geom)
-#    index = build_index(geom,grid)
-#    t2 = time.time()
-#    build_times.append(t2-t1)
-#    
-#    t1 = time.time()
-#    index_intersects(target,index)
-#    t2 = time.time()
-#    int_times.append(t2-t1)
-#
-#plt.figure(1)
-#plt.subplot(211)
-#plt.plot(dims,build_times)
-#plt.title('build times')
-#
-#plt.subplot(212)
-#plt.plot(dims,int_times)
-#plt.title('intersects times')
-#
-#plt.show()
-
-#print index_intersects(pt,index)
-
-#import ipdb;ipdb.set_trace()
-
-################################################################################
-
-#rtup = (40.0,50.0)
-#ctup = (-120.0,-100.0)
-#dim = 5.0
-#
-#tag = str(datetime.now())
-#target = make_poly(rtup,ctup)
-#grid = shapely_grid(dim,rtup,ctup)
-#index = build_index(target,grid)
-#test_in = make_poly((42.17,43.31),(-118.72,-117.52))
-#test_out = make_poly((41.10,42.81),(-125.56,-123.58))
-#
-#print('in')
-#print(index_intersects(test_in,index))
-#print('out')
-#print(index_intersects(test_out,index))
-#
-#import ipdb;ipdb.set_trace()
-#
-#shapely_to_shp(target,'target_'+tag)
-#shapely_to_shp(grid,'grid_'+tag)
-#shapely_to_shp(test_in,'test_in_'+tag)
-#shapely_to_shp(test_out,'test_out_'+tag)
-
-#sc = ShpCabinet()
-#geom_dict = sc.get_geom_dict('state_boundaries',{'ugid':[25]})
-#geom = geom_dict[0]['geom']
-#bounds = geom.bounds
-#rtup = (bounds[1],bounds[3])
-#ctup = (bounds[0],bounds[2])
-#grid = shapely_grid(1.0,rtup,ctup,target=geom)
-#index = build_index(geom,grid)
-#
-#import ipdb;ipdb.set_trace()
-#
-#shapely_to_shp(geom,'geom_'+tag)
-#shapely_to_shp(grid,'grid_'+tag)
\ No newline at end of file
+def _get_str_order_(bounds,node_capacity):
+    ## sort-tile-recursive: sort by x into vertical slices then sort each slice by y
+    n = bounds.shape[0]
+    n_nodes = int(np.ceil(n/float(node_capacity)))
+    n_slices = int(np.ceil(np.sqrt(n_nodes)))
+    slice_size = n_slices*node_capacity
+    x = bounds[:,0]+bounds[:,2]
+    y = bounds[:,1]+bounds[:,3]
+    order = np.argsort(x,kind='mergesort')
+    slice_id = np.arange(n)//slice_size
+    ## stable sort by slice then y
+    order = order[np.lexsort((y[order],slice_id))]
+    return(order)
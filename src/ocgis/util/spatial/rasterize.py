@@ -0,0 +1,165 @@
+import numpy as np
+from shapely.geometry.polygon import Polygon
+from shapely.geometry.multipolygon import MultiPolygon
+from shapely.prepared import prep
+
+
+def get_rectilinear_intersects_mask(polygon,row_bounds,col_bounds,row_coords,col_coords,get_geom):
+    '''
+    Compute an intersects mask for a rectilinear grid without creating a
+    geometry for every grid cell. The selection polygon's boundary is traced
+    through the cell bounds to find cells it passes through. Only these cells
+    are tested exactly with their geometries. All other cells lie entirely inside
+    or outside the polygon and are classified by a scanline point-in-polygon
+    test on their coordinates.
+
+    A cell is selected if it intersects but does not only touch the polygon.
+
+    :param polygon: The selection geometry.
+    :type polygon: :class:`shapely.geometry.Polygon` or :class:`shapely.geometry.MultiPolygon`
+    :param row_bounds: Row bounds with shape (nrow,2).
+    :type row_bounds: :class:`numpy.ndarray`
+    :param col_bounds: Column bounds with shape (ncol,2).
+    :type col_bounds: :class:`numpy.ndarray`
+    :param row_coords: Row coordinates used for the point-in-polygon test. These
+     must fall within the row bounds.
+    :type row_coords: :class:`numpy.ndarray`
+    :param col_coords: Column coordinates used for the point-in-polygon test.
+     These must fall within the column bounds.
+    :type col_coords: :class:`numpy.ndarray`
+    :param get_geom: Function taking a row and column index and returning the
+     geometry of that cell. Called only for cells crossed by the polygon boundary.
+    :type get_geom: function
+    :returns: Boolean mask with shape (nrow,ncol). `True` values do not intersect
+     the polygon. `None` is returned if the bounds are not monotonic.
+    :rtype: :class:`numpy.ndarray`
+    '''
+
+    row_index = _get_axis_index_(row_bounds)
+    col_index = _get_axis_index_(col_bounds)
+    if row_index is None or col_index is None:
+        return(None)
+
+    segments = _get_segments_(polygon)
+
+    ## split polygon edges so that each piece spans at most a few cells
+    step_x = col_index['width']
+    step_y = row_index['width']
+    segments = _get_densified_segments_(segments,step_x,step_y)
+
+    ## locate the cells crossed by the polygon boundary. a small padding ensures
+    ## cells are not missed due to floating point error during densification.
+    shp = (row_bounds.shape[0],col_bounds.shape[0])
+    candidates = np.zeros(shp,dtype=bool)
+    xmin = np.minimum(segments[:,0],segments[:,2])
+    xmax = np.maximum(segments[:,0],segments[:,2])
+    ymin = np.minimum(segments[:,1],segments[:,3])
+    ymax = np.maximum(segments[:,1],segments[:,3])
+    pad_x = step_x*1e-6
+    pad_y = step_y*1e-6
+    rows_start,rows_stop = _get_index_ranges_(row_index,ymin-pad_y,ymax+pad_y)
+    cols_start,cols_stop = _get_index_ranges_(col_index,xmin-pad_x,xmax+pad_x)
+    select = np.logical_and(rows_start <= rows_stop,cols_start <= cols_stop)
+    rows_start,rows_stop = rows_start[select],rows_stop[select]
+    cols_start,cols_stop = cols_start[select],cols_stop[select]
+    if rows_start.shape[0] > 0:
+        for dr in range((rows_stop-rows_start).max()+1):
+            idx_row = row_index['order'][np.minimum(rows_start+dr,rows_stop)]
+            for dc in range((cols_stop-cols_start).max()+1):
+                idx_col = col_index['order'][np.minimum(cols_start+dc,cols_stop)]
+                candidates[idx_row,idx_col] = True
+
+    ## cells not crossed by the boundary are inside the polygon if their
+    ## coordinate is inside the polygon.
+    inside = _get_scanline_inside_(segments,row_coords,col_coords)
+
+    ## exact test for the cells crossed by the boundary
+    prepared = prep(polygon)
+    for idx_row,idx_col in zip(*np.where(candidates)):
+        geom = get_geom(idx_row,idx_col)
+        inside[idx_row,idx_col] = prepared.intersects(geom) and not polygon.touches(geom)
+
+    return(np.invert(inside))
+
+def _get_axis_index_(bounds):
+    lower = bounds.min(axis=1)
+    upper = bounds.max(axis=1)
+    order = np.argsort(lower,kind='mergesort')
+    lower = lower[order]
+    upper = upper[order]
+    ## binary searches require both the lower and upper bounds to be sorted
+    if np.any(np.diff(upper) < 0):
+        return(None)
+    width = (upper-lower).min()
+    if width <= 0:
+        return(None)
+    return({'order':order,'lower':lower,'upper':upper,'width':width})
+
+def _get_index_ranges_(index,lower,upper):
+    ## the first cell with an upper bound greater than or equal to the lower
+    ## coordinate and the last cell with a lower bound less than or equal to
+    ## the upper coordinate. cells in between have closed intersections.
+    start = np.searchsorted(index['upper'],lower,side='left')
+    stop = np.searchsorted(index['lower'],upper,side='right')-1
+    n = index['order'].shape[0]
+    start = np.minimum(start,n)
+    stop = np.minimum(stop,n-1)
+    return(start,stop)
+
+def _get_segments_(polygon):
+    if isinstance(polygon,Polygon):
+        polygons = [polygon]
+    elif isinstance(polygon,MultiPolygon):
+        polygons = list(polygon)
+    else:
+        raise(NotImplementedError(type(polygon)))
+    segments = []
+    for element in polygons:
+        for ring in [element.exterior]+list(element.interiors):
+            coords = np.array(ring.coords)[:,0:2]
+            segments.append(np.hstack((coords[0:-1],coords[1:])))
+    segments = np.vstack(segments)
+    return(segments)
+
+def _get_densified_segments_(segments,step_x,step_y):
+    dx = segments[:,2]-segments[:,0]
+    dy = segments[:,3]-segments[:,1]
+    nsplit = np.ceil(np.maximum(np.abs(dx)/step_x,np.abs(dy)/step_y)).astype(int)
+    nsplit = np.maximum(nsplit,1)
+    if np.all(nsplit == 1):
+        return(segments)
+    idx_segment = np.repeat(np.arange(segments.shape[0]),nsplit)
+    ## position of the sub-segment within its parent segment
+    offsets = np.arange(idx_segment.shape[0])-np.repeat(np.cumsum(nsplit)-nsplit,nsplit)
+    t_start = offsets.astype(float)/nsplit[idx_segment]
+    t_stop = (offsets+1).astype(float)/nsplit[idx_segment]
+    ref = segments[idx_segment]
+    ref_dx = dx[idx_segment]
+    ref_dy = dy[idx_segment]
+    ret = np.empty_like(ref)
+    ret[:,0] = ref[:,0]+t_start*ref_dx
+    ret[:,1] = ref[:,1]+t_start*ref_dy
+    ret[:,2] = ref[:,0]+t_stop*ref_dx
+    ret[:,3] = ref[:,1]+t_stop*ref_dy
+    ## end points are exact
+    last = offsets == nsplit[idx_segment]-1
+    ret[last,2] = ref[last,2]
+    ret[last,3] = ref[last,3]
+    return(ret)
+
+def _get_scanline_inside_(segments,row_coords,col_coords):
+    x1,y1,x2,y2 = segments[:,0],segments[:,1],segments[:,2],segments[:,3]
+    ## horizontal segments never cross a scanline
+    select = y1 != y2
+    x1,y1,x2,y2 = x1[select],y1[select],x2[select],y2[select]
+    slope = (x2-x1)/(y2-y1)
+
+    inside = np.zeros((row_coords.shape[0],col_coords.shape[0]),dtype=bool)
+    for idx_row,y in enumerate(row_coords):
+        ## half-open crossing rule avoids counting shared vertices twice
+        crosses = (y1 <= y) != (y2 <= y)
+        xs = x1[crosses]+(y-y1[crosses])*slope[crosses]
+        xs.sort()
+        ## a point is inside if an odd number of crossings lie to its left
+        inside[idx_row,:] = np.searchsorted(xs,col_coords,side='left') % 2 == 1
+    return(inside)
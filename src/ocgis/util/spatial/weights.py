@@ -0,0 +1,194 @@
+import hashlib
+import numpy as np
+from shapely.prepared import prep
+from ocgis.util.helpers import get_cache_path, get_cached
+
+
+class SpatialWeights(object):
+    '''
+    A sparse matrix of area weights with a row for each selection polygon and a
+    column for each grid cell. Rows are stored in compressed sparse row format.
+    Cells are identified by their flat index into the grid's (row,column) shape.
+
+    :param indptr: Row pointers with shape (npolygons+1,). The cells of row `i`
+     are `indices[indptr[i]:indptr[i+1]]`.
+    :type indptr: :class:`numpy.ndarray`
+    :param indices: Flat cell indices of the nonzero weights.
+    :type indices: :class:`numpy.ndarray`
+    :param weights: The nonzero weights.
+    :type weights: :class:`numpy.ndarray`
+    :param shape: The grid shape as (nrow,ncol).
+    :type shape: tuple
+
+    >>> sw = SpatialWeights([0,2,3],[0,1,3],[1.,0.5,1.],(2,2))
+    >>> sw.get_row(0)[0].tolist()
+    [0, 1]
+    '''
+
+    def __init__(self,indptr,indices,weights,shape):
+        self.indptr = np.array(indptr,dtype=int)
+        self.indices = np.array(indices,dtype=int)
+        self.weights = np.array(weights,dtype=float)
+        self.shape = tuple([int(s) for s in shape])
+        assert(self.indptr[-1] == self.indices.shape[0] == self.weights.shape[0])
+
+    def __len__(self):
+        return(self.indptr.shape[0]-1)
+
+    @classmethod
+    def from_spatial(cls,spatial,polygons,clip=False):
+        '''
+        Compute the overlap weights between selection polygons and the polygon
+        representation of a spatial dimension. A cell is selected if it intersects
+        but does not only touch the polygon.
+
+        :param spatial: The spatial dimension providing the grid cells.
+        :type spatial: :class:`ocgis.interface.base.dimension.spatial.SpatialDimension`
+        :param polygons: Sequence of selection polygons in the coordinate system
+         of `spatial`.
+        :param bool clip: If `True`, the weights are the areas of the cells clipped
+         by the polygon. Otherwise, the weights are the full cell areas.
+        :rtype: :class:`ocgis.util.spatial.weights.SpatialWeights`
+        '''
+        ref_polygon = spatial.geom.polygon
+        r_value = ref_polygon.value
+        r_data = r_value.data.reshape(-1)
+        r_mask = np.ma.getmaskarray(r_value).reshape(-1)
+
+        idx_polygon,idx_cell = ref_polygon.get_index().query_many([polygon.bounds for polygon in polygons])
+        select = np.invert(r_mask[idx_cell])
+        idx_polygon,idx_cell = idx_polygon[select],idx_cell[select]
+
+        ## the overlap area is zero for cells only touching the polygon
+        prepared = [prep(polygon) for polygon in polygons]
+        weights = np.zeros(idx_cell.shape[0],dtype=float)
+        for ii,(ip,ic) in enumerate(zip(idx_polygon,idx_cell)):
+            geom = r_data[ic]
+            if prepared[ip].intersects(geom):
+                area = polygons[ip].intersection(geom).area
+                if area > 0:
+                    weights[ii] = area if clip else geom.area
+
+        select = weights > 0
+        idx_polygon,idx_cell,weights = idx_polygon[select],idx_cell[select],weights[select]
+        indptr = np.zeros(len(polygons)+1,dtype=int)
+        indptr[1:] = np.cumsum(np.bincount(idx_polygon,minlength=len(polygons)))
+        return(cls(indptr,idx_cell,weights,r_value.shape))
+
+    @classmethod
+    def load(cls,path):
+        '''
+        :param str path: Path to a file written by :meth:`~ocgis.util.spatial.weights.SpatialWeights.save`.
+        :rtype: :class:`ocgis.util.spatial.weights.SpatialWeights`
+        '''
+        data = np.load(path)
+        try:
+            ret = cls(data['indptr'],data['indices'],data['weights'],data['shape'])
+        finally:
+            data.close()
+        return(ret)
+
+    def get_aggregated(self,value):
+        '''
+        Compute the weighted average of the spatial axes for every row of the matrix.
+        Masked values are excluded from the average.
+
+        :param value: Array with shape (realization,time,level,nrow,ncol).
+        :type value: :class:`numpy.ma.MaskedArray`
+        :returns: Array with shape (realization,time,level,npolygons). Polygons
+         without unmasked values are masked.
+        :rtype: :class:`numpy.ma.MaskedArray`
+        '''
+        assert(tuple(value.shape[-2:]) == self.shape)
+        shp = list(value.shape[0:3])
+        r_data = np.ma.getdata(value).reshape(-1,self.shape[0]*self.shape[1])
+        mask = np.ma.getmask(value)
+        if mask is np.ma.nomask or not mask.any():
+            r_unmasked = None
+        else:
+            r_unmasked = np.invert(mask).reshape(r_data.shape)
+
+        numerator = np.zeros((r_data.shape[0],len(self)),dtype=float)
+        denominator = np.zeros(numerator.shape,dtype=float)
+        ## empty rows are skipped by the reduction
+        counts = np.diff(self.indptr)
+        rows = np.where(counts > 0)[0]
+        starts = self.indptr[rows]
+        ## limit the number of gathered values held in memory at once
+        nchunk = max(1,int(1e7/max(1,self.indices.shape[0])))
+        nslices = r_data.shape[0] if rows.shape[0] > 0 else 0
+        for start in range(0,nslices,nchunk):
+            slc = slice(start,start+nchunk)
+            weighted = r_data[slc][:,self.indices]*self.weights
+            ## the denominator is the same for all slices if nothing is masked
+            if r_unmasked is None:
+                denominator[slc,rows] = np.add.reduceat(self.weights,starts)
+            else:
+                unmasked = r_unmasked[slc][:,self.indices]
+                weighted = np.where(unmasked,weighted,0)
+                denominator[slc,rows] = np.add.reduceat(unmasked*self.weights,starts,axis=1)
+            numerator[slc,rows] = np.add.reduceat(weighted,starts,axis=1)
+
+        ## averages without any unmasked and weighted values are masked
+        mask = denominator == 0
+        denominator[mask] = 1
+        ret = np.ma.array(numerator/denominator,mask=mask).astype(value.dtype)
+        ret = ret.reshape(shp+[len(self)])
+        return(ret)
+
+    def get_row(self,idx):
+        '''
+        :param int idx: The row index.
+        :returns: Tuple of flat cell indices and their weights.
+        :rtype: tuple
+        '''
+        slc = slice(self.indptr[idx],self.indptr[idx+1])
+        return(self.indices[slc],self.weights[slc])
+
+    def save(self,path):
+        '''
+        :param str path: Path of the ".npz" file to write.
+        '''
+        with open(path,'wb') as f:
+            np.savez(f,indptr=self.indptr,indices=self.indices,weights=self.weights,
+                     shape=np.array(self.shape))
+
+
+def get_spatial_weights(spatial,polygons,clip=False,cache_dir=None):
+    '''
+    Return the weight matrix for a spatial dimension and selection polygons.
+    If a cache directory is provided, the matrix is read from the cache if
+    present and readable. Otherwise, it is computed and written to the cache.
+
+    :param spatial: The spatial dimension providing the grid cells.
+    :type spatial: :class:`ocgis.interface.base.dimension.spatial.SpatialDimension`
+    :param polygons: Sequence of selection polygons.
+    :param bool clip: See :meth:`~ocgis.util.spatial.weights.SpatialWeights.from_spatial`.
+    :param str cache_dir: Directory holding cached weight matrices.
+    :rtype: :class:`ocgis.util.spatial.weights.SpatialWeights`
+    '''
+    if cache_dir is None:
+        ret = SpatialWeights.from_spatial(spatial,polygons,clip=clip)
+    else:
+        key = get_spatial_weights_key(spatial,polygons,clip=clip)
+        path = get_cache_path(cache_dir,'ocgis_weights',key,extension='npz')
+        ret = get_cached(path,lambda: SpatialWeights.from_spatial(spatial,polygons,clip=clip),
+                         load=SpatialWeights.load,save=SpatialWeights.save)
+    return(ret)
+
+def get_spatial_weights_key(spatial,polygons,clip=False):
+    '''
+    :returns: A hash identifying the grid cells, their mask, the selection
+     polygons, and the weighting.
+    :rtype: str
+    '''
+    grid = spatial.grid
+    corners = grid.corners
+    h = hashlib.sha1()
+    h.update(str(bool(clip)))
+    h.update(str(np.ma.getdata(corners).shape))
+    h.update(np.ascontiguousarray(np.ma.getdata(corners),dtype=float).tostring())
+    h.update(np.ma.getmaskarray(grid.value)[0].tostring())
+    for polygon in polygons:
+        h.update(polygon.wkb)
+    return(h.hexdigest())